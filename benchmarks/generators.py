@@ -0,0 +1,104 @@
+"""Synthetic Prodigy-shaped annotations for benchmarking."""
+from itertools import product
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+ExampleDict = Dict[str, Any]
+TASKS = ("binary", "multiclass", "multilabel")
+
+
+def category_probabilities(n_categories: int, skew: float) -> np.ndarray:
+    """Zipf-like category distribution, p_k ~ 1 / (k + 1) ** skew. A skew of 0 is
+    uniform, larger values make the first categories more and more common."""
+    weights = 1 / np.arange(1, n_categories + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate_examples(
+    task: str = "multiclass",
+    n_examples: int = 1000,
+    n_annotators: int = 5,
+    n_categories: int = 5,
+    overlap: float = 0.5,
+    skew: float = 0.0,
+    agreement: float = 0.8,
+    seed: int = 0,
+) -> List[ExampleDict]:
+    """Generates annotations in the format Prodigy stores them, one example per
+    annotation, with annotators identified by `_session_id`.
+
+    Every example is annotated by one annotator, plus each other annotator with
+    probability `overlap`. Each example has a "true" category drawn with
+    `category_probabilities(n_categories, skew)`, and annotators give it with
+    probability `agreement`, or a random category otherwise. For 'binary' the
+    categories are "accept" and "reject", and for 'multilabel' every category is a
+    label that's selected independently with its probability."""
+    if task not in TASKS:
+        raise ValueError(f"Unknown task '{task}', expected one of {TASKS}")
+    rng = np.random.default_rng(seed)
+    if task == "binary":
+        n_categories = 2
+    labels = [f"LABEL_{k}" for k in range(n_categories)]
+    probabilities = category_probabilities(n_categories, skew)
+
+    # (N x A) mask of who annotated what, with one guaranteed annotator
+    annotated = rng.random((n_examples, n_annotators)) < overlap
+    annotated[np.arange(n_examples), rng.integers(0, n_annotators, n_examples)] = True
+    rows, cols = np.nonzero(annotated)
+    n_annotations = len(rows)
+    agrees = rng.random(n_annotations) < agreement
+    if task == "multilabel":
+        truth = (
+            rng.random((n_examples, n_categories)) < probabilities * n_categories / 2
+        )
+        noise = rng.random((n_annotations, n_categories)) < 0.5
+        selected = np.where(agrees[:, None], truth[rows], noise)
+    else:
+        truth = rng.choice(n_categories, size=n_examples, p=probabilities)
+        noise = rng.integers(0, n_categories, n_annotations)
+        values = np.where(agrees, truth[rows], noise)
+
+    examples = []
+    for i, (row, col) in enumerate(zip(rows.tolist(), cols.tolist())):
+        example = {
+            "text": f"Example {row}",
+            "_input_hash": row,
+            "_task_hash": row,
+            "_session_id": f"annotator-{col}",
+            "_view_id": "classification" if task == "binary" else "choice",
+        }
+        if task == "binary":
+            example["label"] = "LABEL"
+            example["answer"] = "accept" if values[i] == 0 else "reject"
+        else:
+            example["options"] = [{"id": label, "text": label} for label in labels]
+            example["answer"] = "accept"
+            if task == "multiclass":
+                example["accept"] = [labels[values[i]]]
+            else:
+                example["accept"] = [
+                    label for label, s in zip(labels, selected[i]) if s
+                ]
+        examples.append(example)
+    return examples
+
+
+def scaling_grid(
+    base: Dict[str, Any], axes: Dict[str, List[Any]]
+) -> Iterator[Dict[str, Any]]:
+    """Yields `base` once, and then with each value of each axis in `axes`, varying
+    one axis at a time. Use `full_grid` for every combination instead."""
+    yield dict(base)
+    for key, values in axes.items():
+        for value in values:
+            if value != base.get(key):
+                yield {**base, key: value}
+
+
+def full_grid(
+    base: Dict[str, Any], axes: Dict[str, List[Any]]
+) -> Iterator[Dict[str, Any]]:
+    """Yields `base` with every combination of the values in `axes`."""
+    for values in product(*axes.values()):
+        yield {**base, **dict(zip(axes, values))}
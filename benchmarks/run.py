@@ -0,0 +1,232 @@
+"""Times the main stages of calculating agreement on synthetic data.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output new.json --baseline results.json
+
+Results are saved as JSON. With `--baseline`, every timing is compared to the
+stored one for the same task, configuration and stage, and the script exits with
+an error if any stage got slower by more than `--threshold`.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from wasabi import msg, table
+
+from prodigy_iaa.measures import (
+    build_agreement_table,
+    calculate_agreement,
+    calculate_agreement_vectorized,
+)
+from prodigy_iaa.processors import (
+    VALUE_GETTERS,
+    examples_to_codes,
+    examples_to_reliability,
+)
+
+from .generators import TASKS, full_grid, generate_examples, scaling_grid
+
+CONFIG_KEYS = ("n_examples", "n_annotators", "n_categories", "overlap", "skew")
+BASE_CONFIG = {
+    "n_examples": 10_000,
+    "n_annotators": 5,
+    "n_categories": 5,
+    "overlap": 0.5,
+    "skew": 0.0,
+}
+SCALING_AXES = {
+    "n_examples": [1_000, 10_000, 100_000],
+    "n_annotators": [3, 5, 20, 100],
+    "n_categories": [2, 5, 50],
+    "overlap": [0.1, 0.5, 1.0],
+    "skew": [0.0, 2.0],
+}
+QUICK_AXES = {"n_examples": [1_000, 10_000], "n_annotators": [3, 20]}
+# The pure-Python reference implementation is skipped above this many examples
+MAX_REFERENCE_EXAMPLES = 10_000
+
+
+def _value_getter(task: str, examples: List[Dict[str, Any]]) -> Callable:
+    if task == "multilabel":
+        # One label's binary task, the unit of work `iaa_dispatch` repeats per label
+        return partial(
+            VALUE_GETTERS["multilabel"], value=examples[0]["options"][0]["id"]
+        )
+    return VALUE_GETTERS[task]
+
+
+def _iaa_dispatch() -> Optional[Callable]:
+    """`iaa_dispatch` needs prodigy, so it's only benchmarked if it's installed."""
+    try:
+        from prodigy_iaa.recipe import iaa_dispatch
+    except ImportError:
+        return None
+    return iaa_dispatch
+
+
+def stages(
+    task: str, examples: List[Dict[str, Any]]
+) -> Iterator[Tuple[str, Callable[[], Any]]]:
+    """Yields (name, function) for every stage to time on `examples`."""
+    value_getter = _value_getter(task, examples)
+    matrix = examples_to_reliability(examples, value_getter=value_getter)
+    yield "examples_to_reliability", lambda: examples_to_reliability(
+        examples, value_getter=value_getter
+    )
+    yield "examples_to_codes", lambda: examples_to_codes(
+        examples, value_getter=value_getter, sparse=True
+    )
+    if len(matrix) <= MAX_REFERENCE_EXAMPLES:
+        yield "build_agreement_table", lambda: build_agreement_table(matrix)
+        yield "calculate_agreement", lambda: calculate_agreement(matrix)
+    yield "calculate_agreement_vectorized", lambda: calculate_agreement_vectorized(
+        matrix
+    )
+    iaa_dispatch = _iaa_dispatch()
+    if iaa_dispatch is not None:
+        labels = [option["id"] for option in examples[0].get("options", [])]
+
+        def dispatch():
+            with contextlib.redirect_stdout(io.StringIO()):
+                iaa_dispatch(examples, task, VALUE_GETTERS[task], labels, "_session_id")
+
+        yield "iaa_dispatch", dispatch
+
+
+def time_function(function: Callable[[], Any], repeat: int) -> float:
+    """Best wall time of `repeat` runs, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmarks(
+    configs: List[Dict[str, Any]], tasks: List[str], repeat: int = 3, seed: int = 0
+) -> List[Dict[str, Any]]:
+    results = []
+    for task in tasks:
+        for config in configs:
+            examples = generate_examples(task, seed=seed, **config)
+            for stage, function in stages(task, examples):
+                seconds = time_function(function, repeat)
+                result = {"task": task, **config, "stage": stage, "seconds": seconds}
+                result["n_annotations"] = len(examples)
+                results.append(result)
+                print(
+                    f"{task:<10} {stage:<30} {seconds:>9.4f}s  "
+                    + ", ".join(f"{k}={config[k]}" for k in CONFIG_KEYS)
+                )
+    return results
+
+
+def _key(result: Dict[str, Any]) -> Tuple:
+    return (result["task"], result["stage"]) + tuple(result[k] for k in CONFIG_KEYS)
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: List[Dict[str, Any]],
+    threshold: float = 0.25,
+) -> List[Dict[str, Any]]:
+    """Matches results to the `baseline` by task, configuration and stage, and
+    returns the ones slower than the baseline by more than `threshold` (relative)."""
+    baseline_seconds = {_key(result): result["seconds"] for result in baseline}
+    rows = []
+    regressions = []
+    for result in results:
+        before = baseline_seconds.get(_key(result))
+        if before is None:
+            continue
+        ratio = result["seconds"] / before if before else np.inf
+        slower = ratio > 1 + threshold
+        rows.append(
+            (
+                result["task"],
+                result["stage"],
+                ", ".join(f"{k}={result[k]}" for k in CONFIG_KEYS),
+                f"{before:.4f}",
+                f"{result['seconds']:.4f}",
+                f"{ratio:.2f}x" + (" !" if slower else ""),
+            )
+        )
+        if slower:
+            regressions.append({**result, "baseline_seconds": before})
+    header = ("Task", "Stage", "Config", "Baseline (s)", "Now (s)", "Ratio")
+    print(
+        table(rows, header=header, divider=True, aligns=("l", "l", "l", "r", "r", "r"))
+    )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", "-o", help="JSON file to save the results to")
+    parser.add_argument("--baseline", "-b", help="JSON results to compare against")
+    parser.add_argument("--tasks", default=",".join(TASKS), help="Comma separated")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per timing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Relative slowdown compared to the baseline that counts as a regression",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="Only a small grid, e.g. for CI"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Every combination of the grid instead of one axis at a time",
+    )
+    for key in CONFIG_KEYS:
+        parser.add_argument(
+            f"--{key.replace('_', '-')}",
+            type=type(BASE_CONFIG[key]),
+            help=f"Base value of {key} (default: {BASE_CONFIG[key]})",
+        )
+    args = parser.parse_args(argv)
+
+    base = dict(BASE_CONFIG)
+    for key in CONFIG_KEYS:
+        if getattr(args, key) is not None:
+            base[key] = getattr(args, key)
+    axes = QUICK_AXES if args.quick else SCALING_AXES
+    grid = full_grid if args.full else scaling_grid
+    results = run_benchmarks(
+        list(grid(base, axes)), args.tasks.split(","), args.repeat, args.seed
+    )
+    output = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(output, f, indent=2)
+        msg.good(f"Saved {len(results)} timings to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            msg.fail(f"{len(regressions)} stage(s) slower than the baseline", exits=1)
+        msg.good("No regressions compared to the baseline")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
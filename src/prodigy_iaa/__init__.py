@@ -1,4 +1,30 @@
-from .recipe import iaa_datasets, iaa_jsonl, iaa_sessions
-from . import measures, processors, render  # noqa
+import importlib
+from typing import Any
 
-__all__ = ["iaa_datasets", "iaa_sessions", "iaa_jsonl"]
+# Recipes need Prodigy, so they're only imported when first accessed. Everything
+# else (e.g. `prodigy_iaa.measures`) can be used without Prodigy installed.
+RECIPES = (
+    "iaa_datasets",
+    "iaa_sessions",
+    "iaa_jsonl",
+    "iaa_parquet",
+    "iaa_shards",
+    "iaa_watch",
+    "iaa_batch",
+)
+SUBMODULES = ("measures", "processors", "render")
+
+__all__ = list(RECIPES)
+
+
+def __getattr__(name: str) -> Any:
+    if name in RECIPES:
+        recipe = importlib.import_module(".recipe", __name__)
+        return getattr(recipe, name)
+    if name in SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(RECIPES) + list(SUBMODULES))
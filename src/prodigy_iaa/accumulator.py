@@ -0,0 +1,142 @@
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .measures import (
+    N_SCALAR_STATISTICS,
+    Weighting,
+    accumulate_statistics,
+    agreement_from_statistics,
+    format_agreement,
+    split_statistics,
+    weight_matrix,
+)
+
+
+class AgreementAccumulator:
+    """Keeps the sufficient statistics for Percent Agreement, Alpha and AC2 up to
+    date as annotations arrive, e.g. from a Prodigy `update` callback.
+
+    Adding or retracting an annotation only touches the counts of its example, so
+    it costs O(K), and reading the current measures with `stats()` costs O(K^2),
+    no matter how many annotations have been seen. The results are the same as
+    calculating agreement on all current annotations at once.
+
+    Categories are usually known upfront, e.g. the `choice` options of a task or
+    ("accept", "reject") for binary annotations. Without `categories`, they're
+    added as they're seen, which is only possible with 'identity' weighting,
+    since other weightings depend on the full set of categories.
+    """
+
+    def __init__(
+        self,
+        categories: Optional[Iterable[Any]] = None,
+        weighting: Weighting = "identity",
+    ):
+        self._grow = categories is None
+        if self._grow and weighting != "identity":
+            raise ValueError("Categories have to be known upfront for this weighting")
+        self.categories: List[Any] = list(categories or [])
+        self.weights = weight_matrix(self.categories, weighting)
+        self.statistics = np.zeros(N_SCALAR_STATISTICS + 3 * len(self.categories))
+        self._category_index = {c: i for i, c in enumerate(self.categories)}
+        # Per example: category counts and weighted counts (r_ik and r*_ik)
+        self._counts: Dict[Hashable, Tuple[np.ndarray, np.ndarray]] = {}
+        self._annotations: Dict[Tuple[Hashable, Hashable], int] = {}
+        self._annotators: Counter = Counter()
+
+    def __len__(self) -> int:
+        """Number of annotations currently included."""
+        return len(self._annotations)
+
+    def __contains__(self, key: Tuple[Hashable, Hashable]) -> bool:
+        """Whether the `(example_id, annotator_id)` annotation is included."""
+        return key in self._annotations
+
+    def _code(self, value: Optional[Any]) -> int:
+        if value is None:
+            return -1
+        if value not in self._category_index and self._grow:
+            self._add_category(value)
+        try:
+            return self._category_index[value]
+        except KeyError:
+            raise ValueError(
+                f"Unknown category {value!r}, expected one of {self.categories}"
+            )
+
+    def _add_category(self, category: Any) -> None:
+        """Adds an unseen category, with no annotations yet. Examples' counts are
+        padded when they're next updated."""
+        self._category_index[category] = len(self.categories)
+        self.categories.append(category)
+        self.weights = np.eye(len(self.categories))
+        scalars, *blocks = split_statistics(self.statistics, len(self.categories) - 1)
+        self.statistics = np.concatenate(
+            [scalars] + [np.append(block, 0.0) for block in blocks]
+        )
+
+    def _update_example(self, example_id: Hashable, code: int, sign: int) -> None:
+        counts, rbar_k = self._counts.get(example_id, (None, None))
+        if counts is None:
+            counts = np.zeros(len(self.categories))
+            rbar_k = np.zeros(len(self.categories))
+        else:
+            # Categories may have been added since the example was last updated
+            padding = (0, len(self.categories) - len(counts))
+            counts, rbar_k = np.pad(counts, padding), np.pad(rbar_k, padding)
+            accumulate_statistics(
+                self.statistics, counts[None], rbar_k[None], sign=-1.0
+            )
+        counts[code] += sign
+        rbar_k += sign * self.weights[:, code]
+        accumulate_statistics(self.statistics, counts[None], rbar_k[None])
+        if counts.any():
+            self._counts[example_id] = (counts, rbar_k)
+        else:
+            self._counts.pop(example_id, None)
+
+    def add(self, example_id: Hashable, annotator_id: Hashable, value: Any) -> None:
+        """Adds the annotation `value` (a category, or `None` for no value) given by
+        `annotator_id` to `example_id`."""
+        key = (example_id, annotator_id)
+        if key in self._annotations:
+            raise ValueError(
+                f"Annotator {annotator_id!r} already annotated example {example_id!r}"
+            )
+        code = self._code(value)
+        if code >= 0:
+            self._update_example(example_id, code, 1)
+        self._annotations[key] = code
+        self._annotators[annotator_id] += 1
+
+    def remove(self, example_id: Hashable, annotator_id: Hashable) -> None:
+        """Retracts the annotation `annotator_id` gave to `example_id`."""
+        key = (example_id, annotator_id)
+        if key not in self._annotations:
+            raise KeyError(
+                f"Annotator {annotator_id!r} didn't annotate example {example_id!r}"
+            )
+        code = self._annotations.pop(key)
+        if code >= 0:
+            self._update_example(example_id, code, -1)
+        self._annotators[annotator_id] -= 1
+        if not self._annotators[annotator_id]:
+            del self._annotators[annotator_id]
+
+    def update(
+        self,
+        examples: Iterable[Dict[str, Any]],
+        value_getter: Callable[[Dict[str, Any]], Any],
+        annotator_id: str = "_session_id",
+        example_id: str = "_task_hash",
+    ) -> None:
+        """Adds a batch of Prodigy examples, e.g. the answers passed to `update`."""
+        for example in examples:
+            self.add(example[example_id], example[annotator_id], value_getter(example))
+
+    def stats(self) -> Dict[str, Any]:
+        """The current statistics, in the format returned by `calculate_agreement`."""
+        agreement = agreement_from_statistics(self.statistics, self.weights)
+        return format_agreement(agreement, self.categories, len(self._annotators))
@@ -0,0 +1,106 @@
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+
+from .cache import AnnotationColumns
+from .loaders import VALUE_KEYS
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+def _pyarrow():
+    """Imports pyarrow on first use, since it's optional and slow to import."""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "Reading Parquet and Arrow files requires pyarrow: pip install pyarrow"
+        ) from None
+    return pyarrow
+
+
+def read_arrow_table(path: Union[str, Path], columns: List[str]) -> "pyarrow.Table":
+    """Reads `columns` of a Parquet file (by suffix, see `PARQUET_SUFFIXES`) or
+    Arrow IPC (Feather) file, memory-mapped. Columns that the file doesn't have
+    are left out, other columns aren't read at all."""
+    pyarrow = _pyarrow()
+    path = Path(path)
+    if path.suffix in PARQUET_SUFFIXES:
+        names = pyarrow.parquet.read_schema(path, memory_map=True).names
+        present = [column for column in columns if column in names]
+        return pyarrow.parquet.read_table(path, columns=present, memory_map=True)
+    # Arrow IPC is read zero-copy, only the selected columns' pages are touched
+    table = pyarrow.ipc.open_file(pyarrow.memory_map(str(path))).read_all()
+    return table.select([column for column in columns if column in table.column_names])
+
+
+def _encode_column(column: "pyarrow.ChunkedArray") -> Tuple[np.ndarray, list]:
+    """Positions of every value in the vocabulary of the column's distinct values
+    (in order of first appearance, -1 for null), and the vocabulary."""
+    pyarrow = _pyarrow()
+    encoded = pyarrow.compute.dictionary_encode(column).combine_chunks()
+    indices = pyarrow.compute.fill_null(encoded.indices, -1)
+    return (
+        indices.to_numpy(zero_copy_only=False).astype(np.int64),
+        encoded.dictionary.to_pylist(),
+    )
+
+
+def table_to_columns(
+    table: "pyarrow.Table",
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+) -> AnnotationColumns:
+    """Encodes the annotations in an Arrow table, with one row per annotation, as
+    `AnnotationColumns`. Uses Arrow's dictionary encoding on whole columns, so
+    no Python object is created per annotation, only per distinct value."""
+    pyarrow = _pyarrow()
+    for key in (example_id, annotator_id):
+        if key not in table.column_names:
+            raise ValueError(f"Missing column '{key}'")
+        if table[key].null_count:
+            raise ValueError(f"Column '{key}' has missing values")
+    example, examples = _encode_column(table[example_id])
+    annotator, annotators = _encode_column(table[annotator_id])
+    if "answer" in table.column_names:
+        answer, answers = _encode_column(table["answer"])
+    else:
+        answer, answers = np.full(table.num_rows, -1, dtype=np.int64), []
+    if "accept" in table.column_names:
+        accept_lists = table["accept"].combine_chunks()
+        n_accept = pyarrow.compute.fill_null(
+            pyarrow.compute.list_value_length(accept_lists), 0
+        ).to_numpy(zero_copy_only=False)
+        accept, labels = _encode_column(
+            pyarrow.chunked_array([pyarrow.compute.list_flatten(accept_lists)])
+        )
+    else:
+        n_accept = np.zeros(table.num_rows, dtype=np.int64)
+        accept, labels = np.zeros(0, dtype=np.int64), []
+    return AnnotationColumns(
+        examples=examples,
+        annotators=annotators,
+        answers=answers,
+        labels=labels,
+        example=example,
+        annotator=annotator,
+        answer=answer,
+        n_accept=n_accept.astype(np.int64),
+        accept=accept,
+    )
+
+
+def read_arrow_annotations(
+    path: Union[str, Path],
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+) -> AnnotationColumns:
+    """Reads the annotations of a Parquet or Arrow IPC file with one row per
+    annotation, like a Prodigy export, as `AnnotationColumns`. Only the
+    `example_id`, `annotator_id`, `answer` and `accept` columns are read."""
+    table = read_arrow_table(path, [example_id, annotator_id] + list(VALUE_KEYS))
+    return table_to_columns(table, annotator_id=annotator_id, example_id=example_id)
@@ -0,0 +1,244 @@
+import json
+import math
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+from .arrow import read_arrow_annotations
+from .cache import AnnotationColumns, cached_jsonl_annotations, encode_columns
+from .loaders import annotation_keys, read_jsonl_projected
+from .measures import MEASURES, agreement_from_codes, agreement_from_multilabel_codes
+from .processors import (
+    columns_to_codes,
+    columns_to_multilabel_codes,
+    connect_db,
+    datasets_to_annotations,
+)
+
+ManifestEntry = Dict[str, Any]
+BatchRecord = Dict[str, Any]
+
+# Manifest entry types, named after the recipe they run
+BATCH_TYPES = ("datasets", "sessions", "jsonl", "parquet")
+# Entry types that read a file (`path`) instead of datasets
+FILE_TYPES = ("jsonl", "parquet")
+ANNOTATION_TYPES = ("binary", "multiclass", "multilabel")
+
+
+def read_manifest(path: Union[str, Path]) -> List[ManifestEntry]:
+    """Reads a batch manifest, either a JSON list or JSONL with one entry per
+    line. Each entry has a `type` (one of `BATCH_TYPES`), the `datasets` (for
+    "datasets" and "sessions") or `path` (for "jsonl" and "parquet") to read,
+    and the `annotation_type`. Optional keys are `name` (used in the results,
+    defaults to the datasets or path), `labels`, `dataset_id_key` and
+    `weighting`."""
+    text = Path(path).read_text(encoding="utf8").strip()
+    if text.startswith("["):
+        entries = json.loads(text)
+    else:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for entry in entries:
+        validate_entry(entry)
+    return entries
+
+
+def validate_entry(entry: ManifestEntry) -> None:
+    """Raises a `ValueError` if a manifest entry is missing required keys."""
+    if entry.get("type") not in BATCH_TYPES:
+        raise ValueError(f"Entry type has to be one of {BATCH_TYPES}: {entry}")
+    if entry.get("annotation_type") not in ANNOTATION_TYPES:
+        raise ValueError(
+            f"Entry annotation_type has to be one of {ANNOTATION_TYPES}: {entry}"
+        )
+    if entry["annotation_type"] == "multilabel" and not entry.get("labels"):
+        raise ValueError(f"Entry needs labels for 'multilabel': {entry}")
+    source_key = "path" if entry["type"] in FILE_TYPES else "datasets"
+    if not entry.get(source_key):
+        raise ValueError(f"Entry of type '{entry['type']}' needs '{source_key}'")
+
+
+def entry_name(entry: ManifestEntry) -> str:
+    if "name" in entry:
+        return entry["name"]
+    if entry["type"] in FILE_TYPES:
+        return str(entry["path"])
+    return ",".join(_datasets(entry))
+
+
+def _datasets(entry: ManifestEntry) -> List[str]:
+    datasets = entry["datasets"]
+    return [datasets] if isinstance(datasets, str) else list(datasets)
+
+
+def _annotator_id(entry: ManifestEntry) -> str:
+    if entry["type"] == "datasets":
+        return "_dataset_id"
+    return entry.get("dataset_id_key") or "_session_id"
+
+
+def jsonable(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Undefined measures become `null`, and categories become strings, as JSON
+    object keys have to be."""
+    record = {}
+    for key, value in stats.items():
+        if isinstance(value, float) and not math.isfinite(value):
+            value = None
+        elif isinstance(value, dict):
+            value = {str(k): v for k, v in value.items()}
+        record[key] = value
+    return record
+
+
+def agreement_records(
+    columns: AnnotationColumns,
+    annotation_type: str,
+    labels: Optional[List[str]] = None,
+    weighting: str = "identity",
+) -> List[BatchRecord]:
+    """Calculates agreement for encoded annotations, returning records with the
+    fields of `calculate_agreement`. For 'multilabel' there's one record per
+    label (with its `label`), plus the macro and micro averages (`average`)."""
+    if annotation_type == "multilabel":
+        reliability = columns_to_multilabel_codes(columns, labels)
+        per_label, summary = agreement_from_multilabel_codes(
+            reliability.codes, reliability.labels, weighting=weighting
+        )
+        records = [
+            {"label": label, **jsonable(stats)} for label, stats in per_label.items()
+        ]
+        for average in ("macro", "micro"):
+            stats = {key: summary[average][key] for key in MEASURES}
+            records.append({"average": average, **jsonable(stats)})
+        return records
+    reliability = columns_to_codes(columns, annotation_type, sparse=True)
+    stats = agreement_from_codes(
+        reliability.codes, reliability.categories, weighting=weighting
+    )
+    return [jsonable(stats)]
+
+
+def _entry_records(
+    entry: ManifestEntry,
+    columns: Optional[AnnotationColumns] = None,
+    cache_dir: Optional[str] = None,
+) -> List[BatchRecord]:
+    """Runs one entry. Files are read here, so that happens in the worker."""
+    if columns is None:
+        annotator_id = _annotator_id(entry)
+        if entry["type"] == "parquet":
+            columns = read_arrow_annotations(entry["path"], annotator_id=annotator_id)
+        elif cache_dir is not None:
+            columns = cached_jsonl_annotations(
+                entry["path"], cache_dir, annotator_id=annotator_id
+            )
+        else:
+            columns = encode_columns(
+                read_jsonl_projected(entry["path"], annotation_keys(annotator_id)),
+                annotator_id,
+            )
+    return agreement_records(
+        columns,
+        entry["annotation_type"],
+        labels=entry.get("labels"),
+        weighting=entry.get("weighting") or "identity",
+    )
+
+
+def _load_database_entry(
+    entry: ManifestEntry, DB, cache_dir: Optional[str] = None
+) -> AnnotationColumns:
+    """Reads the annotations of a "datasets" or "sessions" entry, with the same
+    validation as the recipes."""
+    annotator_id = _annotator_id(entry)
+    annotations = datasets_to_annotations(
+        _datasets(entry),
+        annotator_id=annotator_id,
+        dataset_id_key="_dataset_id",
+        validate=entry["type"] == "datasets",
+        DB=DB,
+        cache_dir=cache_dir,
+    )
+    if isinstance(annotations, AnnotationColumns):
+        return annotations
+    return encode_columns(annotations, annotator_id)
+
+
+class _InlineExecutor(Executor):
+    """Runs submitted functions right away, for `n_process=1`."""
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        try:
+            result = fn(*args, **kwargs)
+        except (Exception, SystemExit) as e:
+            return _failed(e)
+        future: Future = Future()
+        future.set_result(result)
+        return future
+
+
+def _error_message(error: BaseException) -> str:
+    if isinstance(error, SystemExit):
+        # Validation failures are reported with `msg.fail`, which exits
+        return "Validation failed, see the log for details"
+    return f"{type(error).__name__}: {error}"
+
+
+def _failed(error: BaseException) -> Future:
+    future: Future = Future()
+    future.set_exception(error)
+    return future
+
+
+def _entry_results(entry: ManifestEntry, future: Future) -> Iterator[BatchRecord]:
+    info = {
+        "name": entry_name(entry),
+        "type": entry["type"],
+        "annotation_type": entry["annotation_type"],
+    }
+    try:
+        records = future.result()
+    except (Exception, SystemExit) as e:
+        yield {**info, "error": _error_message(e)}
+        return
+    for record in records:
+        yield {**info, **record}
+
+
+def run_batch(
+    entries: List[ManifestEntry],
+    DB=None,
+    n_process: int = 1,
+    cache_dir: Optional[str] = None,
+) -> Iterator[BatchRecord]:
+    """Calculates agreement for every manifest entry (see `read_manifest`) and
+    yields the records of `agreement_records`, each with the entry's `name`,
+    `type` and `annotation_type`, in manifest order.
+
+    Database entries all share one connection, `DB` (connected on first use if not
+    given), and are read in this process. Calculating agreement, and reading JSONL
+    entries, runs in a pool of `n_process` processes while the next entries are
+    read. Records are yielded as soon as all earlier entries are done. An entry
+    that fails yields one record with an `error` instead."""
+    for entry in entries:
+        validate_entry(entry)
+    executor = ProcessPoolExecutor(n_process) if n_process > 1 else _InlineExecutor()
+    pending: Deque[Tuple[ManifestEntry, Future]] = deque()
+    with executor:
+        for entry in entries:
+            if entry["type"] in FILE_TYPES:
+                future = executor.submit(_entry_records, entry, None, cache_dir)
+            else:
+                if DB is None:
+                    DB = connect_db()
+                try:
+                    columns = _load_database_entry(entry, DB, cache_dir)
+                except (Exception, SystemExit) as e:
+                    future = _failed(e)
+                else:
+                    future = executor.submit(_entry_records, entry, columns)
+            pending.append((entry, future))
+            while pending and pending[0][1].done():
+                yield from _entry_results(*pending.popleft())
+        while pending:
+            yield from _entry_results(*pending.popleft())
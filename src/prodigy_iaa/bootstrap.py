@@ -0,0 +1,155 @@
+from typing import Any, Dict, List, Union
+
+import numpy as np
+
+from .measures import (
+    MEASURES,
+    N_SCALAR_STATISTICS,
+    SparseAgreementTable,
+    Weighting,
+    agreement_from_statistics,
+    sparse_agreement_statistics,
+    sparse_example_terms,
+    split_statistics,
+    weight_matrix,
+)
+from .parallel import map_shared
+
+# Columns of the terms array resampled by `_bootstrap_batch`: one row per non-zero
+# count, with its example and category, the scalar terms of its example (on the
+# example's first count only, zeros on the others) and its own terms
+_ROW, _CATEGORY, _SCALARS, _COUNT_TERMS = 0, 1, slice(2, 7), slice(7, 10)
+
+
+def _to_sparse(
+    agreement_table: Union[np.ndarray, SparseAgreementTable]
+) -> SparseAgreementTable:
+    if isinstance(agreement_table, SparseAgreementTable):
+        return agreement_table
+    table = np.asarray(agreement_table)
+    rows, categories = np.nonzero(table)
+    indptr = np.zeros(table.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=table.shape[0]), out=indptr[1:])
+    return SparseAgreementTable(
+        indptr, categories, table[rows, categories], table.shape[1]
+    )
+
+
+def _resample_terms(table: SparseAgreementTable, weights: np.ndarray) -> np.ndarray:
+    """The terms of a `SparseAgreementTable` that `_bootstrap_batch` resamples, as a
+    single (nnz x 10) float array (see `_ROW` etc.), so it can be shared with
+    workers. Examples without annotations are dropped, since they aren't
+    resampled."""
+    annotated = np.diff(table.indptr) > 0
+    rows = (np.cumsum(annotated) - 1)[table.rows()]
+    terms, count_terms = sparse_example_terms(table, weights)
+    resampled = np.zeros((len(rows), 10))
+    resampled[:, _ROW] = rows
+    resampled[:, _CATEGORY] = table.indices
+    resampled[table.indptr[:-1][annotated], _SCALARS] = terms[annotated]
+    resampled[:, _COUNT_TERMS] = count_terms
+    return resampled
+
+
+def _bootstrap_batch(terms: np.ndarray, task: Dict[str, Any]) -> np.ndarray:
+    """Calculates the measures for `task["n_samples"]` resamples of the examples,
+    returning an (n_samples x 3) array. Each resample is represented as the
+    number of times every example was drawn, which weights the terms of its
+    non-zero counts (see `_resample_terms`), so the table is never copied.
+
+    Draw counts are sampled one chunk of examples at a time: the number of draws
+    landing in a chunk is binomial given the draws left for the remaining
+    examples, which gives exactly the multinomial counts of drawing N examples
+    with replacement, without holding (n_samples x N) counts in memory."""
+    rng = np.random.default_rng(task["seed"])
+    n_samples, n_categories = task["n_samples"], task["n_categories"]
+    chunk_size = task.get("chunk_size", 10_000)
+    rows = terms[:, _ROW].astype(np.int64)
+    categories = terms[:, _CATEGORY].astype(np.int64)
+    n_examples = int(rows[-1]) + 1 if len(rows) else 0
+    statistics = np.zeros((n_samples, N_SCALAR_STATISTICS + 3 * n_categories))
+    scalars, *blocks = split_statistics(statistics, n_categories)
+    draws_left = np.full(n_samples, n_examples)
+    for start in range(0, n_examples, chunk_size):
+        size = min(chunk_size, n_examples - start)
+        examples_left = n_examples - start
+        draws = (
+            draws_left
+            if size == examples_left
+            else rng.binomial(draws_left, size / examples_left)
+        )
+        draws_left = draws_left - draws
+        sample = np.repeat(np.arange(n_samples), draws)
+        drawn = sample * size + rng.integers(0, size, len(sample))
+        counts = np.bincount(drawn, minlength=n_samples * size)
+        counts = counts.reshape(n_samples, size).astype(float)
+
+        lo, hi = np.searchsorted(rows, [start, start + size])
+        # (n_samples x nnz) times each non-zero count of the chunk was drawn
+        count_draws = counts[:, rows[lo:hi] - start]
+        scalars += count_draws @ terms[lo:hi, _SCALARS]
+        cells = (
+            np.arange(n_samples)[:, None] * n_categories + categories[lo:hi]
+        ).ravel()
+        for block, column in zip(blocks, terms[lo:hi, _COUNT_TERMS].T):
+            block += np.bincount(
+                cells,
+                (count_draws * column).ravel(),
+                minlength=n_samples * n_categories,
+            ).reshape(n_samples, n_categories)
+    agreement = agreement_from_statistics(statistics, task["weights"])
+    return np.stack([agreement[measure] for measure in MEASURES], axis=-1)
+
+
+def bootstrap_agreement(
+    agreement_table: Union[np.ndarray, SparseAgreementTable],
+    categories: List[Any],
+    weighting: Weighting = "identity",
+    n_samples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+    n_process: int = 1,
+    batch_size: int = 100,
+) -> Dict[str, Dict[str, float]]:
+    """Calculates percentile bootstrap confidence intervals for Percent Agreement,
+    Alpha and AC2 by resampling the examples (rows) of an (N x K) agreement table,
+    dense or a `SparseAgreementTable`, with replacement. Only the terms of the
+    non-zero counts are resampled, so the work is proportional to the categories
+    actually used.
+
+    Resamples are drawn in batches of `batch_size`, each with its own seed spawned
+    from `seed`, so results are the same for any `n_process`. With `n_process > 1`
+    batches are run in a process pool, sharing the terms (see `map_shared`).
+
+    Returns the point estimate and the `lower` and `upper` bounds for each measure.
+    """
+    table = _to_sparse(agreement_table)
+    weights = weight_matrix(categories, weighting)
+    n_batches = -(-n_samples // batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_batches)
+    tasks = [
+        {
+            "seed": batch_seed,
+            "n_samples": min(batch_size, n_samples - i * batch_size),
+            "n_categories": table.n_categories,
+            "weights": weights,
+        }
+        for i, batch_seed in enumerate(seeds)
+    ]
+    terms = _resample_terms(table, weights)
+    samples = np.concatenate(map_shared(_bootstrap_batch, terms, tasks, n_process))
+
+    statistics = sparse_agreement_statistics(table, weights)
+    estimate = agreement_from_statistics(statistics, weights)
+    tail = 100 * (1 - confidence) / 2
+    # Degenerate resamples (e.g. no co-incident examples) have undefined measures
+    with np.errstate(invalid="ignore"):
+        lower, upper = np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+    return {
+        measure: {
+            "estimate": float(estimate[measure]),
+            "lower": float(lower[i]),
+            "upper": float(upper[i]),
+        }
+        for i, measure in enumerate(MEASURES)
+    }
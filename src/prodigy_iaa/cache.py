@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+from array import array
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from .loaders import (
+    annotation_keys,
+    read_jsonl_checkpointed,
+    read_sql_checkpointed,
+    sql_count_links,
+)
+
+ExampleDict = Dict[str, Any]
+
+CACHE_VERSION = 2
+# Vocabularies, in order of first appearance
+VOCABULARIES = ("examples", "annotators", "answers", "labels")
+# One value per annotation, as vocabulary positions (-1 for a missing `answer`)
+ANNOTATION_COLUMNS = ("example", "annotator", "answer", "n_accept")
+# The `accept` values of all annotations, `n_accept` per annotation
+COLUMNS = ANNOTATION_COLUMNS + ("accept",)
+# Bytes at the start of a JSONL file that have to be unchanged to reuse its cache
+_HEAD_BYTES = 1 << 16
+
+
+class AnnotationColumns(NamedTuple):
+    """Integer-encoded annotations, one array entry per annotation. `example`,
+    `annotator` and `answer` are positions in the `examples`, `annotators` and
+    `answers` vocabularies, and each annotation's `accept` list is the next
+    `n_accept` entries of `accept`, as positions in `labels`. The arrays are
+    memory-mapped when loaded from an `AnnotationCache`."""
+
+    examples: List[Any]
+    annotators: List[Any]
+    answers: List[Any]
+    labels: List[Any]
+    example: np.ndarray
+    annotator: np.ndarray
+    answer: np.ndarray
+    n_accept: np.ndarray
+    accept: np.ndarray
+
+
+def hashable(value: Any) -> Any:
+    """Turns lists into tuples, so they can be dict keys. JSON turns tuples into
+    lists."""
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _index(vocabulary: List[Any]) -> Dict[Any, int]:
+    return {hashable(value): i for i, value in enumerate(vocabulary)}
+
+
+def encode_annotations(
+    examples: Iterable[ExampleDict],
+    vocabularies: Dict[str, Dict[Any, int]],
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+) -> Dict[str, array]:
+    """Encodes the annotations of `examples` as integer columns (see
+    `AnnotationColumns`) in a single pass. `vocabularies` maps each name in
+    `VOCABULARIES` to a dict of values to positions, and is extended in place
+    with values that weren't seen before."""
+    example_index = vocabularies["examples"]
+    annotator_index = vocabularies["annotators"]
+    answer_index = vocabularies["answers"]
+    label_index = vocabularies["labels"]
+    columns = {name: array("q") for name in COLUMNS}
+    for example in examples:
+        columns["example"].append(
+            example_index.setdefault(example[example_id], len(example_index))
+        )
+        columns["annotator"].append(
+            annotator_index.setdefault(example[annotator_id], len(annotator_index))
+        )
+        answer = example.get("answer")
+        columns["answer"].append(
+            -1 if answer is None else answer_index.setdefault(answer, len(answer_index))
+        )
+        accept = example.get("accept") or []
+        columns["n_accept"].append(len(accept))
+        for label in accept:
+            columns["accept"].append(
+                label_index.setdefault(hashable(label), len(label_index))
+            )
+    return columns
+
+
+def encode_columns(
+    examples: Iterable[Dict[str, Any]],
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+) -> AnnotationColumns:
+    """Encodes the annotations of `examples` as `AnnotationColumns` in memory,
+    with new vocabularies (see `encode_annotations`)."""
+    vocabularies: Dict[str, Dict[Any, int]] = {name: {} for name in VOCABULARIES}
+    columns = encode_annotations(examples, vocabularies, annotator_id, example_id)
+    return AnnotationColumns(
+        **{name: list(values) for name, values in vocabularies.items()},
+        **{
+            name: np.frombuffer(values, dtype=np.int64)
+            for name, values in columns.items()
+        },
+    )
+
+
+class AnnotationCache:
+    """On-disk cache of `AnnotationColumns` for one data source, so only examples
+    added since the last run have to be read and encoded.
+
+    The cache lives in a sub-directory of `cache_dir` named after a fingerprint
+    of `source`, a JSON-serializable description of where the examples come
+    from. Each column is a flat file of int64 values that's only ever appended
+    to and is memory-mapped for reading, and each vocabulary is a JSONL file
+    that only new values are appended to. `meta.json` only holds the number of
+    values in each column, the size of each vocabulary file, and the
+    `checkpoint` to resume reading the source from, so a refresh writes time
+    proportional to what was added. `meta.json` is replaced atomically after the
+    columns and vocabularies are written, so an interrupted refresh leaves the
+    previous state intact."""
+
+    def __init__(self, cache_dir: Union[str, Path], source: Dict[str, Any]):
+        self.source = source
+        fingerprint = hashlib.sha1(
+            json.dumps(source, sort_keys=True).encode("utf8")
+        ).hexdigest()[:16]
+        self.path = Path(cache_dir) / fingerprint
+        self.meta = self._read_meta()
+
+    def _read_meta(self) -> Dict[str, Any]:
+        meta_path = self.path / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text(encoding="utf8"))
+            if meta.get("version") == CACHE_VERSION and meta["source"] == self.source:
+                return meta
+        return {
+            "version": CACHE_VERSION,
+            "source": self.source,
+            "checkpoint": None,
+            "validation": None,
+            "lengths": {name: 0 for name in COLUMNS},
+            "vocabulary_bytes": {name: 0 for name in VOCABULARIES},
+        }
+
+    @property
+    def checkpoint(self) -> Any:
+        """Where to resume reading the source, `None` if nothing was read yet."""
+        return self.meta["checkpoint"]
+
+    @property
+    def validation(self) -> Any:
+        """What the source looked like at the checkpoint, to detect changes to
+        examples that were already read."""
+        return self.meta["validation"]
+
+    def __len__(self) -> int:
+        """Number of cached annotations."""
+        return self.meta["lengths"]["example"]
+
+    def clear(self) -> None:
+        """Discards all cached annotations."""
+        for name in COLUMNS:
+            (self.path / f"{name}.i8").unlink(missing_ok=True)
+        for name in VOCABULARIES:
+            (self.path / f"{name}.jsonl").unlink(missing_ok=True)
+        (self.path / "meta.json").unlink(missing_ok=True)
+        self.meta = self._read_meta()
+
+    def _read_vocabulary(self, name: str) -> List[Any]:
+        size = self.meta["vocabulary_bytes"][name]
+        if not size:
+            return []
+        with (self.path / f"{name}.jsonl").open("rb") as f:
+            # Anything after `size` was written by an interrupted refresh
+            lines = f.read(size).splitlines()
+        return [hashable(json.loads(line)) for line in lines]
+
+    def append(
+        self,
+        examples: Iterable[Tuple[ExampleDict, Any]],
+        annotator_id: str = "_session_id",
+        example_id: str = "_task_hash",
+        validate: Optional[Callable[[Any], Any]] = None,
+    ) -> int:
+        """Encodes and appends `(example, checkpoint)` pairs, e.g. from
+        `read_jsonl_checkpointed` started at `self.checkpoint`. `validate` is
+        called with the new checkpoint to describe the source at that point (see
+        `validation`). Returns the number of annotations added."""
+        vocabularies = {
+            name: _index(self._read_vocabulary(name)) for name in VOCABULARIES
+        }
+        vocabulary_sizes = {name: len(vocabularies[name]) for name in VOCABULARIES}
+        checkpoint = self.checkpoint
+
+        def track(pairs: Iterable[Tuple[ExampleDict, Any]]) -> Iterator[ExampleDict]:
+            nonlocal checkpoint
+            for example, checkpoint in pairs:
+                yield example
+
+        columns = encode_annotations(
+            track(examples), vocabularies, annotator_id, example_id
+        )
+        self.path.mkdir(parents=True, exist_ok=True)
+        lengths = dict(self.meta["lengths"])
+        for name in COLUMNS:
+            with (self.path / f"{name}.i8").open("ab") as f:
+                # Drop anything written after the last successful refresh
+                f.truncate(lengths[name] * columns[name].itemsize)
+                columns[name].tofile(f)
+            lengths[name] += len(columns[name])
+        vocabulary_bytes = dict(self.meta["vocabulary_bytes"])
+        for name in VOCABULARIES:
+            with (self.path / f"{name}.jsonl").open("ab") as f:
+                f.truncate(vocabulary_bytes[name])
+                for value in islice(vocabularies[name], vocabulary_sizes[name], None):
+                    f.write(json.dumps(value).encode("utf8") + b"\n")
+                vocabulary_bytes[name] = f.tell()
+        if validate is not None and checkpoint is not None:
+            validation = validate(checkpoint)
+        else:
+            validation = self.validation
+        self.meta.update(
+            checkpoint=checkpoint,
+            validation=validation,
+            lengths=lengths,
+            vocabulary_bytes=vocabulary_bytes,
+        )
+        tmp_path = self.path / "meta.json.tmp"
+        tmp_path.write_text(json.dumps(self.meta), encoding="utf8")
+        os.replace(tmp_path, self.path / "meta.json")
+        return len(columns["example"])
+
+    def columns(self) -> AnnotationColumns:
+        """The cached annotations, with memory-mapped arrays."""
+        arrays = {}
+        for name in COLUMNS:
+            length = self.meta["lengths"][name]
+            if length:
+                arrays[name] = np.memmap(
+                    self.path / f"{name}.i8", dtype=np.int64, mode="r", shape=(length,)
+                )
+            else:
+                arrays[name] = np.zeros(0, dtype=np.int64)
+        vocabularies = {name: self._read_vocabulary(name) for name in VOCABULARIES}
+        return AnnotationColumns(**vocabularies, **arrays)
+
+
+def file_head(path: Path, size: int) -> str:
+    """A hash of the first `size` bytes of a file (at most `_HEAD_BYTES`), to
+    check that what was already read of it didn't change."""
+    with path.open("rb") as f:
+        return hashlib.sha1(f.read(min(size, _HEAD_BYTES))).hexdigest()
+
+
+def cached_jsonl_annotations(
+    path: Union[str, Path],
+    cache_dir: Union[str, Path],
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+) -> AnnotationColumns:
+    """Reads the annotations of a JSONL file through an `AnnotationCache`. Only the
+    lines after the byte offset reached by the last run are read. If the file
+    got shorter or its start changed, it's assumed to have been rewritten and is
+    read again from scratch."""
+    path = Path(path)
+    cache = AnnotationCache(
+        cache_dir,
+        {
+            "type": "jsonl",
+            "path": str(path.resolve()),
+            "annotator_id": annotator_id,
+            "example_id": example_id,
+        },
+    )
+    if cache.checkpoint is not None:
+        size = path.stat().st_size
+        if size < cache.checkpoint or file_head(path, cache.checkpoint) != (
+            cache.validation
+        ):
+            cache.clear()
+    examples = read_jsonl_checkpointed(
+        path, annotation_keys(annotator_id, example_id), start=cache.checkpoint or 0
+    )
+    cache.append(
+        examples,
+        annotator_id,
+        example_id,
+        validate=lambda checkpoint: file_head(path, checkpoint),
+    )
+    return cache.columns()
+
+
+def cached_sql_annotations(
+    connection,
+    dialect: str,
+    datasets: List[str],
+    cache_dir: Union[str, Path],
+    db_name: str = "",
+    annotator_id: str = "_session_id",
+    dataset_id_key: str = "_dataset_id",
+) -> AnnotationColumns:
+    """Reads the annotations of `datasets` in a Prodigy database through an
+    `AnnotationCache`. Only examples linked after the highest link ID seen by the
+    last run are read. If examples up to that link ID were deleted since, the
+    datasets are read again from scratch."""
+    cache = AnnotationCache(
+        cache_dir,
+        {
+            "type": "sql",
+            "dialect": dialect,
+            "db_name": db_name,
+            "datasets": sorted(datasets),
+            "annotator_id": annotator_id,
+            "dataset_id_key": dataset_id_key,
+        },
+    )
+    if cache.checkpoint is not None:
+        n_links = sql_count_links(connection, dialect, datasets, cache.checkpoint)
+        if n_links != cache.validation:
+            cache.clear()
+    examples = read_sql_checkpointed(
+        connection,
+        dialect,
+        datasets,
+        annotator_id=annotator_id,
+        dataset_id_key=dataset_id_key,
+        start=-1 if cache.checkpoint is None else cache.checkpoint,
+    )
+    cache.append(
+        examples,
+        annotator_id,
+        validate=lambda checkpoint: sql_count_links(
+            connection, dialect, datasets, checkpoint
+        ),
+    )
+    return cache.columns()
@@ -0,0 +1,129 @@
+import heapq
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+from .measures import (
+    Codes,
+    Weighting,
+    annotation_coordinates,
+    sparse_agreement_table,
+    sparse_example_raters,
+    weight_matrix,
+)
+
+
+class ExampleAgreement(NamedTuple):
+    """Agreement on single examples, at positions `rows` of the code array.
+    `percent_agreement` is the (weighted) share of ordered pairs of annotators
+    that agree, AC2's `ac_pa_i`, and `kripp_pa_i` is Alpha's per-example term,
+    the number of other annotators agreeing with an annotator on average."""
+
+    rows: np.ndarray
+    n_annotations: np.ndarray
+    kripp_pa_i: np.ndarray
+    percent_agreement: np.ndarray
+
+
+def example_agreement(
+    codes: Codes,
+    categories: List[Any],
+    weighting: Weighting = "identity",
+    chunk_size: int = 100_000,
+) -> Iterator[ExampleAgreement]:
+    """Yields the per-example agreement of the co-incident examples (more than one
+    annotation) of an (N x A) code array (-1 for missing) or `SparseReliability`,
+    `chunk_size` examples at a time, in example order. These are the terms
+    `calculate_agreement` sums over, so only one chunk is in memory at a time."""
+    weights = weight_matrix(categories, weighting)
+    n_examples = codes.shape[0]
+    rows, _, values = annotation_coordinates(codes)
+    boundaries = np.searchsorted(rows, np.arange(0, n_examples, chunk_size))
+    for first, start, end in zip(
+        range(0, n_examples, chunk_size),
+        boundaries,
+        np.append(boundaries[1:], len(rows)),
+    ):
+        n_chunk = min(chunk_size, n_examples - first)
+        table = sparse_agreement_table(
+            rows[start:end] - first, values[start:end], n_chunk, len(categories)
+        )
+        ri, pa_i = sparse_example_raters(table, weights)
+        coincident = np.flatnonzero(ri > 1)
+        ri, pa_i = ri[coincident], pa_i[coincident]
+        yield ExampleAgreement(
+            coincident + first,
+            ri.astype(int),
+            pa_i / (ri - 1),
+            pa_i / (ri * (ri - 1)),
+        )
+
+
+def most_contested(
+    codes: Codes,
+    categories: List[Any],
+    k: int = 100,
+    weighting: Weighting = "identity",
+    chunk_size: int = 100_000,
+) -> ExampleAgreement:
+    """Finds the `k` co-incident examples with the lowest per-example agreement
+    (see `example_agreement`), most contested first. Ties go to the example with
+    more annotations, then to the earlier example.
+
+    Examples are streamed in chunks, and only the `k` most contested so far are
+    kept in a bounded heap, so memory is O(k + chunk_size) no matter how many
+    examples there are."""
+    # Min-heap of negated sort keys, so the least contested example kept is on top
+    heap: List[Tuple[float, int, int, float]] = []
+    for chunk in example_agreement(codes, categories, weighting, chunk_size):
+        # Only a chunk's own k most contested examples can make it into the heap
+        order = np.lexsort((chunk.rows, -chunk.n_annotations, chunk.percent_agreement))
+        for i in order[:k].tolist():
+            item = (
+                -float(chunk.percent_agreement[i]),
+                int(chunk.n_annotations[i]),
+                -int(chunk.rows[i]),
+                float(chunk.kripp_pa_i[i]),
+            )
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            else:
+                # The chunk is sorted, so nothing after this is more contested
+                break
+    items = sorted(heap, reverse=True)
+    return ExampleAgreement(
+        np.array([-row for _, _, row, _ in items], dtype=np.int64),
+        np.array([n for _, n, _, _ in items], dtype=int),
+        np.array([kripp_pa_i for _, _, _, kripp_pa_i in items]),
+        np.array([-percent_agreement for percent_agreement, _, _, _ in items]),
+    )
+
+
+def contested_records(
+    contested: ExampleAgreement,
+    codes: Codes,
+    examples: List[Any],
+    annotators: List[Any],
+    categories: List[Any],
+    example_id: str = "_task_hash",
+) -> Iterator[Dict[str, Any]]:
+    """Yields one record per example of `most_contested`, most contested first,
+    with the example's ID under `example_id`, its agreement and every
+    annotator's answer, e.g. to export to JSONL and review."""
+    rows, cols, values = annotation_coordinates(codes)
+    starts = np.searchsorted(rows, contested.rows)
+    ends = np.searchsorted(rows, contested.rows, side="right")
+    for rank, (row, start, end) in enumerate(zip(contested.rows, starts, ends)):
+        yield {
+            "rank": rank + 1,
+            example_id: examples[row],
+            "n_annotations": int(contested.n_annotations[rank]),
+            "percent_agreement": float(contested.percent_agreement[rank]),
+            "kripp_pa_i": float(contested.kripp_pa_i[rank]),
+            "annotations": {
+                str(annotators[col]): categories[value]
+                for col, value in zip(cols[start:end], values[start:end])
+            },
+        }
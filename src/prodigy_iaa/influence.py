@@ -0,0 +1,102 @@
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from .measures import (
+    MEASURES,
+    Codes,
+    Weighting,
+    agreement_from_statistics,
+    agreement_statistics,
+    annotation_coordinates,
+    build_agreement_array,
+    example_terms,
+    split_statistics,
+    weight_matrix,
+)
+
+
+def leave_one_out_agreement(
+    codes: Codes,
+    categories: List[Any],
+    weighting: Weighting = "identity",
+    chunk_size: int = 100_000,
+) -> Dict[str, np.ndarray]:
+    """Calculates Percent Agreement, Alpha and AC2 with each annotator of an (N x A)
+    code array (-1 for missing) or `SparseReliability` left out, returning arrays
+    of length A.
+
+    Rather than recalculating agreement A times, the sufficient statistics of all
+    annotations are calculated once, and each annotation's contribution is
+    subtracted: removing annotation k from an example only changes that example's
+    terms. The total cost is about one pass over the annotations.
+
+    Also returns the measures on all annotations (`full`), and the number of
+    annotations per annotator (`n_annotations`)."""
+    n_annotators = codes.shape[1]
+    n_categories = len(categories)
+    weights = weight_matrix(categories, weighting)
+    table = build_agreement_array(codes, n_categories).astype(float)
+    rbar_ik = table @ weights.T
+    statistics = agreement_statistics(table, weights)
+
+    # Change in the statistics when leaving out each annotator
+    deltas = np.zeros((n_annotators,) + statistics.shape)
+    scalars, coincident_totals, proportions, totals = split_statistics(
+        deltas, n_categories
+    )
+    rows, cols, values = annotation_coordinates(codes)
+    for start in range(0, len(rows), chunk_size):
+        row, col, value = (x[start : start + chunk_size] for x in (rows, cols, values))
+        before = table[row]
+        after = before.copy()
+        after[np.arange(len(row)), value] -= 1
+        terms_before, coincident_before, inverse_ri_before = example_terms(
+            before, rbar_ik[row]
+        )
+        terms_after, coincident_after, inverse_ri_after = example_terms(
+            after, rbar_ik[row] - weights[:, value].T
+        )
+        np.add.at(scalars, col, terms_after - terms_before)
+        np.add.at(
+            coincident_totals,
+            col,
+            after * coincident_after[:, None] - before * coincident_before[:, None],
+        )
+        np.add.at(
+            proportions,
+            col,
+            after * inverse_ri_after[:, None] - before * inverse_ri_before[:, None],
+        )
+        np.add.at(totals, (col, value), -1)
+
+    without = agreement_from_statistics(statistics + deltas, weights)
+    full = agreement_from_statistics(statistics, weights)
+    result = {measure: without[measure] for measure in MEASURES}
+    result["full"] = {measure: float(full[measure]) for measure in MEASURES}
+    result["n_annotations"] = np.bincount(cols, minlength=n_annotators)
+    return result
+
+
+def influence_records(
+    leave_one_out: Dict[str, Any], annotators: List[Any]
+) -> Iterator[Dict[str, Any]]:
+    """Yields one record per annotator with the measures without them, and the
+    change compared to including everyone. A positive `kripp_alpha_delta` means
+    agreement goes up without the annotator. Sorted by `kripp_alpha_delta`,
+    largest first, so the annotators that drag agreement down come first."""
+    records = []
+    for a, annotator in enumerate(annotators):
+        record = {
+            "annotator": annotator,
+            "n_annotations": int(leave_one_out["n_annotations"][a]),
+        }
+        for measure in MEASURES:
+            value = float(leave_one_out[measure][a])
+            record[measure] = value
+            record[f"{measure}_delta"] = value - leave_one_out["full"][measure]
+        records.append(record)
+    records.sort(
+        key=lambda r: (np.isnan(r["kripp_alpha_delta"]), -r["kripp_alpha_delta"])
+    )
+    yield from records
@@ -0,0 +1,248 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Union
+
+ExampleDict = Dict[str, Any]
+
+# The only example keys the value getters read, besides the example and annotator IDs
+VALUE_KEYS = ("answer", "accept")
+# The keys `spans.get_spans` reads, for 'ner' and 'spancat'
+SPAN_KEYS = ("answer", "spans", "tokens", "text")
+
+
+def annotation_keys(
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+    value_keys: Tuple[str, ...] = VALUE_KEYS,
+) -> Tuple[str, ...]:
+    """Keys of an example that are needed to calculate agreement."""
+    return (example_id, annotator_id) + tuple(value_keys)
+
+
+def read_jsonl_checkpointed(
+    path: Union[str, Path], keys: Iterable[str], start: int = 0
+) -> Iterator[Tuple[ExampleDict, int]]:
+    """Like `read_jsonl_projected`, but starts reading at byte offset `start` and
+    yields each example with the byte offset right after its line. Reading can
+    be resumed from that offset later to only see examples added since. A last
+    line that isn't valid JSON yet (e.g. still being written) is left for later."""
+    keys = tuple(keys)
+    offset = start
+    with Path(path).open("rb") as f:
+        f.seek(start)
+        for line in f:
+            offset += len(line)
+            try:
+                example = json.loads(line) if line.strip() else None
+            except ValueError:
+                if line.endswith(b"\n"):
+                    raise
+                return
+            if example is None:
+                continue
+            yield {key: example[key] for key in keys if key in example}, offset
+
+
+def read_jsonl_projected(
+    path: Union[str, Path], keys: Iterable[str], start: int = 0
+) -> Iterator[ExampleDict]:
+    """Streams examples from a JSONL file line by line, keeping only `keys`. Nothing
+    else of an example (text, tokens, spans, html, ...) outlives the line it was
+    parsed from, so this can be consumed by `examples_to_codes` without holding
+    the whole file in memory."""
+    for example, _ in read_jsonl_checkpointed(path, keys, start=start):
+        yield example
+
+
+# SQL pushdown for Prodigy databases. Prodigy stores examples as JSON blobs in the
+# `example` table, linked to datasets through the `link` table. Instead of
+# deserializing every example, we extract only the keys we need in the database.
+SQL_DIALECTS = ("sqlite", "postgresql")
+_SAFE_KEY = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+
+def _json_field(dialect: str, key: str) -> str:
+    """SQL expression extracting `key` from an example's content, as text."""
+    if not _SAFE_KEY.match(key):
+        raise ValueError(f"Can't query example key '{key}' in SQL")
+    if dialect == "sqlite":
+        return f"json_extract(CAST(example.content AS TEXT), '$.\"{key}\"')"
+    elif dialect == "postgresql":
+        return f"(convert_from(example.content, 'UTF8')::json ->> '{key}')"
+    raise ValueError(f"Unsupported SQL dialect '{dialect}'")
+
+
+def _json_value_fields(dialect: str, path: Tuple[str, ...]) -> List[str]:
+    """SQL expressions extracting the value at `path` (nested keys) of an example's
+    content, decoded by `_json_value`. Unlike `_json_field`, numbers, booleans,
+    objects and lists keep their type."""
+    for key in path:
+        if not all(_SAFE_KEY.match(part) for part in key.split(".")):
+            raise ValueError(f"Can't query example key '{key}' in SQL")
+    if dialect == "sqlite":
+        content = "CAST(example.content AS TEXT)"
+        json_path = "$" + "".join(f'."{key}"' for key in path)
+        return [
+            f"json_type({content}, '{json_path}')",
+            f"json_extract({content}, '{json_path}')",
+        ]
+    elif dialect == "postgresql":
+        # The driver decodes the extracted JSON
+        elements = ",".join(f'"{key}"' for key in path)
+        return [f"(convert_from(example.content, 'UTF8')::json #> '{{{elements}}}')"]
+    raise ValueError(f"Unsupported SQL dialect '{dialect}'")
+
+
+def _json_value(dialect: str, values: Tuple[Any, ...]) -> Tuple[bool, Any]:
+    """Whether the value extracted by `_json_value_fields` exists, and the value."""
+    if dialect == "postgresql":
+        (value,) = values
+        # A missing key and a JSON null are both NULL
+        return value is not None, value
+    json_type, value = values
+    if json_type in ("object", "array"):
+        return True, json.loads(value)
+    if json_type in ("true", "false"):
+        return True, json_type == "true"
+    return json_type is not None, value
+
+
+def _set_path(example: ExampleDict, path: Tuple[str, ...], value: Any) -> None:
+    for key in path[:-1]:
+        example = example.setdefault(key, {})
+    example[path[-1]] = value
+
+
+def _placeholders(dialect: str, n: int) -> str:
+    return ", ".join(["?" if dialect == "sqlite" else "%s"] * n)
+
+
+_DATASET_JOIN = """
+FROM link
+JOIN example ON example.id = link.example_id
+JOIN dataset ON dataset.id = link.dataset_id
+WHERE dataset.name IN ({datasets})
+"""
+
+
+def sql_distinct_values(connection, dialect: str, datasets: List[str], key: str) -> int:
+    """Counts the distinct values of `key` across the examples in `datasets` with a
+    single aggregate query. A missing key counts as one value, like `None`."""
+    field = _json_field(dialect, key)
+    query = (
+        f"SELECT COUNT(DISTINCT {field}), "
+        f"MAX(CASE WHEN {field} IS NULL THEN 1 ELSE 0 END)"
+        + _DATASET_JOIN.format(datasets=_placeholders(dialect, len(datasets)))
+    )
+    cursor = connection.cursor()
+    cursor.execute(query, list(datasets))
+    n_distinct, has_null = cursor.fetchone()
+    return (n_distinct or 0) + (has_null or 0)
+
+
+def sql_count_links(
+    connection, dialect: str, datasets: List[str], max_link_id: int
+) -> int:
+    """Counts the examples in `datasets` up to link ID `max_link_id`, to check
+    that none were deleted since they were read."""
+    query = (
+        "SELECT COUNT(*)"
+        + _DATASET_JOIN.format(datasets=_placeholders(dialect, len(datasets)))
+        + f"AND link.id <= {_placeholders(dialect, 1)}"
+    )
+    cursor = connection.cursor()
+    cursor.execute(query, list(datasets) + [max_link_id])
+    return cursor.fetchone()[0]
+
+
+def read_sql_checkpointed(
+    connection,
+    dialect: str,
+    datasets: List[str],
+    annotator_id: str = "_session_id",
+    dataset_id_key: str = "_dataset_id",
+    page_size: int = 10_000,
+    start: int = -1,
+    extra_keys: Tuple[str, ...] = (),
+) -> Iterator[Tuple[ExampleDict, int]]:
+    """Like `read_sql_projected`, but only reads examples with a link ID above
+    `start`, and yields each example with its link ID. Prodigy only ever adds
+    links, so reading can be resumed from the last link ID to only see examples
+    added since."""
+    fields = [("answer", _json_field(dialect, "answer"))]
+    fields.append(("accept", _json_field(dialect, "accept")))
+    if annotator_id != dataset_id_key:
+        fields.append((annotator_id, _json_field(dialect, annotator_id)))
+    # Every path an extra key can be found at: the full key, or nested keys
+    extra_fields = [
+        (key, path, _json_value_fields(dialect, path))
+        for key in extra_keys
+        for path in dict.fromkeys([(key,), tuple(key.split("."))])
+    ]
+    expressions = [expression for _, expression in fields]
+    for _, _, path_expressions in extra_fields:
+        expressions.extend(path_expressions)
+    query = (
+        "SELECT link.id, example.task_hash, dataset.name, "
+        + ", ".join(expressions)
+        + _DATASET_JOIN.format(datasets=_placeholders(dialect, len(datasets)))
+        + f"AND link.id > {_placeholders(dialect, 1)} "
+        + f"ORDER BY link.id LIMIT {int(page_size)}"
+    )
+    last_id = start
+    cursor = connection.cursor()
+    while True:
+        cursor.execute(query, list(datasets) + [last_id])
+        rows = cursor.fetchall()
+        for row in rows:
+            last_id, task_hash, dataset_name = row[:3]
+            example = {"_task_hash": task_hash, dataset_id_key: dataset_name}
+            for (key, _), value in zip(fields, row[3:]):
+                example[key] = value
+            position = 3 + len(fields)
+            for key, path, path_expressions in extra_fields:
+                values = row[position : position + len(path_expressions)]
+                position += len(path_expressions)
+                found, value = _json_value(dialect, values)
+                # The full key takes precedence, like in `processors.get_group`
+                if found and key not in example:
+                    _set_path(example, path, value)
+            # Lists are extracted as JSON text
+            if example["accept"] is not None:
+                example["accept"] = json.loads(example["accept"])
+            else:
+                del example["accept"]
+            yield example, last_id
+        if len(rows) < page_size:
+            break
+
+
+def read_sql_projected(
+    connection,
+    dialect: str,
+    datasets: List[str],
+    annotator_id: str = "_session_id",
+    dataset_id_key: str = "_dataset_id",
+    page_size: int = 10_000,
+    extra_keys: Tuple[str, ...] = (),
+) -> Iterator[ExampleDict]:
+    """Streams the keys needed to calculate agreement from the examples in
+    `datasets`, using the database's JSON functions. Rows are fetched in pages
+    of `page_size` (ordered by link ID), and the name of each example's dataset
+    is saved as `dataset_id_key`, like `datasets_to_long` does.
+
+    `extra_keys` are also extracted, keeping their JSON type, e.g. to group by
+    or for `_timestamp`. Dots separate nested keys, e.g. 'meta.source' is
+    extracted as `{"meta": {"source": ...}}`, unless the example has the full
+    key."""
+    for example, _ in read_sql_checkpointed(
+        connection,
+        dialect,
+        datasets,
+        annotator_id,
+        dataset_id_key,
+        page_size,
+        extra_keys=extra_keys,
+    ):
+        yield example
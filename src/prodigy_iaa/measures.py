@@ -1,6 +1,21 @@
 from collections import Counter
+from functools import lru_cache
 from itertools import chain, product
-from typing import Any, Callable, List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+
+from .parallel import map_shared, split_evenly
 
 
 def KnownCounter(keys):
@@ -42,8 +57,13 @@ def calculate_agreement(
     Input is an (N x A) reliability matrix, where N is the number
     of unique examples, A is the number of unique annotators,
     and the value is the annotation given by annotator A to example N
-    (or None if not annotated)
+    (or None if not annotated). A `SparseReliability` is passed on to
+    `calculate_agreement_vectorized`, so it's never expanded to N x A.
     """
+    if isinstance(reliability_matrix, SparseReliability):
+        if weighting is identity_weighting:
+            weighting = "identity"
+        return calculate_agreement_vectorized(reliability_matrix, weighting)
     agreement_table = build_agreement_table(reliability_matrix)
     raters_per_example = ri = [sum(example.values()) for example in agreement_table]
     categories = list(agreement_table[0].keys())
@@ -78,7 +98,7 @@ def calculate_agreement(
             r_ik = counts[k]
             rbar_ik = 0
             for l in categories:
-                v = weighting(k, l) * r_ik
+                v = weighting(k, l) * counts[l]
                 rbar_ik += v
             kripp_p_ai_k = (r_ik * (rbar_ik - 1)) / (rbar * (ri_c[i] - 1))
             kripp_pa_i += kripp_p_ai_k
@@ -106,7 +126,7 @@ def calculate_agreement(
     kripp_pi_k = {k: v / rbar for k, v in average_category_per_unit.items()}
 
     kripp_pe = sum(
-        weighting(k, l) * kripp_pi_k[k] * kripp_pi_k[k]
+        weighting(k, l) * kripp_pi_k[k] * kripp_pi_k[l]
         for k, l in product(categories, categories)
     )
     ac_pi_k = {}
@@ -135,3 +155,878 @@ def calculate_agreement(
         "n_single_annotation": n_single_annotation,
         "coincident_annotations_per_category": coincident_annotations_per_category,
     }
+
+
+def _category_sort_key(category):
+    """Sorts numeric-looking categories by value and everything else by string,
+    so that e.g. '2' comes before '10' and mixed types don't raise."""
+    try:
+        return (0, float(category), "")
+    except (TypeError, ValueError):
+        return (1, 0.0, str(category))
+
+
+def sort_categories(categories: Iterable[Any]) -> List[Any]:
+    """Returns the categories in a stable order, used to assign integer codes."""
+    return sorted(categories, key=_category_sort_key)
+
+
+def encode_reliability(
+    reliability_matrix: List[List[Optional[Any]]],
+) -> Tuple[np.ndarray, List[Any]]:
+    """Converts an (N x A) reliability matrix into an (N x A) integer array of
+    category codes, where -1 marks a missing value. Also returns the list of
+    categories, indexed by code."""
+    categories = set(chain.from_iterable(reliability_matrix))
+    categories.discard(None)
+    categories = sort_categories(categories)
+    lookup = {category: code for code, category in enumerate(categories)}
+    lookup[None] = -1
+    n_annotators = len(reliability_matrix[0]) if reliability_matrix else 0
+    codes = np.array(
+        [[lookup[value] for value in row] for row in reliability_matrix],
+        dtype=np.intp,
+    ).reshape(len(reliability_matrix), n_annotators)
+    return codes, categories
+
+
+class SparseReliability(NamedTuple):
+    """An (N x A) reliability matrix in coordinate (COO) format: annotator `cols[i]`
+    gave `categories[codes[i]]` to example `rows[i]`. Missing values aren't stored,
+    so memory is proportional to the number of annotations instead of N x A.
+    Accepted wherever an (N x A) code array is."""
+
+    rows: np.ndarray
+    cols: np.ndarray
+    codes: np.ndarray
+    shape: Tuple[int, int]
+    categories: List[Any]
+
+    @classmethod
+    def from_codes(
+        cls, codes: np.ndarray, categories: List[Any]
+    ) -> "SparseReliability":
+        rows, cols = np.nonzero(codes >= 0)
+        return cls(rows, cols, codes[rows, cols], codes.shape, categories)
+
+    @classmethod
+    def from_matrix(
+        cls, reliability_matrix: List[List[Optional[Any]]]
+    ) -> "SparseReliability":
+        categories = set(chain.from_iterable(reliability_matrix))
+        categories.discard(None)
+        categories = sort_categories(categories)
+        lookup = {category: code for code, category in enumerate(categories)}
+        rows, cols, codes = [], [], []
+        for n, row in enumerate(reliability_matrix):
+            for a, value in enumerate(row):
+                if value is not None:
+                    rows.append(n)
+                    cols.append(a)
+                    codes.append(lookup[value])
+        n_annotators = len(reliability_matrix[0]) if reliability_matrix else 0
+        return cls(
+            np.array(rows, dtype=np.intp),
+            np.array(cols, dtype=np.intp),
+            np.array(codes, dtype=np.intp),
+            (len(reliability_matrix), n_annotators),
+            categories,
+        )
+
+    def toarray(self) -> np.ndarray:
+        """The dense (N x A) code array, with -1 for missing values."""
+        codes = np.full(self.shape, -1, dtype=np.intp)
+        codes[self.rows, self.cols] = self.codes
+        return codes
+
+    def to_list(self) -> List[List[Optional[Any]]]:
+        """Converts to an (N x A) list of lists, with `None` for missing values."""
+        lookup = self.categories + [None]
+        return [[lookup[code] for code in row] for row in self.toarray().tolist()]
+
+
+Codes = Union[np.ndarray, SparseReliability]
+
+
+def annotation_coordinates(
+    codes: Codes,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the example, annotator and category code of every annotation in an
+    (N x A) code array or `SparseReliability`, sorted by example."""
+    if isinstance(codes, SparseReliability):
+        rows, cols, values = codes.rows, codes.cols, codes.codes
+        annotated = values >= 0
+        if not annotated.all():
+            rows, cols, values = rows[annotated], cols[annotated], values[annotated]
+        if np.any(rows[1:] < rows[:-1]):
+            order = np.argsort(rows, kind="stable")
+            rows, cols, values = rows[order], cols[order], values[order]
+        return rows, cols, values
+    rows, cols = np.nonzero(codes >= 0)
+    return rows, cols, codes[rows, cols]
+
+
+def build_agreement_array(codes: Codes, n_categories: int) -> np.ndarray:
+    """Converts an (N x A) array of category codes into an (N x K) agreement table,
+    containing the number of values for each of K categories for each example."""
+    n_examples = codes.shape[0]
+    rows, _, values = annotation_coordinates(codes)
+    flat = rows * n_categories + values
+    counts = np.bincount(flat, minlength=n_examples * n_categories)
+    return counts.reshape(n_examples, n_categories)
+
+
+Weighting = Union[str, Callable[[Any, Any], float], np.ndarray]
+
+
+def _numeric_values(categories: Tuple[Any, ...], weighting: str) -> np.ndarray:
+    try:
+        return np.array([float(c) for c in categories])
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"'{weighting}' weighting requires numeric categories, got {list(categories)}"
+        )
+
+
+def _identity_weights(categories: Tuple[Any, ...]) -> np.ndarray:
+    return np.eye(len(categories))
+
+
+def _ordinal_weights(categories: Tuple[Any, ...]) -> np.ndarray:
+    """Uses only the rank of each category: 1 - C(M_kl, 2) / C(q, 2), where
+    M_kl is the number of ranks between k and l (inclusive)."""
+    q = len(categories)
+    ranks = np.arange(q)
+    m = np.abs(ranks[:, None] - ranks[None, :]) + 1
+    if q < 2:
+        return np.ones((q, q))
+    return 1 - (m * (m - 1)) / (q * (q - 1))
+
+
+def _linear_weights(categories: Tuple[Any, ...]) -> np.ndarray:
+    x = _numeric_values(categories, "linear")
+    spread = np.ptp(x) if len(x) else 0
+    if spread == 0:
+        return np.ones((len(x), len(x)))
+    return 1 - np.abs(x[:, None] - x[None, :]) / spread
+
+
+def _quadratic_weights(categories: Tuple[Any, ...]) -> np.ndarray:
+    x = _numeric_values(categories, "quadratic")
+    spread = np.ptp(x) if len(x) else 0
+    if spread == 0:
+        return np.ones((len(x), len(x)))
+    return 1 - (x[:, None] - x[None, :]) ** 2 / spread**2
+
+
+def _ratio_weights(categories: Tuple[Any, ...]) -> np.ndarray:
+    x = _numeric_values(categories, "ratio")
+    if len(x) == 0 or x.max() == x.min():
+        return np.ones((len(x), len(x)))
+    total = x[:, None] + x[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d = np.where(total != 0, (x[:, None] - x[None, :]) / total, 0) ** 2
+    d_max = ((x.max() - x.min()) / (x.max() + x.min())) ** 2
+    return 1 - d / d_max
+
+
+# Interval weights are Krippendorff's squared-difference metric, which scaled
+# to [0, 1] is the same as Gwet's quadratic weights.
+WEIGHTINGS: Dict[str, Callable[[Tuple[Any, ...]], np.ndarray]] = {
+    "identity": _identity_weights,
+    "ordinal": _ordinal_weights,
+    "linear": _linear_weights,
+    "quadratic": _quadratic_weights,
+    "interval": _quadratic_weights,
+    "ratio": _ratio_weights,
+}
+
+
+@lru_cache(maxsize=128)
+def _cached_weight_matrix(weighting, categories: Tuple[Any, ...]) -> np.ndarray:
+    if isinstance(weighting, str):
+        weights = WEIGHTINGS[weighting](categories)
+    else:
+        weights = np.array(
+            [[weighting(k, l) for l in categories] for k in categories], dtype=float
+        ).reshape(len(categories), len(categories))
+    # The same array is handed out for every call, so it must not be modified
+    weights.setflags(write=False)
+    return weights
+
+
+def weight_matrix(categories: List[Any], weighting: Weighting) -> np.ndarray:
+    """Returns the (K x K) matrix where entry (k, l) is the weight between
+    `categories[k]` and `categories[l]`. `weighting` can be the name of one of the
+    built-in `WEIGHTINGS`, a function `weighting(k, l) -> float`, or an already
+    computed (K x K) array in the same order as `categories`.
+
+    Matrices are cached per weighting and category set, so a weighting function
+    is only evaluated once per pair of categories."""
+    n_categories = len(categories)
+    if isinstance(weighting, np.ndarray):
+        if weighting.shape != (n_categories, n_categories):
+            raise ValueError(
+                f"Weight matrix has shape {weighting.shape}, expected {(n_categories, n_categories)}"
+            )
+        return weighting.astype(float, copy=False)
+    if isinstance(weighting, str) and weighting not in WEIGHTINGS:
+        raise ValueError(
+            f"Unknown weighting '{weighting}', choose one of: {', '.join(WEIGHTINGS)}"
+        )
+    try:
+        return _cached_weight_matrix(weighting, tuple(categories))
+    except TypeError:
+        # Unhashable weighting function or categories, build it without caching
+        return _cached_weight_matrix.__wrapped__(weighting, tuple(categories))
+
+
+MEASURES = ("percent_agreement", "kripp_alpha", "ac2")
+
+# Layout of the sufficient statistics vector, followed by three blocks of K values:
+# coincident annotations per category, the sum over examples of each category's
+# share of an example's annotations, and total annotations per category.
+N_EXAMPLES, N_COINCIDENT, N_COINCIDENT_RATINGS, KRIPP_PA_SUM, AC_PA_SUM = range(5)
+N_SCALAR_STATISTICS = 5
+
+
+def split_statistics(statistics: np.ndarray, n_categories: int):
+    """Splits a (..., 5 + 3K) statistics array into its scalar part and its three
+    per-category blocks."""
+    k = n_categories
+    scalars = statistics[..., :N_SCALAR_STATISTICS]
+    coincident_totals = statistics[..., N_SCALAR_STATISTICS : N_SCALAR_STATISTICS + k]
+    proportions = statistics[..., N_SCALAR_STATISTICS + k : N_SCALAR_STATISTICS + 2 * k]
+    totals = statistics[..., N_SCALAR_STATISTICS + 2 * k :]
+    return scalars, coincident_totals, proportions, totals
+
+
+def _terms_from_raters(
+    ri: np.ndarray, pa_i: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-example terms given the number of raters `ri` of each example and
+    `pa_i = sum_k r_ik (r*_ik - 1)`, see `example_terms`."""
+    coincident = ri > 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kripp_pa_i = np.where(coincident, pa_i / (ri - 1), 0)
+        ac_pa_i = np.where(coincident, pa_i / (ri * (ri - 1)), 0)
+        inverse_ri = np.where(ri > 0, 1 / ri, 0)
+    scalars = np.stack(
+        [ri > 0, coincident, ri * coincident, kripp_pa_i, ac_pa_i], axis=-1
+    ).astype(float)
+    return scalars, coincident.astype(float), inverse_ri
+
+
+def example_terms(
+    agreement_table: np.ndarray, rbar_ik: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-example terms of the sufficient statistics for an (..., N, K) agreement
+    table. Returns the (..., N, 5) scalar terms (see `N_EXAMPLES` and friends), and
+    the per-example factors by which an example's category counts enter the
+    coincident totals and category shares. `rbar_ik` is the weighted number of
+    raters agreeing with each category, `agreement_table @ weights.T`."""
+    ri = agreement_table.sum(axis=-1)
+    pa_i = (agreement_table * (rbar_ik - 1)).sum(axis=-1)
+    return _terms_from_raters(ri, pa_i)
+
+
+def accumulate_statistics(
+    statistics: np.ndarray,
+    agreement_table: np.ndarray,
+    rbar_ik: np.ndarray,
+    sign: float = 1.0,
+) -> None:
+    """Adds (or with `sign=-1` subtracts) the contribution of the examples in an
+    (..., N, K) agreement table to `statistics` in place. `rbar_ik` is the weighted
+    number of raters agreeing with each category, `agreement_table @ weights.T`."""
+    n_categories = agreement_table.shape[-1]
+    scalars, coincident_totals, proportions, totals = split_statistics(
+        statistics, n_categories
+    )
+    terms, coincident, inverse_ri = example_terms(agreement_table, rbar_ik)
+    scalars += sign * terms.sum(axis=-2)
+    coincident_totals += sign * (agreement_table * coincident[..., None]).sum(axis=-2)
+    proportions += sign * (agreement_table * inverse_ri[..., None]).sum(axis=-2)
+    totals += sign * agreement_table.sum(axis=-2)
+
+
+def weighted_agreement_statistics(
+    agreement_table: np.ndarray,
+    weights: np.ndarray,
+    example_weights: np.ndarray,
+    chunk_size: int = 100_000,
+) -> np.ndarray:
+    """Like `agreement_statistics`, but for each row of a (B x N) array of example
+    weights, every example's contribution is multiplied by its weight. With
+    integer weights this is the same as repeating examples, e.g. for
+    resampling. Returns (B x (5 + 3K)) statistics for an (N x K) table."""
+    table = np.asarray(agreement_table)
+    n_examples, n_categories = table.shape
+    example_weights = np.atleast_2d(example_weights)
+    statistics = np.zeros(
+        (example_weights.shape[0], N_SCALAR_STATISTICS + 3 * n_categories)
+    )
+    scalars, coincident_totals, proportions, totals = split_statistics(
+        statistics, n_categories
+    )
+    for start in range(0, n_examples, chunk_size):
+        chunk = table[start : start + chunk_size].astype(float)
+        w = example_weights[:, start : start + chunk_size].astype(float)
+        terms, coincident, inverse_ri = example_terms(chunk, chunk @ weights.T)
+        scalars += w @ terms
+        coincident_totals += (w * coincident) @ chunk
+        proportions += (w * inverse_ri) @ chunk
+        totals += w @ chunk
+    return statistics
+
+
+def agreement_statistics(
+    agreement_table: np.ndarray, weights: np.ndarray, chunk_size: int = 100_000
+) -> np.ndarray:
+    """Reduces an (..., N, K) agreement table to a (..., 5 + 3K) vector of sufficient
+    statistics for Percent Agreement, Alpha and AC2 (see `split_statistics`). Every
+    entry is a sum over examples, so statistics of disjoint sets of examples can be
+    added together. Leading dimensions are treated as independent batches, and
+    examples are processed `chunk_size` at a time to bound memory use."""
+    table = np.asarray(agreement_table)
+    *batch, n_examples, n_categories = table.shape
+    statistics = np.zeros((*batch, N_SCALAR_STATISTICS + 3 * n_categories))
+    for start in range(0, n_examples, chunk_size):
+        chunk = table[..., start : start + chunk_size, :].astype(float)
+        # r*_ik, the (weighted) number of raters agreeing with category k
+        accumulate_statistics(statistics, chunk, chunk @ weights.T)
+    return statistics
+
+
+def agreement_from_statistics(
+    statistics: np.ndarray, weights: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """Calculates Percent Agreement, Alpha and AC2 from (..., 5 + 3K) sufficient
+    statistics, returning arrays with the leading dimensions of `statistics`.
+    Categories that were never used are left out of AC2's expected agreement,
+    the same as if they had not been passed in.
+
+    Where `calculate_agreement` raises a ZeroDivisionError, the measures are NaN
+    instead, so one degenerate entry (e.g. a label, group or time window) doesn't
+    fail a whole batch: all three without coincident examples, and Alpha and AC2
+    with a single category (q=1). No RuntimeWarnings are emitted for them."""
+    n_categories = weights.shape[0]
+    scalars, coincident_totals, proportions, totals = split_statistics(
+        statistics, n_categories
+    )
+    n_a = scalars[..., N_EXAMPLES]
+    n_c = scalars[..., N_COINCIDENT]
+    present = (totals > 0).astype(float)
+    q = present.sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rbar = scalars[..., N_COINCIDENT_RATINGS] / n_c
+        kripp_pa_prime = scalars[..., KRIPP_PA_SUM] / rbar / n_c
+        kripp_pa = ((1 - (1 / (rbar * n_c))) * kripp_pa_prime) + (1 / (rbar * n_c))
+        # AC uses this "raw" pa and not pa_prime
+        ac_pa = scalars[..., AC_PA_SUM] / n_c
+
+        kripp_pi_k = coincident_totals / (n_c * rbar)[..., None]
+        kripp_pe = np.einsum("...k,kl,...l->...", kripp_pi_k, weights, kripp_pi_k)
+        # Note: AC uses all examples, not only the coincident ones
+        ac_pi_k = proportions / n_a[..., None]
+        tw = np.einsum("...k,kl,...l->...", present, weights, present)
+        ac_pe = (tw / (q * (q - 1))) * (ac_pi_k * (1 - ac_pi_k)).sum(axis=-1)
+
+        kripp_alpha = (kripp_pa - kripp_pe) / (1 - kripp_pe)
+        ac2 = (ac_pa - ac_pe) / (1 - ac_pe)
+        avg_raters_per_example = totals.sum(axis=-1) / n_a
+    return {
+        "percent_agreement": ac_pa,
+        "kripp_alpha": kripp_alpha,
+        "ac2": ac2,
+        "n_categories": q,
+        "n_examples": n_a,
+        "n_coincident_examples": n_c,
+        "avg_raters_per_example": avg_raters_per_example,
+        "n_single_annotation": n_a - n_c,
+        "coincident_annotations_per_category": coincident_totals,
+    }
+
+
+def format_agreement(
+    agreement: Dict[str, np.ndarray], categories: List[Any], n_annotators: int
+) -> Dict[str, Any]:
+    """Converts the (unbatched) output of `agreement_from_statistics` into the
+    dictionary returned by `calculate_agreement`."""
+    coincident_annotations_per_category = Counter(
+        {
+            k: int(v)
+            for k, v in zip(
+                categories, agreement["coincident_annotations_per_category"]
+            )
+            if v > 0
+        }
+    )
+    return {
+        "percent_agreement": float(agreement["percent_agreement"]),
+        "kripp_alpha": float(agreement["kripp_alpha"]),
+        "ac2": float(agreement["ac2"]),
+        "n_categories": int(agreement["n_categories"]),
+        "n_annotators": n_annotators,
+        "n_examples": int(agreement["n_examples"]),
+        "n_coincident_examples": int(agreement["n_coincident_examples"]),
+        "avg_raters_per_example": float(agreement["avg_raters_per_example"]),
+        "n_single_annotation": int(agreement["n_single_annotation"]),
+        "coincident_annotations_per_category": coincident_annotations_per_category,
+    }
+
+
+class SparseAgreementTable(NamedTuple):
+    """An (N x K) agreement table in compressed sparse row (CSR) format. The non-zero
+    counts of example n are `counts[indptr[n]:indptr[n + 1]]`, for the categories
+    in `indices[indptr[n]:indptr[n + 1]]`. Use this when K is large, since each
+    example only has a handful of categories."""
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    counts: np.ndarray
+    n_categories: int
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.indptr) - 1, self.n_categories)
+
+    def rows(self) -> np.ndarray:
+        """The example of every non-zero count."""
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def toarray(self) -> np.ndarray:
+        table = np.zeros(self.shape, dtype=self.counts.dtype)
+        table[self.rows(), self.indices] = self.counts
+        return table
+
+
+def sparse_agreement_table(
+    rows: np.ndarray, values: np.ndarray, n_examples: int, n_categories: int
+) -> SparseAgreementTable:
+    """Counts the annotations of each category for each example into a
+    `SparseAgreementTable`, given the example (`rows`) and category code (`values`)
+    of every annotation. Missing values (-1) are skipped."""
+    annotated = values >= 0
+    cells, counts = np.unique(
+        rows[annotated].astype(np.int64) * n_categories + values[annotated],
+        return_counts=True,
+    )
+    indptr = np.zeros(n_examples + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells // n_categories, minlength=n_examples), out=indptr[1:])
+    return SparseAgreementTable(indptr, cells % n_categories, counts, n_categories)
+
+
+def within_group_pairs(groups: np.ndarray, include_self: bool = False) -> np.ndarray:
+    """Given a sorted array with the group of every item, returns a (P x 2) array
+    with the positions of every ordered pair of items in the same group."""
+    if len(groups) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    group_sizes = np.bincount(groups - groups[0])
+    group_starts = np.cumsum(group_sizes) - group_sizes
+    sizes = group_sizes[groups - groups[0]]
+    starts = group_starts[groups - groups[0]]
+    left = np.repeat(np.arange(len(groups)), sizes)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    right = np.repeat(starts, sizes) + offsets
+    if not include_self:
+        different = left != right
+        left, right = left[different], right[different]
+    return np.stack([left, right], axis=1)
+
+
+def sparse_example_raters(
+    agreement_table: SparseAgreementTable, weights: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The number of raters `ri` of every example of a `SparseAgreementTable`, and
+    the (weighted) number of ordered pairs of raters agreeing on it,
+    `pa_i = sum_k r_ik (r*_ik - 1)`. With non-identity weights, r*_ik needs
+    every pair of non-zero counts within an example."""
+    n_examples, n_categories = agreement_table.shape
+    rows = agreement_table.rows()
+    categories = agreement_table.indices
+    counts = agreement_table.counts.astype(float)
+    if np.array_equal(weights, np.eye(n_categories)):
+        rbar_ik = counts
+    else:
+        pairs = within_group_pairs(rows, include_self=True)
+        k, l = categories[pairs[:, 0]], categories[pairs[:, 1]]
+        rbar_ik = np.bincount(
+            pairs[:, 0], weights[k, l] * counts[pairs[:, 1]], minlength=len(rows)
+        )
+    ri = np.bincount(rows, counts, minlength=n_examples)
+    pa_i = np.bincount(rows, counts * (rbar_ik - 1), minlength=n_examples)
+    return ri, pa_i
+
+
+def sparse_example_terms(
+    agreement_table: SparseAgreementTable, weights: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The (N x 5) scalar terms of every example of a `SparseAgreementTable` (see
+    `example_terms`), and the (nnz x 3) terms each non-zero count adds to the
+    coincident total, proportion and total of its category. Summed, they give
+    `sparse_agreement_statistics`."""
+    rows = agreement_table.rows()
+    counts = agreement_table.counts.astype(float)
+    ri, pa_i = sparse_example_raters(agreement_table, weights)
+    terms, coincident, inverse_ri = _terms_from_raters(ri, pa_i)
+    count_terms = np.stack(
+        [counts * coincident[rows], counts * inverse_ri[rows], counts], axis=-1
+    )
+    return terms, count_terms
+
+
+def sparse_agreement_statistics(
+    agreement_table: SparseAgreementTable, weights: np.ndarray
+) -> np.ndarray:
+    """Same as `agreement_statistics`, for a `SparseAgreementTable`. All work is per
+    non-zero count, so it's proportional to the categories actually used."""
+    n_categories = agreement_table.shape[1]
+    terms, count_terms = sparse_example_terms(agreement_table, weights)
+
+    statistics = np.zeros(N_SCALAR_STATISTICS + 3 * n_categories)
+    scalars, *blocks = split_statistics(statistics, n_categories)
+    scalars += terms.sum(axis=0)
+    for block, column in zip(blocks, count_terms.T):
+        block += np.bincount(agreement_table.indices, column, minlength=n_categories)
+    return statistics
+
+
+def agreement_from_table(
+    agreement_table: Union[np.ndarray, SparseAgreementTable],
+    categories: List[Any],
+    n_annotators: int,
+    weights: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
+    """Calculates the same statistics as `calculate_agreement` from an (N x K)
+    agreement table using array operations. `weights` is a (K x K) matrix of
+    weights between categories, defaulting to the identity (exact agreement).
+
+    Examples without any annotations are ignored. The table can also be a
+    `SparseAgreementTable`."""
+    if weights is None:
+        weights = np.eye(len(categories))
+    if isinstance(agreement_table, SparseAgreementTable):
+        statistics = sparse_agreement_statistics(agreement_table, weights)
+    else:
+        statistics = agreement_statistics(agreement_table, weights)
+    agreement = agreement_from_statistics(statistics, weights)
+    return format_agreement(agreement, categories, n_annotators)
+
+
+def multilabel_statistics(
+    codes: np.ndarray, weights: np.ndarray, chunk_size: int = 100_000
+) -> np.ndarray:
+    """Reduces an (N x A x L) multilabel code array to (L x (5 + 3 * 2)) sufficient
+    statistics, one binary (0/1) agreement table per label."""
+    n_examples, n_annotators, n_labels = codes.shape
+    statistics = np.zeros((n_labels, N_SCALAR_STATISTICS + 3 * 2))
+    for start in range(0, n_examples, chunk_size):
+        statistics += agreement_statistics(
+            _multilabel_tables(codes[start : start + chunk_size]), weights
+        )
+    return statistics
+
+
+def _multilabel_tables(codes: np.ndarray) -> np.ndarray:
+    """(L x N x 2) binary agreement tables of an (N x A x L) multilabel code array."""
+    # Every annotation gives a value for every label, so raters are shared
+    ri = (codes[:, :, :1] >= 0).sum(axis=1)
+    ones = (codes == 1).sum(axis=1)
+    return np.stack([ri - ones, ones], axis=-1).transpose(1, 0, 2)
+
+
+def _label_block_statistics(
+    codes: np.ndarray, task: Tuple[slice, np.ndarray, int]
+) -> np.ndarray:
+    labels, weights, chunk_size = task
+    return multilabel_statistics(codes[:, :, labels], weights, chunk_size)
+
+
+def agreement_from_multilabel_codes(
+    codes: np.ndarray,
+    labels: List[Any],
+    weighting: Weighting = "identity",
+    chunk_size: int = 100_000,
+    n_process: int = 1,
+) -> Tuple[Dict[Any, Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Calculates agreement for every label of an (N x A x L) multilabel code array,
+    where each value is 1 if the annotator selected the label, 0 if they didn't,
+    and -1 if they didn't annotate the example. All labels are computed together
+    as a batch of binary (0/1) agreement tables.
+
+    With `n_process > 1`, the labels are split into blocks that are calculated in
+    a process pool sharing the code array (see `parallel.map_shared`). Results
+    are the same, in the order of `labels`.
+
+    Returns the per-label statistics, and a summary with the `macro` average of
+    the per-label measures and `micro` statistics, which pool every
+    (example, label) pair as a single binary unit."""
+    n_examples, n_annotators, n_labels = codes.shape
+    categories = [0, 1]
+    weights = weight_matrix(categories, weighting)
+    tasks = [
+        (labels_block, weights, chunk_size)
+        for labels_block in split_evenly(n_labels, n_process)
+    ]
+    statistics = np.concatenate(
+        [np.zeros((0, N_SCALAR_STATISTICS + 3 * len(categories)))]
+        + map_shared(_label_block_statistics, codes, tasks, n_process)
+    )
+
+    summary = _multilabel_summary(statistics, labels, weights, n_annotators)
+    return summary["per_label"], {"macro": summary["macro"], "micro": summary["micro"]}
+
+
+def _multilabel_summary(
+    statistics: np.ndarray, labels: List[Any], weights: np.ndarray, n_annotators: int
+) -> Dict[str, Any]:
+    """The `per_label` statistics and the `macro` and `micro` summaries for
+    (L x (5 + 3 * 2)) multilabel statistics."""
+    categories = [0, 1]
+    per_label_agreement = agreement_from_statistics(statistics, weights)
+    per_label = {
+        label: format_agreement(
+            {key: value[i] for key, value in per_label_agreement.items()},
+            categories,
+            n_annotators,
+        )
+        for i, label in enumerate(labels)
+    }
+    micro = format_agreement(
+        agreement_from_statistics(statistics.sum(axis=0), weights),
+        categories,
+        n_annotators,
+    )
+    macro = {}
+    for key in MEASURES:
+        # Labels that nobody (or everybody) selected have undefined measures
+        values = per_label_agreement[key][np.isfinite(per_label_agreement[key])]
+        macro[key] = float(values.mean()) if len(values) else float("nan")
+    return {"per_label": per_label, "macro": macro, "micro": micro}
+
+
+# Above this many categories, `agreement_from_codes` uses a sparse agreement table
+SPARSE_MIN_CATEGORIES = 64
+
+
+def agreement_from_codes(
+    codes: Codes, categories: List[Any], weighting: Weighting = "identity"
+) -> Dict[str, Any]:
+    """Calculates agreement statistics from an (N x A) array of category codes
+    (-1 for missing), as produced by `encode_reliability`, or a `SparseReliability`.
+    For many categories, the agreement table is built and reduced in sparse
+    format. Undefined measures are NaN, see `agreement_from_statistics`."""
+    weights = weight_matrix(categories, weighting)
+    if len(categories) > SPARSE_MIN_CATEGORIES:
+        rows, _, values = annotation_coordinates(codes)
+        agreement_table = sparse_agreement_table(
+            rows, values, codes.shape[0], len(categories)
+        )
+        statistics = sparse_agreement_statistics(agreement_table, weights)
+    else:
+        agreement_table = build_agreement_array(codes, len(categories))
+        statistics = agreement_statistics(agreement_table, weights)
+    agreement = agreement_from_statistics(statistics, weights)
+    return format_agreement(agreement, categories, n_annotators=codes.shape[1])
+
+
+def example_statistics(agreement_table: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Every example's own (..., N, 5 + 3K) statistics for an (..., N, K) agreement
+    table, in the layout of `split_statistics`. Summed over examples, they're
+    the `agreement_statistics`."""
+    table = agreement_table.astype(float)
+    terms, coincident, inverse_ri = example_terms(table, table @ weights.T)
+    return np.concatenate(
+        [terms, table * coincident[..., None], table * inverse_ri[..., None], table],
+        axis=-1,
+    )
+
+
+def sum_by_group(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """Sums the (..., N, S) per-example `values` over the examples of each group,
+    given the group of every example, into a (..., G, S) array."""
+    if values.ndim == 2:
+        # Faster than sorting when there are no batch dimensions
+        return np.stack(
+            [np.bincount(groups, column, minlength=n_groups) for column in values.T],
+            axis=-1,
+        ).reshape(n_groups, values.shape[-1])
+    totals = np.zeros((*values.shape[:-2], n_groups, values.shape[-1]))
+    if len(groups) == 0:
+        return totals
+    order = np.argsort(groups, kind="stable")
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.diff(sorted_groups, prepend=-1))
+    totals[..., sorted_groups[starts], :] = np.add.reduceat(
+        values[..., order, :], starts, axis=-2
+    )
+    return totals
+
+
+def grouped_agreement_statistics(
+    agreement_table: Union[np.ndarray, SparseAgreementTable],
+    weights: np.ndarray,
+    groups: np.ndarray,
+    n_groups: int,
+    chunk_size: int = 100_000,
+) -> np.ndarray:
+    """Like `agreement_statistics`, but sums the statistics of every group of
+    examples separately, given the group (0 to `n_groups - 1`) of every example.
+    Returns (..., G, 5 + 3K) statistics for an (..., N, K) agreement table or a
+    `SparseAgreementTable`. The table is only reduced once, and the overall
+    statistics are the sum over groups."""
+    if isinstance(agreement_table, SparseAgreementTable):
+        n_categories = agreement_table.shape[1]
+        rows = agreement_table.rows()
+        cells = groups[rows] * n_categories + agreement_table.indices
+        counts = agreement_table.counts.astype(float)
+        ri, pa_i = sparse_example_raters(agreement_table, weights)
+        terms, coincident, inverse_ri = _terms_from_raters(ri, pa_i)
+        blocks = [
+            np.bincount(cells, counts * factor, minlength=n_groups * n_categories)
+            for factor in (coincident[rows], inverse_ri[rows], 1.0)
+        ]
+        return np.concatenate(
+            [sum_by_group(terms, groups, n_groups)]
+            + [block.reshape(n_groups, n_categories) for block in blocks],
+            axis=-1,
+        )
+    table = np.asarray(agreement_table)
+    *batch, n_examples, n_categories = table.shape
+    statistics = np.zeros((*batch, n_groups, N_SCALAR_STATISTICS + 3 * n_categories))
+    for start in range(0, n_examples, chunk_size):
+        chunk = table[..., start : start + chunk_size, :].astype(float)
+        statistics += sum_by_group(
+            example_statistics(chunk, weights),
+            groups[start : start + chunk_size],
+            n_groups,
+        )
+    return statistics
+
+
+def _group_annotators(
+    rows: np.ndarray, cols: np.ndarray, groups: np.ndarray, n_groups: int
+) -> np.ndarray:
+    """The number of distinct annotators with annotations in each group."""
+    n_annotators = int(cols.max()) + 1 if len(cols) else 0
+    pairs = np.zeros(n_groups * n_annotators, dtype=bool)
+    pairs[groups[rows] * n_annotators + cols] = True
+    return pairs.reshape(n_groups, n_annotators).sum(axis=1)
+
+
+def agreement_by_group(
+    codes: Codes,
+    categories: List[Any],
+    groups: np.ndarray,
+    group_values: List[Any],
+    weighting: Weighting = "identity",
+) -> Tuple[Dict[Any, Dict[str, Any]], Dict[str, Any]]:
+    """Calculates agreement within every group of examples of an (N x A) array of
+    category codes (-1 for missing) or `SparseReliability`, where example n is in
+    group `group_values[groups[n]]`, e.g. as encoded by
+    `processors.examples_to_codes` with `group_by`. Returns the statistics of
+    every group and the overall statistics, which are the sum of the groups'
+    sufficient statistics, so the annotations are only reduced once."""
+    weights = weight_matrix(categories, weighting)
+    n_groups = len(group_values)
+    rows, cols, values = annotation_coordinates(codes)
+    if len(categories) > SPARSE_MIN_CATEGORIES:
+        agreement_table = sparse_agreement_table(
+            rows, values, codes.shape[0], len(categories)
+        )
+    else:
+        agreement_table = build_agreement_array(codes, len(categories))
+    statistics = grouped_agreement_statistics(
+        agreement_table, weights, groups, n_groups
+    )
+    agreement = agreement_from_statistics(statistics, weights)
+    n_annotators = _group_annotators(rows, cols, groups, n_groups)
+    per_group = {
+        group: format_agreement(
+            {key: value[i] for key, value in agreement.items()},
+            categories,
+            int(n_annotators[i]),
+        )
+        for i, group in enumerate(group_values)
+    }
+    overall = format_agreement(
+        agreement_from_statistics(statistics.sum(axis=0), weights),
+        categories,
+        n_annotators=codes.shape[1],
+    )
+    return per_group, overall
+
+
+def multilabel_agreement_by_group(
+    codes: np.ndarray,
+    labels: List[Any],
+    groups: np.ndarray,
+    group_values: List[Any],
+    weighting: Weighting = "identity",
+    chunk_size: int = 100_000,
+) -> Tuple[Dict[Any, Dict[str, Any]], Dict[str, Any]]:
+    """Like `agreement_by_group`, for an (N x A x L) multilabel code array. Every
+    group's (and the overall) result has the `per_label` statistics and the
+    `macro` and `micro` summaries of `agreement_from_multilabel_codes`."""
+    n_examples, n_annotators, n_labels = codes.shape
+    categories = [0, 1]
+    weights = weight_matrix(categories, weighting)
+    n_groups = len(group_values)
+    statistics = np.zeros((n_labels, n_groups, N_SCALAR_STATISTICS + 3 * 2))
+    for start in range(0, n_examples, chunk_size):
+        chunk = codes[start : start + chunk_size]
+        tables = _multilabel_tables(chunk)
+        statistics += grouped_agreement_statistics(
+            tables, weights, groups[start : start + chunk_size], n_groups
+        )
+    rows, cols = np.nonzero(codes[:, :, 0] >= 0) if n_labels else ([], [])
+    group_annotators = _group_annotators(
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(cols, dtype=np.int64),
+        groups,
+        n_groups,
+    )
+    per_group = {
+        group: _multilabel_summary(
+            statistics[:, i], labels, weights, int(group_annotators[i])
+        )
+        for i, group in enumerate(group_values)
+    }
+    overall = _multilabel_summary(statistics.sum(axis=1), labels, weights, n_annotators)
+    return per_group, overall
+
+
+def reliability_descriptives(reliability: SparseReliability) -> Dict[str, Any]:
+    """The descriptive statistics of `calculate_agreement` (number of examples,
+    categories, annotators etc.), counted directly from a `SparseReliability`."""
+    rows, _, values = annotation_coordinates(reliability)
+    raters_per_example = np.bincount(rows, minlength=reliability.shape[0])
+    n_examples = int((raters_per_example > 0).sum())
+    n_coincident = int((raters_per_example > 1).sum())
+    return {
+        "n_categories": len(np.unique(values)),
+        "n_annotators": reliability.shape[1],
+        "n_examples": n_examples,
+        "n_coincident_examples": n_coincident,
+        "avg_raters_per_example": len(rows) / n_examples if n_examples else np.nan,
+        "n_single_annotation": n_examples - n_coincident,
+    }
+
+
+def calculate_agreement_vectorized(
+    reliability_matrix: Union[List[List[Optional[Any]]], SparseReliability],
+    weighting: Weighting = "identity",
+) -> Dict[str, Any]:
+    """Array-based equivalent of `calculate_agreement`. The reliability matrix is
+    integer-coded and turned into an (N x K) agreement table, and `weighting`
+    is turned into a (K x K) matrix once (see `weight_matrix`). Use this for large
+    datasets, `calculate_agreement` is kept as the reference implementation.
+    A `SparseReliability` is used as is. Unlike the reference, undefined
+    measures are NaN instead of raising, see `agreement_from_statistics`."""
+    if isinstance(reliability_matrix, SparseReliability):
+        return agreement_from_codes(
+            reliability_matrix, reliability_matrix.categories, weighting=weighting
+        )
+    codes, categories = encode_reliability(reliability_matrix)
+    return agreement_from_codes(codes, categories, weighting=weighting)
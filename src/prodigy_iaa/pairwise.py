@@ -0,0 +1,121 @@
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from .measures import (
+    AC_PA_SUM,
+    KRIPP_PA_SUM,
+    MEASURES,
+    N_COINCIDENT,
+    N_COINCIDENT_RATINGS,
+    N_EXAMPLES,
+    N_SCALAR_STATISTICS,
+    Codes,
+    Weighting,
+    agreement_from_statistics,
+    annotation_coordinates,
+    split_statistics,
+    weight_matrix,
+    within_group_pairs,
+)
+
+
+def pairwise_agreement(
+    codes: Codes,
+    categories: List[Any],
+    weighting: Weighting = "identity",
+    chunk_size: int = 100_000,
+) -> Dict[str, np.ndarray]:
+    """Calculates Percent Agreement, Alpha and AC2 for every pair of annotators of
+    an (N x A) code array (-1 for missing) or `SparseReliability`, the same as
+    calculating agreement on the two columns of each pair, returning (A x A)
+    matrices. The diagonal is NaN.
+
+    Instead of one pass per pair, co-occurrences are counted once from every pair
+    of annotations on the same example, so the cost is linear in the number of
+    such pairs. `n_coincident_examples` holds the number of examples each pair
+    of annotators both annotated."""
+    n_examples, n_annotators = codes.shape
+    n_categories = len(categories)
+    weights = weight_matrix(categories, weighting)
+    n_pairs = n_annotators * n_annotators
+
+    rows, cols, values = annotation_coordinates(codes)
+    # Per annotator: annotations per category
+    totals = np.bincount(
+        cols * n_categories + values, minlength=n_annotators * n_categories
+    ).reshape(n_annotators, n_categories)
+
+    shared = np.zeros(n_pairs)
+    # Sum of W[x_a, x_b] and W[x_a, x_a] over shared examples, for pair (a, b)
+    cross_weights = np.zeros(n_pairs)
+    self_weights = np.zeros(n_pairs)
+    # Annotations of a per category on examples shared with b, for pair (a, b)
+    shared_totals = np.zeros(n_pairs * n_categories)
+    # Process whole examples at a time to bound the number of pairs in memory
+    boundaries = np.searchsorted(rows, np.arange(0, n_examples, chunk_size))
+    for start, end in zip(boundaries, np.append(boundaries[1:], len(rows))):
+        if start == end:
+            continue
+        pairs = within_group_pairs(rows[start:end]) + start
+        a, b = cols[pairs[:, 0]], cols[pairs[:, 1]]
+        x_a, x_b = values[pairs[:, 0]], values[pairs[:, 1]]
+        pair = a * n_annotators + b
+        shared += np.bincount(pair, minlength=n_pairs)
+        cross_weights += np.bincount(pair, weights[x_a, x_b], minlength=n_pairs)
+        self_weights += np.bincount(pair, weights[x_a, x_a], minlength=n_pairs)
+        shared_totals += np.bincount(
+            pair * n_categories + x_a, minlength=n_pairs * n_categories
+        )
+    shared = shared.reshape(n_annotators, n_annotators)
+    cross_weights = cross_weights.reshape(n_annotators, n_annotators)
+    self_weights = self_weights.reshape(n_annotators, n_annotators)
+    shared_totals = shared_totals.reshape(n_annotators, n_annotators, n_categories)
+
+    # Sufficient statistics of the two-column reliability matrix of each pair.
+    # Every co-incident example has exactly 2 ratings, x_a and x_b, so
+    # sum_k r_ik (r*_ik - 1) = W[a,a] + W[a,b] + W[b,a] + W[b,b] - 2
+    statistics = np.zeros(
+        (n_annotators, n_annotators, N_SCALAR_STATISTICS + 3 * n_categories)
+    )
+    scalars, coincident_totals, proportions, pair_totals = split_statistics(
+        statistics, n_categories
+    )
+    n_rated = totals.sum(axis=1)
+    pa_sum = (
+        self_weights + self_weights.T + cross_weights + cross_weights.T - 2 * shared
+    )
+    scalars[..., N_EXAMPLES] = n_rated[:, None] + n_rated[None, :] - shared
+    scalars[..., N_COINCIDENT] = shared
+    scalars[..., N_COINCIDENT_RATINGS] = 2 * shared
+    scalars[..., KRIPP_PA_SUM] = pa_sum
+    scalars[..., AC_PA_SUM] = pa_sum / 2
+    coincident_totals[:] = shared_totals + shared_totals.transpose(1, 0, 2)
+    pair_totals[:] = totals[:, None, :] + totals[None, :, :]
+    # Single-annotation examples count fully, shared ones split between the two
+    proportions[:] = pair_totals - coincident_totals / 2
+
+    agreement = agreement_from_statistics(statistics, weights)
+    result = {measure: agreement[measure] for measure in MEASURES}
+    for matrix in result.values():
+        np.fill_diagonal(matrix, np.nan)
+    result["n_coincident_examples"] = shared.astype(int)
+    return result
+
+
+def pairwise_records(
+    pairwise: Dict[str, np.ndarray], annotators: List[Any]
+) -> Iterator[Dict[str, Any]]:
+    """Yields one record per (unordered) pair of annotators, e.g. for export to JSONL.
+    Undefined measures are `None`."""
+    for a in range(len(annotators)):
+        for b in range(a + 1, len(annotators)):
+            record = {
+                "annotator_a": annotators[a],
+                "annotator_b": annotators[b],
+                "n_coincident_examples": int(pairwise["n_coincident_examples"][a, b]),
+            }
+            for measure in MEASURES:
+                value = float(pairwise[measure][a, b])
+                record[measure] = value if np.isfinite(value) else None
+            yield record
@@ -0,0 +1,61 @@
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Set in each worker process by `_attach`, so the shared array is only mapped
+# once per worker instead of being pickled with every task.
+_WORKER_DATA: Dict[str, Any] = {}
+
+
+def _attach(name: str, shape: Tuple[int, ...], dtype: str) -> None:
+    from multiprocessing import shared_memory
+
+    # Workers share the parent's resource tracker, which unlinks the memory if
+    # the parent dies without doing so
+    memory = shared_memory.SharedMemory(name=name)
+    _WORKER_DATA["memory"] = memory
+    _WORKER_DATA["array"] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+
+def _run(function: Callable[[np.ndarray, Any], Any], task: Any) -> Any:
+    return function(_WORKER_DATA["array"], task)
+
+
+def map_shared(
+    function: Callable[[np.ndarray, Any], Any],
+    array: np.ndarray,
+    tasks: Sequence[Any],
+    n_process: int = 1,
+) -> List[Any]:
+    """Returns `[function(array, task) for task in tasks]`, calculated in a pool of
+    `n_process` processes. The array is copied into shared memory once, and
+    every worker maps it instead of receiving a pickled copy with each task,
+    so only the (small) tasks and results are sent between processes. Results
+    are in the order of `tasks`. `function` has to be picklable, i.e. defined
+    at the top level of a module, and mustn't modify the array."""
+    if n_process <= 1 or len(tasks) <= 1:
+        return [function(array, task) for task in tasks]
+    # Only imported here, as they take longer to import than the rest of the package
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    array = np.ascontiguousarray(array)
+    memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[...] = array
+        initargs = (memory.name, array.shape, array.dtype.str)
+        with ProcessPoolExecutor(
+            min(n_process, len(tasks)), initializer=_attach, initargs=initargs
+        ) as pool:
+            return list(pool.map(_run, [function] * len(tasks), tasks))
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def split_evenly(n_items: int, n_splits: int) -> List[slice]:
+    """Splits `range(n_items)` into at most `n_splits` contiguous slices of about
+    equal size, in order."""
+    n_splits = max(1, min(n_splits, n_items))
+    bounds = np.linspace(0, n_items, n_splits + 1).round().astype(int)
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
@@ -1,24 +1,83 @@
-from itertools import groupby
-from typing import Any, Dict, List, Optional
+from array import array
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
-import prodigy
-from prodigy.util import msg
+import numpy as np
+from wasabi import msg
+
+from .cache import AnnotationColumns, cached_sql_annotations, hashable
+from .loaders import (
+    SQL_DIALECTS,
+    VALUE_KEYS,
+    annotation_keys,
+    read_sql_projected,
+    sql_distinct_values,
+)
+from .measures import Codes, SparseReliability, sort_categories
+from .spans import get_spans
 
 ExampleDict = Dict[str, Any]
 
 
+class ReliabilityCodes(NamedTuple):
+    """An integer-encoded (N x A) reliability matrix. `codes[n, a]` is the position
+    in `categories` of the value annotator `annotators[a]` gave to example
+    `examples[n]`, or -1 if not annotated. With `sparse=True`, `codes` is a
+    `SparseReliability` instead of a dense array. If encoded with a `group_by`
+    key, example n is in group `group_values[groups[n]]`. If encoded with a
+    `time_key`, `times` has the time of every annotation, in the same layout as
+    `codes` (NaN if missing)."""
+
+    codes: Codes
+    examples: List[Any]
+    annotators: List[Any]
+    categories: List[Any]
+    groups: Optional[np.ndarray] = None
+    group_values: Optional[List[Any]] = None
+    times: Optional[np.ndarray] = None
+
+    def to_list(self) -> List[List[Optional[Any]]]:
+        """Converts back to an (N x A) list of lists, with `None` for missing values."""
+        if isinstance(self.codes, SparseReliability):
+            return self.codes.to_list()
+        lookup = self.categories + [None]
+        return [[lookup[code] for code in row] for row in self.codes.tolist()]
+
+
+def connect_db():
+    """Connects to Prodigy's database. Prodigy is only imported here, so that
+    everything else works without it."""
+    from prodigy.components.db import connect
+
+    return connect()
+
+
 def _has_single_value(annotations, key: str):
     """Checks if a series of annotations has a single value for a given
     key. Useful for checking that all annotations have the same `view_id` and `label`"""
     return len(set(a.get(key) for a in annotations)) == 1
 
 
+def _validate_single_values(examples: List[ExampleDict]) -> None:
+    if not _has_single_value(examples, "label"):
+        msg.fail(
+            "Multiple `label` values present in dataset. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
+            exits=1,
+        )
+
+    if not _has_single_value(examples, "view_id"):
+        msg.fail(
+            "Multiple `view_id` values present in dataset. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
+            exits=1,
+        )
+
+
 def datasets_to_long(
-    datasets: List[str], dataset_id_key="_dataset_id"
+    datasets: List[str], dataset_id_key="_dataset_id", validate=True, DB=None
 ) -> List[ExampleDict]:
     """Convert annotations from multiple datasets into one long
     dataset, with the source dataset saved as `dataset_id_key`"""
-    DB = prodigy.components.db.connect()
+    if DB is None:
+        DB = connect_db()
     for set_id in datasets:
         if set_id not in DB:
             msg.fail(f"Can't find dataset '{set_id}' in database", exits=1)
@@ -28,18 +87,85 @@ def datasets_to_long(
         for example in examples:
             example[dataset_id_key] = set_id
         all_examples.extend(examples)
-    if not _has_single_value(all_examples, "label"):
-        msg.fail(
-            "Multiple `label` values present in dataset. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
-            exits=1,
+    if validate:
+        _validate_single_values(all_examples)
+    return all_examples
+
+
+def datasets_to_annotations(
+    datasets: List[str],
+    annotator_id="_dataset_id",
+    dataset_id_key="_dataset_id",
+    validate=True,
+    DB=None,
+    cache_dir: Optional[str] = None,
+    value_keys: Tuple[str, ...] = VALUE_KEYS,
+    extra_keys: Tuple[str, ...] = (),
+) -> Union[Iterable[ExampleDict], AnnotationColumns]:
+    """Like `datasets_to_long`, but only loads the keys needed to calculate agreement.
+    For SQLite and PostgreSQL databases the keys are extracted by the database and
+    streamed in pages, and the `label` and `view_id` checks run as aggregate
+    queries, so example content is never deserialized in Python. Other databases
+    fall back to `datasets_to_long`.
+
+    With a `cache_dir`, the encoded annotations are cached on disk and only
+    examples added since the last run are read (see `cache.AnnotationCache`).
+
+    Pass other `value_keys` to load e.g. the `loaders.SPAN_KEYS` instead. Those
+    always fall back to `datasets_to_long`, since the database only extracts
+    the classification keys. `extra_keys` are loaded as well, e.g. a key to group
+    by (dots separate nested keys, see `get_group`) or `_timestamp`. The
+    database extracts those too, but they aren't cached."""
+    if DB is None:
+        DB = connect_db()
+    dialect = getattr(DB, "db_id", None)
+    if tuple(value_keys) != VALUE_KEYS:
+        dialect = None
+    if extra_keys and cache_dir is not None:
+        msg.warn("Caching isn't supported with extra keys")
+        cache_dir = None
+    if dialect not in SQL_DIALECTS and cache_dir is not None:
+        msg.warn(
+            "Caching is only supported for classification annotations in SQLite "
+            "and PostgreSQL databases"
+        )
+    if dialect not in SQL_DIALECTS:
+        examples = datasets_to_long(
+            datasets, dataset_id_key=dataset_id_key, validate=validate, DB=DB
         )
+        keys = annotation_keys(annotator_id, value_keys=value_keys)
+        keys += tuple(k for key in extra_keys for k in group_keys(key))
+        return [{key: eg[key] for key in keys if key in eg} for eg in examples]
 
-    if not _has_single_value(all_examples, "view_id"):
-        msg.fail(
-            "Multiple `view_id` values present in dataset. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
-            exits=1,
+    for set_id in datasets:
+        if set_id not in DB:
+            msg.fail(f"Can't find dataset '{set_id}' in database", exits=1)
+    connection = DB.db.connection()
+    if validate:
+        for key in ("label", "view_id"):
+            if sql_distinct_values(connection, dialect, datasets, key) != 1:
+                msg.fail(
+                    f"Multiple `{key}` values present in dataset. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
+                    exits=1,
+                )
+    if cache_dir is not None:
+        return cached_sql_annotations(
+            connection,
+            dialect,
+            datasets,
+            cache_dir,
+            db_name=getattr(DB, "db_name", ""),
+            annotator_id=annotator_id,
+            dataset_id_key=dataset_id_key,
         )
-    return all_examples
+    return read_sql_projected(
+        connection,
+        dialect,
+        datasets,
+        annotator_id=annotator_id,
+        dataset_id_key=dataset_id_key,
+        extra_keys=extra_keys,
+    )
 
 
 def get_answer(example) -> Optional[str]:
@@ -67,16 +193,287 @@ def get_contains(example, value: str) -> int:
     return int(value in example["accept"])
 
 
+def get_group(example: ExampleDict, key: str) -> Any:
+    """The value of `key` in an example, to group examples by. Dots separate
+    nested keys, e.g. 'meta.source', unless the example has the full key.
+    Returns None if the key is missing."""
+    if key in example:
+        return hashable(example[key])
+    value: Any = example
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return hashable(value)
+
+
+def group_keys(group_by: Optional[str]) -> Tuple[str, ...]:
+    """The top-level example keys needed for `get_group(example, group_by)`."""
+    if group_by is None:
+        return ()
+    return tuple(dict.fromkeys([group_by, group_by.split(".")[0]]))
+
+
+def _sorted_groups(
+    groups: array, group_index: Dict[Any, int]
+) -> Tuple[np.ndarray, List[Any]]:
+    """Re-maps group codes assigned in order of appearance to sorted values."""
+    group_values = sort_categories(group_index)
+    remap = np.empty(len(group_values), dtype=np.int64)
+    remap[[group_index[value] for value in group_values]] = np.arange(len(group_values))
+    return remap[np.frombuffer(groups, dtype=np.int64)], group_values
+
+
 VALUE_GETTERS = {
     "binary": get_answer,
     "multiclass": get_choice,
     "multilabel": get_contains,
+    "ner": get_spans,
+    "spancat": get_spans,
 }
 
 
-def _has_unique_annotations(annotations, key: str) -> bool:
-    """Validate that a set of annotations is unique by `key`"""
-    return len(set(a[key] for a in annotations)) == len(annotations)
+def check_unique_annotations(
+    rows: np.ndarray, cols: np.ndarray, n_annotators: int
+) -> None:
+    """Validate that no annotator annotated the same example more than once.
+    Works on the annotations only, so memory is proportional to their number,
+    not to examples x annotators."""
+    cells = np.sort(np.asarray(rows, dtype=np.int64) * n_annotators + cols)
+    if len(cells) and (cells[1:] == cells[:-1]).any():
+        msg.fail(
+            "Multiple annotations by single annotator for same task. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
+            exits=1,
+        )
+
+
+def examples_to_codes(
+    examples: Iterable[ExampleDict],
+    annotator_id="_session_id",
+    example_id="_task_hash",
+    value_getter=get_answer,
+    sparse: bool = False,
+    group_by: Optional[str] = None,
+    time_key: Optional[str] = None,
+) -> ReliabilityCodes:
+    """Converts a long dataset to an integer-encoded (N x A) reliability matrix in a
+    single pass. Examples keyed by `example_id` and annotators given by
+    `annotator_id` are mapped to row and column positions as they are seen, so
+    the cost is linear in the number of annotations. With `sparse=True`, the codes
+    are kept in coordinate format (`SparseReliability`), so memory depends on the
+    number of annotations rather than examples x annotators. With `group_by`,
+    the group of every example (see `get_group`) is encoded in the same pass,
+    taken from its first annotation. With `time_key`, e.g. Prodigy's
+    '_timestamp', the (numeric) time of every annotation is kept as well."""
+    example_index: Dict[Any, int] = {}
+    annotator_index: Dict[Any, int] = {}
+    category_index: Dict[Any, int] = {}
+    group_index: Dict[Any, int] = {}
+    rows = array("q")
+    cols = array("q")
+    values = array("q")
+    groups = array("q")
+    times = array("d")
+    for example in examples:
+        row = example_index.setdefault(example[example_id], len(example_index))
+        rows.append(row)
+        if group_by is not None and row == len(groups):
+            group = get_group(example, group_by)
+            groups.append(group_index.setdefault(group, len(group_index)))
+        if time_key is not None:
+            time = example.get(time_key)
+            times.append(np.nan if time is None else float(time))
+        cols.append(
+            annotator_index.setdefault(example[annotator_id], len(annotator_index))
+        )
+        value = value_getter(example)
+        if value is None:
+            values.append(-1)
+        else:
+            values.append(category_index.setdefault(value, len(category_index)))
+
+    n_examples, n_annotators = len(example_index), len(annotator_index)
+    rows_ = np.frombuffer(rows, dtype=np.int64)
+    cols_ = np.frombuffer(cols, dtype=np.int64)
+    check_unique_annotations(rows_, cols_, n_annotators)
+    # Codes were assigned in order of appearance, re-map them to sorted categories
+    categories = sort_categories(category_index)
+    remap = np.full(len(categories) + 1, -1, dtype=np.intp)
+    remap[[category_index[c] for c in categories]] = np.arange(len(categories))
+    values_ = remap[np.frombuffer(values, dtype=np.int64)]
+    times_ = np.frombuffer(times, dtype=np.float64)
+    if sparse:
+        annotated = values_ >= 0
+        codes = SparseReliability(
+            rows_[annotated],
+            cols_[annotated],
+            values_[annotated],
+            (n_examples, n_annotators),
+            categories,
+        )
+        times_ = times_[annotated] if time_key is not None else None
+    else:
+        codes = np.full((n_examples, n_annotators), -1, dtype=np.intp)
+        codes[rows_, cols_] = values_
+        if time_key is not None:
+            times_by_cell = np.full((n_examples, n_annotators), np.nan)
+            times_by_cell[rows_, cols_] = times_
+            times_ = times_by_cell
+    reliability = ReliabilityCodes(
+        codes, list(example_index), list(annotator_index), categories
+    )
+    if time_key is not None:
+        reliability = reliability._replace(times=times_)
+    if group_by is not None:
+        groups_, group_values = _sorted_groups(groups, group_index)
+        reliability = reliability._replace(groups=groups_, group_values=group_values)
+    return reliability
+
+
+class MultilabelCodes(NamedTuple):
+    """An (N x A x L) multilabel code array. `codes[n, a, l]` is 1 if annotator
+    `annotators[a]` selected `labels[l]` for example `examples[n]`, 0 if they
+    didn't, and -1 if they didn't annotate the example. Groups are the same as
+    for `ReliabilityCodes`."""
+
+    codes: np.ndarray
+    examples: List[Any]
+    annotators: List[Any]
+    labels: List[Any]
+    groups: Optional[np.ndarray] = None
+    group_values: Optional[List[Any]] = None
+
+
+def examples_to_multilabel_codes(
+    examples: Iterable[ExampleDict],
+    labels: List[Any],
+    annotator_id="_session_id",
+    example_id="_task_hash",
+    group_by: Optional[str] = None,
+) -> MultilabelCodes:
+    """Converts a long dataset to an (N x A x L) multilabel code array in a single
+    pass, treating each of `labels` as a binary classification task, the same as
+    `get_contains` does for a single label. `group_by` works the same as for
+    `examples_to_codes`."""
+    label_index = {label: i for i, label in enumerate(labels)}
+    example_index: Dict[Any, int] = {}
+    annotator_index: Dict[Any, int] = {}
+    group_index: Dict[Any, int] = {}
+    rows = array("q")
+    cols = array("q")
+    groups = array("q")
+    # Annotation position and label position of every selected label
+    selected = array("q")
+    selected_labels = array("q")
+    for example in examples:
+        position = len(rows)
+        row = example_index.setdefault(example[example_id], len(example_index))
+        rows.append(row)
+        if group_by is not None and row == len(groups):
+            group = get_group(example, group_by)
+            groups.append(group_index.setdefault(group, len(group_index)))
+        cols.append(
+            annotator_index.setdefault(example[annotator_id], len(annotator_index))
+        )
+        for label in example["accept"]:
+            if label in label_index:
+                selected.append(position)
+                selected_labels.append(label_index[label])
+
+    n_examples, n_annotators = len(example_index), len(annotator_index)
+    rows_ = np.frombuffer(rows, dtype=np.int64)
+    cols_ = np.frombuffer(cols, dtype=np.int64)
+    check_unique_annotations(rows_, cols_, n_annotators)
+    codes = np.full((n_examples, n_annotators, len(labels)), -1, dtype=np.int8)
+    codes[rows_, cols_] = 0
+    selected_ = np.frombuffer(selected, dtype=np.int64)
+    codes[
+        rows_[selected_], cols_[selected_], np.frombuffer(selected_labels, np.int64)
+    ] = 1
+    reliability = MultilabelCodes(
+        codes, list(example_index), list(annotator_index), list(labels)
+    )
+    if group_by is not None:
+        groups_, group_values = _sorted_groups(groups, group_index)
+        reliability = reliability._replace(groups=groups_, group_values=group_values)
+    return reliability
+
+
+def columns_to_codes(
+    columns: AnnotationColumns, annotation_type: str, sparse: bool = False
+) -> ReliabilityCodes:
+    """Same as `examples_to_codes` with the value getter of `annotation_type`
+    ('binary' or 'multiclass', see `VALUE_GETTERS`), for annotations that were
+    already encoded as `AnnotationColumns`. Works on the arrays directly, so
+    nothing is decoded per annotation."""
+    answers = np.array(columns.answers + [None], dtype=object)
+    if annotation_type == "binary":
+        # Answers other than "accept" and "reject" are missing values
+        is_category = np.isin(answers, ["accept", "reject"])
+        values = np.where(is_category[columns.answer], columns.answer, -1)
+        value_names = columns.answers
+    elif annotation_type == "multiclass":
+        # The first accepted label, if the answer was "accept"
+        first = np.cumsum(columns.n_accept) - columns.n_accept
+        accepted = (answers == "accept")[columns.answer] & (columns.n_accept > 0)
+        values = np.full(len(columns.answer), -1, dtype=np.int64)
+        values[accepted] = columns.accept[first[accepted]]
+        value_names = columns.labels
+    else:
+        raise ValueError(f"Can't convert columns to codes for '{annotation_type}'")
+
+    rows = np.asarray(columns.example)
+    cols = np.asarray(columns.annotator)
+    n_examples, n_annotators = len(columns.examples), len(columns.annotators)
+    check_unique_annotations(rows, cols, n_annotators)
+    used = np.unique(values[values >= 0])
+    categories = sort_categories(value_names[v] for v in used)
+    category_index = {c: i for i, c in enumerate(categories)}
+    remap = np.full(len(value_names) + 1, -1, dtype=np.intp)
+    remap[used] = [category_index[value_names[v]] for v in used]
+    values = remap[values]
+    if sparse:
+        annotated = values >= 0
+        codes = SparseReliability(
+            rows[annotated],
+            cols[annotated],
+            values[annotated],
+            (n_examples, n_annotators),
+            categories,
+        )
+    else:
+        codes = np.full((n_examples, n_annotators), -1, dtype=np.intp)
+        codes[rows, cols] = values
+    return ReliabilityCodes(
+        codes, list(columns.examples), list(columns.annotators), categories
+    )
+
+
+def columns_to_multilabel_codes(
+    columns: AnnotationColumns, labels: List[Any]
+) -> MultilabelCodes:
+    """Same as `examples_to_multilabel_codes`, for annotations that were already
+    encoded as `AnnotationColumns`."""
+    rows = np.asarray(columns.example)
+    cols = np.asarray(columns.annotator)
+    n_examples, n_annotators = len(columns.examples), len(columns.annotators)
+    check_unique_annotations(rows, cols, n_annotators)
+    label_index = {label: i for i, label in enumerate(labels)}
+    # Position in `labels` of every label in the vocabulary, -1 if not requested
+    label_positions = np.array(
+        [label_index.get(label, -1) for label in columns.labels] + [-1],
+        dtype=np.int64,
+    )
+    codes = np.full((n_examples, n_annotators, len(labels)), -1, dtype=np.int8)
+    codes[rows, cols] = 0
+    annotation = np.repeat(np.arange(len(rows)), columns.n_accept)
+    selected = label_positions[columns.accept]
+    requested = selected >= 0
+    annotation = annotation[requested]
+    codes[rows[annotation], cols[annotation], selected[requested]] = 1
+    return MultilabelCodes(
+        codes, list(columns.examples), list(columns.annotators), list(labels)
+    )
 
 
 def examples_to_reliability(
@@ -84,33 +481,18 @@ def examples_to_reliability(
     annotator_id="_session_id",
     example_id="_task_hash",
     value_getter=get_answer,
-) -> List[List[Optional[Any]]]:
+    sparse: bool = False,
+) -> Union[List[List[Optional[Any]]], SparseReliability]:
     """Converts a long dataset to an (N x A) reliability matrix, where N is the number
     of unique examples keyed by `example_id` and A is the number of unique annotators
     given by `annotator_id`, and the value is the annotation given by annotator A to example N
-    (or None if not annotated)"""
-    annotators = tuple(set(example[annotator_id] for example in examples))
-    grouped_by_task = groupby(
-        sorted(examples, key=lambda x: x[example_id]), lambda x: x[example_id]
+    (or None if not annotated). With `sparse=True`, returns a `SparseReliability`
+    that `calculate_agreement` accepts as well, without any `None` padding."""
+    reliability = examples_to_codes(
+        examples,
+        annotator_id=annotator_id,
+        example_id=example_id,
+        value_getter=value_getter,
+        sparse=sparse,
     )
-    reliability_matrix = []
-    for _, task_annotations in grouped_by_task:
-        task_annotations = list(task_annotations)
-        if not _has_unique_annotations(task_annotations, annotator_id):
-            msg.fail(
-                "Multiple annotations by single annotator for same task. Export your data to JSONL, clean it up, and try again with the 'iaa.jsonl' recipe.",
-                exits=1,
-            )
-        task_values = []
-        for annotator in annotators:
-            value = next(
-                (
-                    value_getter(ex)
-                    for ex in task_annotations
-                    if ex[annotator_id] == annotator
-                ),
-                None,
-            )
-            task_values.append(value)
-        reliability_matrix.append(task_values)
-    return reliability_matrix
+    return reliability.codes if sparse else reliability.to_list()
@@ -0,0 +1,123 @@
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ProfileRecord = Dict[str, Any]
+
+_PROC_STATUS = Path("/proc/self/status")
+_PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MB, `None` if unavailable. On
+    Linux this is the high-water mark since `reset_peak_rss` was last called."""
+    try:
+        for line in _PROC_STATUS.read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def reset_peak_rss() -> bool:
+    """Resets the peak RSS to the current RSS, so it measures only what comes
+    after. Only possible on Linux, returns whether it worked."""
+    try:
+        _PROC_CLEAR_REFS.write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+class Profiler:
+    """Records wall time, peak RSS and item counts per stage, e.g. of
+    `recipe.iaa_dispatch`:
+
+        profiler = Profiler()
+        with profiler.stage("measures", count=len(examples)):
+            ...
+        print(profiler.records)
+
+    `callback` is called with every record as its stage finishes, e.g. to send
+    it to a monitoring system. A disabled profiler records nothing and adds no
+    overhead, so code can always be instrumented.
+
+    Peak RSS is reset at the start of each stage where the OS allows it (Linux),
+    so it's the peak during the stage. Elsewhere it's the peak of the process so
+    far."""
+
+    def __init__(
+        self,
+        callback: Optional[Callable[[ProfileRecord], None]] = None,
+        enabled: bool = True,
+    ):
+        self.callback = callback
+        self.enabled = enabled
+        self.records: List[ProfileRecord] = []
+        # Peak RSS seen within each open stage, to pass on to enclosing stages
+        self._open_peaks: List[Optional[float]] = []
+
+    def _finish(self, record: ProfileRecord) -> None:
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    @contextmanager
+    def stage(self, name: str, count: Optional[int] = None, **info: Any):
+        """Times the code in the `with` block as stage `name`. `count` is the number
+        of items processed, and can also be set later on the yielded record.
+        Extra keyword arguments (e.g. `label`) are added to the record."""
+        record: ProfileRecord = {"stage": name, **info, "count": count}
+        if not self.enabled:
+            yield record
+            return
+        if self._open_peaks:
+            # Keep the enclosing stage's peak before it's reset
+            outer = peak_rss_mb()
+            self._open_peaks[-1] = max(self._open_peaks[-1] or 0, outer or 0)
+        reset_peak_rss()
+        self._open_peaks.append(None)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            peak = max(self._open_peaks.pop() or 0, peak_rss_mb() or 0)
+            record["peak_rss_mb"] = peak or None
+            if self._open_peaks:
+                self._open_peaks[-1] = max(self._open_peaks[-1] or 0, peak)
+            self._finish(record)
+
+    def iterate(self, name: str, items: Iterable[Any]) -> Iterator[Any]:
+        """Yields from `items`, recording the time spent producing them (e.g. reading
+        from a database or file) and their number as stage `name` once
+        exhausted. The consumer's time isn't included."""
+        if not self.enabled:
+            yield from items
+            return
+        record: ProfileRecord = {"stage": name, "count": 0, "seconds": 0.0}
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                record["seconds"] += time.perf_counter() - start
+                break
+            record["seconds"] += time.perf_counter() - start
+            record["count"] += 1
+            yield item
+        record["peak_rss_mb"] = peak_rss_mb()
+        self._finish(record)
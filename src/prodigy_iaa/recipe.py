@@ -1,20 +1,93 @@
-from functools import partial
-from typing import Callable, Dict, List
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import prodigy
 import srsly
 from prodigy.util import msg
-from prodigy.components.loaders import JSONL
 
-from .measures import calculate_agreement
-from .processors import VALUE_GETTERS, datasets_to_long, examples_to_reliability
-from .render import render_descriptives, render_stats
+from .arrow import read_arrow_annotations
+from .batch import FILE_TYPES, jsonable, read_manifest, run_batch
+from .bootstrap import bootstrap_agreement
+from .cache import AnnotationColumns, cached_jsonl_annotations
+from .contested import contested_records, most_contested
+from .influence import influence_records, leave_one_out_agreement
+from .loaders import SPAN_KEYS, VALUE_KEYS, annotation_keys, read_jsonl_projected
+from .measures import (
+    WEIGHTINGS,
+    agreement_by_group,
+    agreement_from_codes,
+    agreement_from_multilabel_codes,
+    annotation_coordinates,
+    multilabel_agreement_by_group,
+    sparse_agreement_table,
+    weight_matrix,
+)
+from .pairwise import pairwise_agreement, pairwise_records
+from .processors import (
+    VALUE_GETTERS,
+    columns_to_codes,
+    columns_to_multilabel_codes,
+    datasets_to_annotations,
+    examples_to_codes,
+    examples_to_multilabel_codes,
+    group_keys,
+)
+from .profiling import Profiler
+from .render import (
+    render_descriptives,
+    render_group_summary,
+    render_influence,
+    render_multilabel_summary,
+    render_pairwise_summary,
+    render_profile,
+    render_span_descriptives,
+    render_span_summary,
+    render_stats,
+    render_windows,
+)
+from .shards import SHARD_TYPES, shard_paths, sharded_agreement
+from .spans import (
+    examples_to_spans,
+    span_agreement,
+    span_pairwise_records,
+    token_agreement,
+)
+from .watch import WATCH_TYPES, JsonlWatcher
+from .windows import parse_duration, windowed_agreement
+
+SPAN_TYPES = ("ner", "spancat")
+# Prodigy sets the time an example was annotated (in seconds) under this key
+TIME_KEY = "_timestamp"
 
 ANNOTATION_TYPE_HELP = (
     "Type of annotations, can be 'binary' (from `classification` interface, uses 'answer' key), "
     "'multiclass' (from `choices` interface, uses first value in 'accept' key), or "
-    "'multilabel' (from `choices` interface, treats every possible label as a binary classification task)."
+    "'multilabel' (from `choices` interface, treats every possible label as a binary classification task), "
+    "'ner' or 'spancat' (from `ner_manual` or `spans_manual` interface, uses 'spans' key)."
+)
+WEIGHTING_HELP = (
+    "Weighting between categories for Alpha and AC2. Defaults to 'identity' (exact agreement). "
+    f"One of: {', '.join(WEIGHTINGS)}. Non-identity weightings use the sorted category order."
+)
+PAIRWISE_HELP = "JSONL file to export the agreement between every pair of annotators to. Also prints a per-annotator summary ('binary' and 'multiclass' only). For 'ner' and 'spancat', exports span precision, recall and F1."
+INFLUENCE_HELP = "Rank annotators by how much agreement changes when leaving each of them out ('binary' and 'multiclass' only)."
+CONTESTED_HELP = "JSONL file to export the most contested examples to, by per-example agreement, e.g. to review them ('binary' and 'multiclass' only)."
+TOP_K_HELP = "Number of most contested examples to export with --contested-output. Defaults to 100."
+N_PROCESS_HELP = "Number of processes to calculate labels ('multilabel') or bootstrap resamples in. Defaults to 1."
+GROUP_BY_HELP = "Example key to break agreement down by, e.g. 'meta.source' (dots separate nested keys). Prints the agreement within every group and overall ('binary', 'multiclass' and 'multilabel' only)."
+GROUP_OUTPUT_HELP = (
+    "JSON file to save the per-group and overall agreement of --group-by to."
+)
+WINDOW_HELP = "Also calculate agreement in time windows of this length by the examples' '_timestamp', e.g. '7d' to see how agreement changes week by week. Units: s, m, h, d, w ('binary' and 'multiclass' only)."
+WINDOW_STEP_HELP = "Start a new window this often, e.g. '1d' for rolling 7-day windows with --window 7d. Defaults to the window length (non-overlapping windows)."
+WINDOW_OUTPUT_HELP = (
+    "JSONL file to export the agreement of every time window of --window to."
 )
+CACHE_HELP = "Directory to cache the encoded annotations in. Later runs only read examples added since. Off by default."
+PROFILE_HELP = "Record time and peak memory per stage. Print them as a 'table', as 'json', or save them to a JSON file (any other value)."
+BOOTSTRAP_HELP = "Number of bootstrap resamples for 95% confidence intervals ('binary' and 'multiclass' only). Off by default."
 
 
 def iaa_dispatch(
@@ -23,35 +96,358 @@ def iaa_dispatch(
     value_getter: Callable[[Dict], str],
     labels: List[str],
     dataset_id_key: str,
+    weighting: str = "identity",
+    bootstrap: int = 0,
+    pairwise_output: Optional[str] = None,
+    influence: bool = False,
+    profiler: Optional[Profiler] = None,
+    contested_output: Optional[str] = None,
+    top_k: int = 100,
+    n_process: int = 1,
+    group_by: Optional[str] = None,
+    group_output: Optional[str] = None,
+    window: Optional[str] = None,
+    window_step: Optional[str] = None,
+    window_output: Optional[str] = None,
 ):
-    if annotation_type in ("binary", "multiclass"):
-        reliability_matrix = examples_to_reliability(
-            examples, annotator_id=dataset_id_key, value_getter=value_getter
-        )
-        agreement_stats = calculate_agreement(
-            reliability_matrix,
+    """Calculates and prints agreement for the examples. Pass a `Profiler` to
+    record the time and memory of each stage. With `group_by`, also prints the
+    agreement within every group of examples with the same value of that key,
+    and with a `window`, the agreement in every time window."""
+    if weighting not in WEIGHTINGS:
+        msg.fail(
+            f"Invalid `weighting` passed, choose one of: {', '.join(WEIGHTINGS)}",
+            exits=1,
         )
-        msg.info("Annotation Statistics")
-        print(render_descriptives(agreement_stats))
-        print()
-        msg.info("Agreement Statistics")
-        print(render_stats(agreement_stats))
+    try:
+        for duration in (window, window_step):
+            if duration is not None:
+                parse_duration(duration)
+    except ValueError as e:
+        msg.fail(f"Invalid time window: {e}", exits=1)
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+    if not isinstance(examples, AnnotationColumns):
+        examples = profiler.iterate("read", examples)
+    else:
+        if group_by is not None:
+            msg.warn("Grouping isn't available for cached annotations")
+            group_by = None
+        if window is not None:
+            msg.warn("Time windows aren't available for cached or Parquet annotations")
+            window = None
+    if group_by is None and group_output is not None:
+        msg.warn("Pass --group-by to save agreement by group")
+    if window is None and window_output is not None:
+        msg.warn("Pass --window to save agreement by time window")
+    if annotation_type in ("binary", "multiclass"):
+        with profiler.stage("encode") as record:
+            if isinstance(examples, AnnotationColumns):
+                reliability = columns_to_codes(examples, annotation_type, sparse=True)
+            else:
+                reliability = examples_to_codes(
+                    examples,
+                    annotator_id=dataset_id_key,
+                    value_getter=value_getter,
+                    sparse=True,
+                    group_by=group_by,
+                    time_key=TIME_KEY if window is not None else None,
+                )
+            record["count"] = len(reliability.codes.rows)
+        try:
+            weight_matrix(reliability.categories, weighting)
+        except ValueError as e:
+            msg.fail(
+                f"Invalid `weighting` passed: {e}. Only 'identity' and 'ordinal' "
+                "work with non-numeric categories.",
+                exits=1,
+            )
+        with profiler.stage("measures", count=len(reliability.codes.rows)):
+            if group_by is not None:
+                # The overall statistics are the sum of the groups', so both come
+                # from one pass over the annotations
+                per_group, agreement_stats = agreement_by_group(
+                    reliability.codes,
+                    reliability.categories,
+                    reliability.groups,
+                    reliability.group_values,
+                    weighting=weighting,
+                )
+            else:
+                agreement_stats = agreement_from_codes(
+                    reliability.codes, reliability.categories, weighting=weighting
+                )
+        with profiler.stage("render"):
+            msg.info("Annotation Statistics")
+            print(render_descriptives(agreement_stats))
+            print()
+        intervals = None
+        if bootstrap:
+            with profiler.stage("bootstrap", count=bootstrap):
+                rows, _, values = annotation_coordinates(reliability.codes)
+                intervals = bootstrap_agreement(
+                    sparse_agreement_table(
+                        rows,
+                        values,
+                        reliability.codes.shape[0],
+                        len(reliability.categories),
+                    ),
+                    reliability.categories,
+                    weighting=weighting,
+                    n_samples=bootstrap,
+                    n_process=n_process,
+                )
+        with profiler.stage("render"):
+            msg.info("Agreement Statistics")
+            print(render_stats(agreement_stats, intervals))
+        if group_by is not None:
+            _report_groups(group_by, per_group, agreement_stats, group_output)
+        if window is not None:
+            with profiler.stage("windows") as record:
+                windows = windowed_agreement(
+                    reliability.codes,
+                    reliability.categories,
+                    reliability.times,
+                    window,
+                    window_step,
+                    weighting=weighting,
+                )
+                record["count"] = len(windows)
+            _report_windows(windows, window_output)
+        if pairwise_output is not None:
+            n_annotators = len(reliability.annotators)
+            with profiler.stage("pairwise", count=n_annotators * (n_annotators - 1)):
+                pairwise = pairwise_agreement(
+                    reliability.codes, reliability.categories, weighting=weighting
+                )
+                srsly.write_jsonl(
+                    pairwise_output, pairwise_records(pairwise, reliability.annotators)
+                )
+            with profiler.stage("render"):
+                print()
+                msg.info("Pairwise Agreement Summary")
+                print(render_pairwise_summary(pairwise, reliability.annotators))
+                msg.good(f"Saved pairwise agreement to {pairwise_output}")
+        if influence:
+            with profiler.stage("influence", count=len(reliability.annotators)):
+                leave_one_out = leave_one_out_agreement(
+                    reliability.codes, reliability.categories, weighting=weighting
+                )
+            with profiler.stage("render"):
+                print()
+                msg.info("Annotator Influence")
+                print(
+                    render_influence(
+                        influence_records(leave_one_out, reliability.annotators)
+                    )
+                )
+        if contested_output is not None:
+            with profiler.stage("contested", count=top_k):
+                contested = most_contested(
+                    reliability.codes, reliability.categories, top_k, weighting
+                )
+                srsly.write_jsonl(
+                    contested_output,
+                    contested_records(
+                        contested,
+                        reliability.codes,
+                        reliability.examples,
+                        reliability.annotators,
+                        reliability.categories,
+                    ),
+                )
+            msg.good(
+                f"Saved {len(contested.rows)} most contested examples to {contested_output}"
+            )
+    else:
+        if contested_output is not None:
+            msg.warn(
+                "Contested examples are only available for 'binary' and 'multiclass'"
+            )
+        if window is not None:
+            msg.warn("Time windows are only available for 'binary' and 'multiclass'")
+    if annotation_type in SPAN_TYPES:
+        if group_by is not None:
+            msg.warn("Agreement by group isn't available for spans")
+        if bootstrap:
+            msg.warn("Bootstrap confidence intervals aren't available for spans")
+        if influence:
+            msg.warn("Annotator influence isn't available for spans")
+        if weighting != "identity":
+            msg.warn("Span labels are always compared with 'identity' weighting")
+        with profiler.stage("encode") as record:
+            spans = examples_to_spans(
+                examples, annotator_id=dataset_id_key, value_getter=value_getter
+            )
+            record["count"] = len(spans.starts)
+        with profiler.stage("measures", count=len(spans.starts)):
+            span_stats = span_agreement(spans)
+            token_stats = token_agreement(spans)
+        with profiler.stage("render"):
+            msg.info("Annotation Statistics")
+            print(render_span_descriptives(spans))
+            print()
+            msg.info("Span Agreement")
+            print(render_span_summary(span_stats))
+            print()
+            msg.info("Token Agreement Statistics")
+            print(render_stats(token_stats))
+        if pairwise_output is not None:
+            n_annotators = len(spans.annotators)
+            with profiler.stage("pairwise", count=n_annotators * (n_annotators - 1)):
+                srsly.write_jsonl(
+                    pairwise_output, span_pairwise_records(span_stats, spans.annotators)
+                )
+            msg.good(f"Saved pairwise span agreement to {pairwise_output}")
     if annotation_type == "multilabel":
         if not labels:
             msg.fail("Comma separated label values required for 'multilabel'", exits=1)
-        for label in labels:
-            label_value_getter = partial(value_getter, value=label)
-            reliability_matrix = examples_to_reliability(
-                examples,
-                annotator_id=dataset_id_key,
-                value_getter=label_value_getter,
-            )
-            agreement_stats = calculate_agreement(reliability_matrix)
-            msg.info(f"Annotation Statistics. LABEL: {label}")
-            print(render_descriptives(agreement_stats))
+        if bootstrap:
+            msg.warn("Bootstrap confidence intervals aren't available for 'multilabel'")
+        if pairwise_output is not None:
+            msg.warn("Pairwise agreement isn't available for 'multilabel'")
+        if influence:
+            msg.warn("Annotator influence isn't available for 'multilabel'")
+        with profiler.stage("encode") as record:
+            if isinstance(examples, AnnotationColumns):
+                reliability = columns_to_multilabel_codes(examples, labels)
+            else:
+                reliability = examples_to_multilabel_codes(
+                    examples, labels, annotator_id=dataset_id_key, group_by=group_by
+                )
+            record["count"] = int((reliability.codes[..., 0] >= 0).sum())
+        # All labels are calculated in one batch, so only rendering is per label
+        with profiler.stage("measures", count=len(labels)):
+            if group_by is not None:
+                per_group, overall = multilabel_agreement_by_group(
+                    reliability.codes,
+                    reliability.labels,
+                    reliability.groups,
+                    reliability.group_values,
+                    weighting=weighting,
+                )
+                per_label_stats = overall["per_label"]
+                summary = {"macro": overall["macro"], "micro": overall["micro"]}
+            else:
+                per_label_stats, summary = agreement_from_multilabel_codes(
+                    reliability.codes,
+                    reliability.labels,
+                    weighting=weighting,
+                    n_process=n_process,
+                )
+        for label, agreement_stats in per_label_stats.items():
+            with profiler.stage(
+                "render", count=agreement_stats["n_examples"], label=label
+            ):
+                msg.info(f"Annotation Statistics. LABEL: {label}")
+                print(render_descriptives(agreement_stats))
+                print()
+                msg.info(f"Agreement Statistics. LABEL: {label}")
+                print(render_stats(agreement_stats))
+        with profiler.stage("render"):
             print()
-            msg.info(f"Agreement Statistics. LABEL: {label}")
-            print(render_stats(agreement_stats))
+            msg.info("Agreement Summary")
+            print(render_multilabel_summary(per_label_stats, summary))
+        if group_by is not None:
+            _report_groups(group_by, per_group, overall, group_output)
+
+
+def _report_windows(
+    windows: List[Dict[str, Any]], window_output: Optional[str] = None
+) -> None:
+    """Prints the agreement in every time window, and saves it as JSONL to
+    `window_output`."""
+    print()
+    if not windows:
+        msg.warn(f"No annotations with a '{TIME_KEY}' for time windows")
+        return
+    msg.info("Agreement by Time Window")
+    print(render_windows(windows))
+    if window_output is not None:
+        srsly.write_jsonl(window_output, [jsonable(record) for record in windows])
+        msg.good(f"Saved agreement of {len(windows)} time windows to {window_output}")
+
+
+def _report_groups(
+    group_by: str,
+    per_group: Dict[Any, Dict[str, Any]],
+    overall: Dict[str, Any],
+    group_output: Optional[str] = None,
+) -> None:
+    """Prints the agreement by group as a table, using the `micro` statistics for
+    'multilabel', and saves it as JSON to `group_output`."""
+
+    def summary(stats):
+        return stats["micro"] if "micro" in stats else stats
+
+    def record(stats):
+        if "micro" not in stats:
+            return jsonable(stats)
+        per_label = stats["per_label"].items()
+        return {
+            "per_label": {str(label): jsonable(s) for label, s in per_label},
+            "macro": jsonable(stats["macro"]),
+            "micro": jsonable(stats["micro"]),
+        }
+
+    print()
+    msg.info(f"Agreement by '{group_by}'")
+    print(
+        render_group_summary(
+            {group: summary(stats) for group, stats in per_group.items()},
+            summary(overall),
+        )
+    )
+    if group_output is not None:
+        srsly.write_json(
+            group_output,
+            {
+                "group_by": group_by,
+                # A list, since group values don't have to be strings
+                "groups": [
+                    {"group": group, **record(stats)}
+                    for group, stats in per_group.items()
+                ],
+                "overall": record(overall),
+            },
+        )
+        msg.good(f"Saved agreement by group to {group_output}")
+
+
+def _value_keys(annotation_type: str) -> Tuple[str, ...]:
+    return SPAN_KEYS if annotation_type in SPAN_TYPES else VALUE_KEYS
+
+
+def _extra_keys(group_by: Optional[str], window: Optional[str]) -> Tuple[str, ...]:
+    """The keys needed for `group_by` and `window`, besides the value keys."""
+    keys = (group_by,) if group_by is not None else ()
+    return keys + (TIME_KEY,) if window is not None else keys
+
+
+def _example_keys(
+    annotation_type: str, group_by: Optional[str], window: Optional[str]
+) -> Tuple[str, ...]:
+    """The value keys, plus the top-level keys needed for `group_by` and `window`."""
+    keys = _extra_keys(group_by, window)
+    return _value_keys(annotation_type) + tuple(
+        k for key in keys for k in group_keys(key)
+    )
+
+
+def _report_profile(profiler: Profiler, profile: Optional[str]) -> None:
+    """Prints the profile as a table ("table"), as JSON ("json"), or saves it as
+    JSON to a file (any other value)."""
+    if profile is None:
+        return
+    if profile == "table":
+        print()
+        msg.info("Profile")
+        print(render_profile(profiler.records))
+    elif profile == "json":
+        print(srsly.json_dumps(profiler.records))
+    else:
+        srsly.write_json(profile, profiler.records)
+        msg.good(f"Saved profile to {profile}")
 
 
 @prodigy.recipe(
@@ -60,9 +456,41 @@ def iaa_dispatch(
     datasets=("Datasets to get examples from. Assuming one dataset per annotator. Comma separated values.", "positional", None, prodigy.util.split_string),
     annotation_type=(ANNOTATION_TYPE_HELP, "positional", None, str),
     labels=("Labels for when annotation type is 'multiclass'. Comma separated values.", "option", None, prodigy.util.split_string),
+    weighting=(WEIGHTING_HELP, "option", "w", str),
+    bootstrap=(BOOTSTRAP_HELP, "option", "b", int),
+    pairwise_output=(PAIRWISE_HELP, "option", "p", str),
+    influence=(INFLUENCE_HELP, "flag", "i", bool),
+    cache_dir=(CACHE_HELP, "option", "c", str),
+    profile=(PROFILE_HELP, "option", "P", str),
+    contested_output=(CONTESTED_HELP, "option", "x", str),
+    top_k=(TOP_K_HELP, "option", "k", int),
+    n_process=(N_PROCESS_HELP, "option", "n", int),
+    group_by=(GROUP_BY_HELP, "option", "g", str),
+    group_output=(GROUP_OUTPUT_HELP, "option", "G", str),
+    window=(WINDOW_HELP, "option", "W", str),
+    window_step=(WINDOW_STEP_HELP, "option", "S", str),
+    window_output=(WINDOW_OUTPUT_HELP, "option", "O", str),
     # fmt: on
 )
-def iaa_datasets(datasets: List[str], annotation_type: str, labels: List[str]):
+def iaa_datasets(
+    datasets: List[str],
+    annotation_type: str,
+    labels: List[str],
+    weighting: Optional[str] = None,
+    bootstrap: int = 0,
+    pairwise_output: Optional[str] = None,
+    influence: bool = False,
+    cache_dir: Optional[str] = None,
+    profile: Optional[str] = None,
+    contested_output: Optional[str] = None,
+    top_k: Optional[int] = None,
+    n_process: Optional[int] = None,
+    group_by: Optional[str] = None,
+    group_output: Optional[str] = None,
+    window: Optional[str] = None,
+    window_step: Optional[str] = None,
+    window_output: Optional[str] = None,
+):
     """Calculates IAA using Percent (Simple) Agreement, Krippendorff's `Alpha`, and Gwet's `AC2` given a unique dataset per annotator."""
     value_getter = VALUE_GETTERS.get(annotation_type)
     if value_getter is None:
@@ -71,9 +499,42 @@ def iaa_datasets(datasets: List[str], annotation_type: str, labels: List[str]):
     for set_id in datasets:
         if set_id not in DB:
             msg.fail(f"Can't find dataset '{set_id}' in database", exits=1)
-    examples = datasets_to_long(datasets, dataset_id_key="_dataset_id")
+    if cache_dir is not None and (group_by is not None or window is not None):
+        msg.warn("Caching isn't supported with --group-by or --window")
+        cache_dir = None
+    profiler = Profiler(enabled=profile is not None)
+    with profiler.stage("load"):
+        examples = datasets_to_annotations(
+            datasets,
+            annotator_id="_dataset_id",
+            dataset_id_key="_dataset_id",
+            DB=DB,
+            cache_dir=cache_dir,
+            value_keys=_value_keys(annotation_type),
+            extra_keys=_extra_keys(group_by, window),
+        )
 
-    iaa_dispatch(examples, annotation_type, value_getter, labels, "_dataset_id")
+    iaa_dispatch(
+        examples,
+        annotation_type,
+        value_getter,
+        labels,
+        "_dataset_id",
+        weighting=weighting or "identity",
+        bootstrap=bootstrap or 0,
+        pairwise_output=pairwise_output,
+        influence=influence,
+        profiler=profiler,
+        contested_output=contested_output,
+        top_k=top_k or 100,
+        n_process=n_process or 1,
+        group_by=group_by,
+        group_output=group_output,
+        window=window,
+        window_step=window_step,
+        window_output=window_output,
+    )
+    _report_profile(profiler, profile)
 
 
 @prodigy.recipe(
@@ -83,10 +544,41 @@ def iaa_datasets(datasets: List[str], annotation_type: str, labels: List[str]):
     annotation_type=(ANNOTATION_TYPE_HELP, "positional", None, str),
     labels=("Labels for when annotation type is 'multiclass'. Comma separated values.", "option", None, prodigy.util.split_string),
     dataset_id_key=("Per-Example key with annotator ID. Defaults to '_session_id'", "option", None, str),
+    weighting=(WEIGHTING_HELP, "option", "w", str),
+    bootstrap=(BOOTSTRAP_HELP, "option", "b", int),
+    pairwise_output=(PAIRWISE_HELP, "option", "p", str),
+    influence=(INFLUENCE_HELP, "flag", "i", bool),
+    cache_dir=(CACHE_HELP, "option", "c", str),
+    profile=(PROFILE_HELP, "option", "P", str),
+    contested_output=(CONTESTED_HELP, "option", "x", str),
+    top_k=(TOP_K_HELP, "option", "k", int),
+    n_process=(N_PROCESS_HELP, "option", "n", int),
+    group_by=(GROUP_BY_HELP, "option", "g", str),
+    group_output=(GROUP_OUTPUT_HELP, "option", "G", str),
+    window=(WINDOW_HELP, "option", "W", str),
+    window_step=(WINDOW_STEP_HELP, "option", "S", str),
+    window_output=(WINDOW_OUTPUT_HELP, "option", "O", str),
     # fmt: on
 )
 def iaa_sessions(
-    dataset: List[str], annotation_type: str, labels: List[str], dataset_id_key: str
+    dataset: List[str],
+    annotation_type: str,
+    labels: List[str],
+    dataset_id_key: str,
+    weighting: Optional[str] = None,
+    bootstrap: int = 0,
+    pairwise_output: Optional[str] = None,
+    influence: bool = False,
+    cache_dir: Optional[str] = None,
+    profile: Optional[str] = None,
+    contested_output: Optional[str] = None,
+    top_k: Optional[int] = None,
+    n_process: Optional[int] = None,
+    group_by: Optional[str] = None,
+    group_output: Optional[str] = None,
+    window: Optional[str] = None,
+    window_step: Optional[str] = None,
+    window_output: Optional[str] = None,
 ):
     """Calculates IAA using Percent (Simple) Agreement, Krippendorff's `Alpha`, and Gwet's `AC2` assuming multiple annotators within dataset."""
     value_getter = VALUE_GETTERS.get(annotation_type)
@@ -96,11 +588,44 @@ def iaa_sessions(
     DB = prodigy.components.db.connect()
     if dataset not in DB:
         msg.fail(f"Can't find dataset '{dataset}' in database", exits=1)
-    examples = DB.get_dataset_examples(dataset)
     if dataset_id_key is None:
         dataset_id_key = "_session_id"
+    if cache_dir is not None and (group_by is not None or window is not None):
+        msg.warn("Caching isn't supported with --group-by or --window")
+        cache_dir = None
+    profiler = Profiler(enabled=profile is not None)
+    with profiler.stage("load"):
+        examples = datasets_to_annotations(
+            [dataset],
+            annotator_id=dataset_id_key,
+            validate=False,
+            DB=DB,
+            cache_dir=cache_dir,
+            value_keys=_value_keys(annotation_type),
+            extra_keys=_extra_keys(group_by, window),
+        )
 
-    iaa_dispatch(examples, annotation_type, value_getter, labels, dataset_id_key)
+    iaa_dispatch(
+        examples,
+        annotation_type,
+        value_getter,
+        labels,
+        dataset_id_key,
+        weighting=weighting or "identity",
+        bootstrap=bootstrap or 0,
+        pairwise_output=pairwise_output,
+        influence=influence,
+        profiler=profiler,
+        contested_output=contested_output,
+        top_k=top_k or 100,
+        n_process=n_process or 1,
+        group_by=group_by,
+        group_output=group_output,
+        window=window,
+        window_step=window_step,
+        window_output=window_output,
+    )
+    _report_profile(profiler, profile)
 
 
 @prodigy.recipe(
@@ -110,17 +635,342 @@ def iaa_sessions(
     annotation_type=(ANNOTATION_TYPE_HELP, "positional", None, str),
     labels=("Labels for when annotation type is 'multiclass'. Comma separated values.", "option", None, prodigy.util.split_string),
     dataset_id_key=("Per-Example key with annotator ID. Defaults to '_session_id'", "option", None, str),
+    weighting=(WEIGHTING_HELP, "option", "w", str),
+    bootstrap=(BOOTSTRAP_HELP, "option", "b", int),
+    pairwise_output=(PAIRWISE_HELP, "option", "p", str),
+    influence=(INFLUENCE_HELP, "flag", "i", bool),
+    cache_dir=(CACHE_HELP, "option", "c", str),
+    profile=(PROFILE_HELP, "option", "P", str),
+    contested_output=(CONTESTED_HELP, "option", "x", str),
+    top_k=(TOP_K_HELP, "option", "k", int),
+    n_process=(N_PROCESS_HELP, "option", "n", int),
+    group_by=(GROUP_BY_HELP, "option", "g", str),
+    group_output=(GROUP_OUTPUT_HELP, "option", "G", str),
+    window=(WINDOW_HELP, "option", "W", str),
+    window_step=(WINDOW_STEP_HELP, "option", "S", str),
+    window_output=(WINDOW_OUTPUT_HELP, "option", "O", str),
     # fmt: on
 )
 def iaa_jsonl(
-    dataset: str, annotation_type: str, labels: List[str], dataset_id_key: str
+    dataset: str,
+    annotation_type: str,
+    labels: List[str],
+    dataset_id_key: str,
+    weighting: Optional[str] = None,
+    bootstrap: int = 0,
+    pairwise_output: Optional[str] = None,
+    influence: bool = False,
+    cache_dir: Optional[str] = None,
+    profile: Optional[str] = None,
+    contested_output: Optional[str] = None,
+    top_k: Optional[int] = None,
+    n_process: Optional[int] = None,
+    group_by: Optional[str] = None,
+    group_output: Optional[str] = None,
+    window: Optional[str] = None,
+    window_step: Optional[str] = None,
+    window_output: Optional[str] = None,
 ):
     """Calculates IAA using Percent (Simple) Agreement, Krippendorff's `Alpha`, and Gwet's `AC2` assuming multiple annotators within dataset."""
     value_getter = VALUE_GETTERS.get(annotation_type)
     if value_getter is None:
         msg.fail("Invalid `annotation_type` passed", exits=1)
 
-    examples = list(JSONL(dataset))
+    if not Path(dataset).exists():
+        msg.fail(f"Can't find file '{dataset}'", exits=1)
     if dataset_id_key is None:
         dataset_id_key = "_session_id"
-    iaa_dispatch(examples, annotation_type, value_getter, labels, dataset_id_key)
+    if cache_dir is not None and annotation_type in SPAN_TYPES:
+        msg.warn("Caching is only supported for classification annotations")
+        cache_dir = None
+    if cache_dir is not None and (group_by is not None or window is not None):
+        msg.warn("Caching isn't supported with --group-by or --window")
+        cache_dir = None
+    profiler = Profiler(enabled=profile is not None)
+    with profiler.stage("load"):
+        if cache_dir is not None:
+            examples = cached_jsonl_annotations(
+                dataset, cache_dir, annotator_id=dataset_id_key
+            )
+        else:
+            # Stream only the keys we need, so memory doesn't scale with the raw JSON
+            keys = annotation_keys(
+                dataset_id_key,
+                value_keys=_example_keys(annotation_type, group_by, window),
+            )
+            examples = read_jsonl_projected(dataset, keys)
+    iaa_dispatch(
+        examples,
+        annotation_type,
+        value_getter,
+        labels,
+        dataset_id_key,
+        weighting=weighting or "identity",
+        bootstrap=bootstrap or 0,
+        pairwise_output=pairwise_output,
+        influence=influence,
+        profiler=profiler,
+        contested_output=contested_output,
+        top_k=top_k or 100,
+        n_process=n_process or 1,
+        group_by=group_by,
+        group_output=group_output,
+        window=window,
+        window_step=window_step,
+        window_output=window_output,
+    )
+    _report_profile(profiler, profile)
+
+
+@prodigy.recipe(
+    "iaa.parquet",
+    # fmt: off
+    dataset=("Parquet or Arrow IPC (Feather) file with one row per annotation, e.g. a converted Prodigy export. Assuming annotators are captured per-row in _session_id", "positional", None, str),
+    annotation_type=(ANNOTATION_TYPE_HELP, "positional", None, str),
+    labels=("Labels for when annotation type is 'multiclass'. Comma separated values.", "option", None, prodigy.util.split_string),
+    dataset_id_key=("Per-Example key with annotator ID. Defaults to '_session_id'", "option", None, str),
+    weighting=(WEIGHTING_HELP, "option", "w", str),
+    bootstrap=(BOOTSTRAP_HELP, "option", "b", int),
+    pairwise_output=(PAIRWISE_HELP, "option", "p", str),
+    influence=(INFLUENCE_HELP, "flag", "i", bool),
+    profile=(PROFILE_HELP, "option", "P", str),
+    contested_output=(CONTESTED_HELP, "option", "x", str),
+    top_k=(TOP_K_HELP, "option", "k", int),
+    n_process=(N_PROCESS_HELP, "option", "n", int),
+    # fmt: on
+)
+def iaa_parquet(
+    dataset: str,
+    annotation_type: str,
+    labels: List[str],
+    dataset_id_key: str,
+    weighting: Optional[str] = None,
+    bootstrap: int = 0,
+    pairwise_output: Optional[str] = None,
+    influence: bool = False,
+    profile: Optional[str] = None,
+    contested_output: Optional[str] = None,
+    top_k: Optional[int] = None,
+    n_process: Optional[int] = None,
+):
+    """Calculates IAA using Percent (Simple) Agreement, Krippendorff's `Alpha`, and Gwet's `AC2` from a Parquet or Arrow file, reading only the needed columns."""
+    value_getter = VALUE_GETTERS.get(annotation_type)
+    if value_getter is None:
+        msg.fail("Invalid `annotation_type` passed", exits=1)
+    if annotation_type in SPAN_TYPES:
+        msg.fail(
+            "Span annotations can't be read from Parquet, use 'iaa.jsonl'", exits=1
+        )
+
+    if not Path(dataset).exists():
+        msg.fail(f"Can't find file '{dataset}'", exits=1)
+    if dataset_id_key is None:
+        dataset_id_key = "_session_id"
+    profiler = Profiler(enabled=profile is not None)
+    with profiler.stage("load"):
+        try:
+            examples = read_arrow_annotations(dataset, annotator_id=dataset_id_key)
+        except (ImportError, ValueError) as e:
+            msg.fail(f"Can't read '{dataset}': {e}", exits=1)
+    iaa_dispatch(
+        examples,
+        annotation_type,
+        value_getter,
+        labels,
+        dataset_id_key,
+        weighting=weighting or "identity",
+        bootstrap=bootstrap or 0,
+        pairwise_output=pairwise_output,
+        influence=influence,
+        profiler=profiler,
+        contested_output=contested_output,
+        top_k=top_k or 100,
+        n_process=n_process or 1,
+    )
+    _report_profile(profiler, profile)
+
+
+@prodigy.recipe(
+    "iaa.shards",
+    # fmt: off
+    pattern=("Glob pattern of the JSONL, Parquet or Arrow files the annotations are split across, e.g. 'exports/*.jsonl' ('**' matches any directories). Quote it so the shell doesn't expand it. Assuming annotators are captured per-example in _session_id", "positional", None, str),
+    annotation_type=("Type of annotations, 'binary' or 'multiclass'. See iaa.jsonl.", "positional", None, str),
+    dataset_id_key=("Per-Example key with annotator ID. Defaults to '_session_id'", "option", None, str),
+    weighting=(WEIGHTING_HELP, "option", "w", str),
+    n_process=("Number of processes to read shards in. Defaults to 1.", "option", "n", int),
+    profile=(PROFILE_HELP, "option", "P", str),
+    # fmt: on
+)
+def iaa_shards(
+    pattern: str,
+    annotation_type: str,
+    dataset_id_key: Optional[str] = None,
+    weighting: Optional[str] = None,
+    n_process: Optional[int] = None,
+    profile: Optional[str] = None,
+):
+    """Calculates IAA over many export files at once, counting the annotations of each file in parallel and merging the counts, also of examples annotated in several files."""
+    if annotation_type not in SHARD_TYPES:
+        msg.fail(
+            f"Invalid `annotation_type` passed, choose one of: {', '.join(SHARD_TYPES)}",
+            exits=1,
+        )
+    if weighting is not None and weighting not in WEIGHTINGS:
+        msg.fail(
+            f"Invalid `weighting` passed, choose one of: {', '.join(WEIGHTINGS)}",
+            exits=1,
+        )
+    paths = shard_paths(pattern)
+    if not paths:
+        msg.fail(f"Can't find any files matching '{pattern}'", exits=1)
+    profiler = Profiler(enabled=profile is not None)
+    with profiler.stage("shards", count=len(paths)):
+        try:
+            agreement_stats = sharded_agreement(
+                paths,
+                annotation_type,
+                weighting=weighting or "identity",
+                annotator_id=dataset_id_key or "_session_id",
+                n_process=n_process or 1,
+            )
+        except (ImportError, ValueError) as e:
+            msg.fail(f"Can't read shards of '{pattern}': {e}", exits=1)
+    with profiler.stage("render"):
+        msg.info(f"Annotation Statistics ({len(paths)} shards)")
+        print(render_descriptives(agreement_stats))
+        print()
+        msg.info("Agreement Statistics")
+        print(render_stats(agreement_stats))
+    _report_profile(profiler, profile)
+
+
+@prodigy.recipe(
+    "iaa.watch",
+    # fmt: off
+    dataset=("JSONL file to watch, e.g. one annotations are appended to. Assuming annotators are captured per-example in _session_id", "positional", None, str),
+    annotation_type=("Type of annotations, 'binary' or 'multiclass'. See iaa.jsonl.", "positional", None, str),
+    labels=("All labels for when annotation type is 'multiclass'. Comma separated values. Required for non-identity weighting, otherwise labels are added as they're seen.", "option", None, prodigy.util.split_string),
+    dataset_id_key=("Per-Example key with annotator ID. Defaults to '_session_id'", "option", None, str),
+    weighting=(WEIGHTING_HELP, "option", "w", str),
+    state_dir=("Directory to save the position in the file and the annotations read so far in, to continue from there after a restart. Off by default.", "option", "s", str),
+    output=("Print the statistics as a 'table' (default) or as 'json' lines, or save them to a JSON file (any other value) after every refresh with new annotations.", "option", "o", str),
+    interval=("Seconds between refreshes. Defaults to 10.", "option", "t", float),
+    max_refreshes=("Stop after this many refreshes. Runs until interrupted by default.", "option", "m", int),
+    # fmt: on
+)
+def iaa_watch(
+    dataset: str,
+    annotation_type: str,
+    labels: Optional[List[str]] = None,
+    dataset_id_key: Optional[str] = None,
+    weighting: Optional[str] = None,
+    state_dir: Optional[str] = None,
+    output: Optional[str] = None,
+    interval: Optional[float] = None,
+    max_refreshes: Optional[int] = None,
+):
+    """Calculates IAA on a growing JSONL file, only reading what was appended since the last refresh, and keeps printing or saving the current statistics."""
+    if annotation_type not in WATCH_TYPES:
+        msg.fail(
+            f"Invalid `annotation_type` passed, choose one of: {', '.join(WATCH_TYPES)}",
+            exits=1,
+        )
+    if weighting is not None and weighting not in WEIGHTINGS:
+        msg.fail(
+            f"Invalid `weighting` passed, choose one of: {', '.join(WEIGHTINGS)}",
+            exits=1,
+        )
+    if not Path(dataset).exists():
+        msg.fail(f"Can't find file '{dataset}'", exits=1)
+    try:
+        watcher = JsonlWatcher(
+            dataset,
+            annotation_type,
+            categories=labels or None,
+            weighting=weighting or "identity",
+            annotator_id=dataset_id_key or "_session_id",
+            state_dir=state_dir,
+        )
+    except ValueError as e:
+        msg.fail(f"Can't watch '{dataset}': {e}", exits=1)
+    if watcher.offset:
+        msg.info(f"Continuing after {len(watcher.accumulator)} annotations")
+    n_refreshes = 0
+    try:
+        while True:
+            try:
+                n_new = watcher.refresh()
+            except ValueError as e:
+                msg.fail(f"Can't read '{dataset}': {e}", exits=1)
+            if n_new or not n_refreshes:
+                _report_watch(watcher.stats(), n_new, output)
+            n_refreshes += 1
+            if max_refreshes is not None and n_refreshes >= max_refreshes:
+                break
+            time.sleep(10 if interval is None else interval)
+    except KeyboardInterrupt:
+        msg.info(f"Stopped watching '{dataset}'")
+
+
+def _report_watch(stats: Dict[str, Any], n_new: int, output: Optional[str]) -> None:
+    """Prints the current statistics as a table (`None` or "table"), as a JSON line
+    ("json"), or saves them as JSON to a file (any other value)."""
+    record = {**jsonable(stats), "n_new": n_new, "time": time.time()}
+    if output is None or output == "table":
+        msg.info(
+            f"{stats['n_annotations']} annotations ({n_new} new) at "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S')}"
+        )
+        print(render_stats(stats))
+        print()
+    elif output == "json":
+        print(srsly.json_dumps(record), flush=True)
+    else:
+        # Replaced atomically, so a dashboard never reads a partial file
+        tmp_path = Path(f"{output}.tmp")
+        srsly.write_json(tmp_path, record)
+        os.replace(tmp_path, output)
+
+
+@prodigy.recipe(
+    "iaa.batch",
+    # fmt: off
+    manifest=("JSON or JSONL manifest, one entry per dataset or file. See `batch.read_manifest` for the keys.", "positional", None, str),
+    output=("JSONL file to write the results to, one record per entry (per label for 'multilabel').", "positional", None, str),
+    n_process=("Number of processes to calculate entries in.", "option", "n", int),
+    cache_dir=(CACHE_HELP, "option", "c", str),
+    # fmt: on
+)
+def iaa_batch(
+    manifest: str,
+    output: str,
+    n_process: int = 1,
+    cache_dir: Optional[str] = None,
+):
+    """Calculates IAA for every entry of a manifest in one process, sharing one database connection, and writes the results as JSONL."""
+    if not Path(manifest).exists():
+        msg.fail(f"Can't find file '{manifest}'", exits=1)
+    try:
+        entries = read_manifest(manifest)
+    except ValueError as e:
+        msg.fail(f"Invalid manifest: {e}", exits=1)
+    DB = None
+    for entry in entries:
+        if entry["type"] in FILE_TYPES:
+            continue
+        if DB is None:
+            DB = prodigy.components.db.connect()
+        datasets = entry["datasets"]
+        for set_id in [datasets] if isinstance(datasets, str) else datasets:
+            if set_id not in DB:
+                msg.fail(f"Can't find dataset '{set_id}' in database", exits=1)
+    records = run_batch(entries, DB=DB, n_process=n_process or 1, cache_dir=cache_dir)
+    n_errors = 0
+    with Path(output).open("w", encoding="utf8") as f:
+        for record in records:
+            n_errors += "error" in record
+            f.write(srsly.json_dumps(record) + "\n")
+            f.flush()
+    if n_errors:
+        msg.warn(f"{n_errors} manifest entries failed, see the 'error' field")
+    msg.good(f"Saved agreement for {len(entries)} entries to {output}")
@@ -1,5 +1,10 @@
+from datetime import datetime, timezone
+
+import numpy as np
 from wasabi import table
 
+from .measures import SparseReliability, reliability_descriptives
+
 
 def _format_number(number: float, ndigits: int = 2) -> str:
     """Formats a number rounding to `ndigits`, without truncating trailing 0s,
@@ -8,6 +13,10 @@ def _format_number(number: float, ndigits: int = 2) -> str:
 
 
 def render_descriptives(iaa_stats):
+    """Renders the descriptive statistics of `calculate_agreement`, or of a
+    `SparseReliability` directly."""
+    if isinstance(iaa_stats, SparseReliability):
+        iaa_stats = reliability_descriptives(iaa_stats)
     data = [
         (
             "Examples",
@@ -34,8 +43,9 @@ def render_descriptives(iaa_stats):
     return formatted
 
 
-def render_stats(iaa_stats):
-
+def render_stats(iaa_stats, intervals=None, confidence=0.95):
+    """Renders the agreement measures. If bootstrap `intervals` are passed (see
+    `bootstrap.bootstrap_agreement`), they're added as an extra column."""
     data = [
         (
             "Percent (Simple) Agreement",
@@ -44,6 +54,233 @@ def render_stats(iaa_stats):
         ("Krippendorff's Alpha", _format_number(iaa_stats["kripp_alpha"], 4)),
         ("Gwet's AC2", _format_number(iaa_stats["ac2"], 4)),
     ]
+    header = ("Statistic", "Value")
     aligns = ("l", "r")
-    formatted = table(data, header=("Statistic", "Value"), divider=True, aligns=aligns)
+    if intervals is not None:
+        measures = ("percent_agreement", "kripp_alpha", "ac2")
+        data = [
+            row
+            + (
+                f"[{_format_number(intervals[measure]['lower'], 4)}, "
+                f"{_format_number(intervals[measure]['upper'], 4)}]",
+            )
+            for row, measure in zip(data, measures)
+        ]
+        header += (f"{confidence:.0%} CI",)
+        aligns += ("r",)
+    formatted = table(data, header=header, divider=True, aligns=aligns)
+    return formatted
+
+
+def render_multilabel_summary(per_label_stats, summary):
+    data = [
+        (
+            label,
+            _format_number(stats["percent_agreement"], 4),
+            _format_number(stats["kripp_alpha"], 4),
+            _format_number(stats["ac2"], 4),
+        )
+        for label, stats in per_label_stats.items()
+    ]
+    for name in ("macro", "micro"):
+        data.append(
+            (
+                f"({name.capitalize()})",
+                _format_number(summary[name]["percent_agreement"], 4),
+                _format_number(summary[name]["kripp_alpha"], 4),
+                _format_number(summary[name]["ac2"], 4),
+            )
+        )
+    aligns = ("l", "r", "r", "r")
+    header = ("Label", "Percent Agreement", "Krippendorff's Alpha", "Gwet's AC2")
+    formatted = table(data, header=header, divider=True, aligns=aligns)
+    formatted += "\n* Macro averages the per-label measures, Micro pools every (example, label) pair"
+    return formatted
+
+
+def render_pairwise_summary(pairwise, annotators):
+    """Ranks annotators by their average pairwise Alpha with all other annotators
+    they share examples with, lowest first, to spot outliers."""
+    data = []
+    with np.errstate(invalid="ignore"):
+        for a, annotator in enumerate(annotators):
+            shared = pairwise["n_coincident_examples"][a] > 0
+            alpha = pairwise["kripp_alpha"][a][shared]
+            ac2 = pairwise["ac2"][a][shared]
+            data.append(
+                (
+                    annotator,
+                    int(shared.sum()),
+                    np.nanmean(alpha) if np.isfinite(alpha).any() else np.nan,
+                    np.nanmean(ac2) if np.isfinite(ac2).any() else np.nan,
+                )
+            )
+    data.sort(key=lambda row: (np.isnan(row[2]), row[2]))
+    data = [
+        (annotator, n, _format_number(alpha, 4), _format_number(ac2, 4))
+        for annotator, n, alpha, ac2 in data
+    ]
+    aligns = ("l", "r", "r", "r")
+    header = ("Annotator", "Co-Annotators", "Avg. Pairwise Alpha", "Avg. Pairwise AC2")
+    return table(data, header=header, divider=True, aligns=aligns)
+
+
+def render_influence(records):
+    """Renders the output of `influence.influence_records` as a ranked table."""
+    data = [
+        (
+            record["annotator"],
+            record["n_annotations"],
+            _format_number(record["kripp_alpha"], 4),
+            f"{record['kripp_alpha_delta']:+.4f}",
+            _format_number(record["ac2"], 4),
+            f"{record['ac2_delta']:+.4f}",
+        )
+        for record in records
+    ]
+    aligns = ("l", "r", "r", "r", "r", "r")
+    header = (
+        "Annotator",
+        "Annotations",
+        "Alpha Without",
+        "Alpha Change",
+        "AC2 Without",
+        "AC2 Change",
+    )
+    formatted = table(data, header=header, divider=True, aligns=aligns)
+    formatted += "\n* Change in agreement when leaving the annotator out, positive means they lower agreement"
     return formatted
+
+
+def render_profile(records):
+    """Renders the stages recorded by a `profiling.Profiler`."""
+    data = []
+    for record in records:
+        stage = record["stage"]
+        if record.get("label") is not None:
+            stage = f"{stage} ({record['label']})"
+        peak = record.get("peak_rss_mb")
+        count = record.get("count")
+        data.append(
+            (
+                stage,
+                _format_number(record["seconds"], 3),
+                "" if peak is None else _format_number(peak, 1),
+                "" if count is None else count,
+            )
+        )
+    total = sum(record["seconds"] for record in records if record["stage"] != "read")
+    data.append(("Total", _format_number(total, 3), "", ""))
+    header = ("Stage", "Seconds", "Peak RSS (MB)", "Items")
+    aligns = ("l", "r", "r", "r")
+    formatted = table(data, header=header, divider=True, aligns=aligns)
+    if any(record["stage"] == "read" for record in records):
+        formatted += "\n* 'read' is the time spent reading examples during 'encode'"
+    return formatted
+
+
+def render_span_descriptives(spans):
+    """Renders the number of examples, annotators and spans of a
+    `spans.SpanAnnotations`."""
+    raters_per_example = np.bincount(spans.rows, minlength=len(spans.examples))
+    data = [
+        ("Examples", len(spans.examples)),
+        ("Labels", len(spans.labels)),
+        ("Co-Incident Examples*", int((raters_per_example > 1).sum())),
+        ("Annotators", len(spans.annotators)),
+        ("Spans", len(spans.starts)),
+        (
+            "Avg. Spans per Annotation",
+            _format_number(len(spans.starts) / max(len(spans.rows), 1), 2),
+        ),
+    ]
+    aligns = ("l", "r")
+    formatted = table(data, header=("Attribute", "Value"), divider=True, aligns=aligns)
+    formatted += "\n* (>1 annotation)"
+    return formatted
+
+
+def render_span_summary(span_stats):
+    """Renders the pooled exact and overlap F1 of `spans.span_agreement`, per label
+    and overall."""
+    exact, overlap = span_stats["exact"], span_stats["overlap"]
+    data = [
+        (
+            label,
+            _format_number(exact["per_label"][label], 4),
+            _format_number(overlap["per_label"][label], 4),
+        )
+        for label in exact["per_label"]
+    ]
+    data.append(
+        (
+            "(All)",
+            _format_number(exact["pooled_f1"], 4),
+            _format_number(overlap["pooled_f1"], 4),
+        )
+    )
+    aligns = ("l", "r", "r")
+    header = ("Label", "Exact F1", "Overlap F1")
+    formatted = table(data, header=header, divider=True, aligns=aligns)
+    formatted += "\n* Pooled over every pair of annotators, spans have to have the same label to match"
+    return formatted
+
+
+def render_group_summary(per_group_stats, overall):
+    """Renders the agreement of every group of `measures.agreement_by_group`, and
+    overall. For 'multilabel', pass the `micro` statistics of each group."""
+    data = [
+        (
+            "(None)" if group is None else group,
+            stats["n_examples"],
+            stats["n_coincident_examples"],
+            _format_number(stats["percent_agreement"], 4),
+            _format_number(stats["kripp_alpha"], 4),
+            _format_number(stats["ac2"], 4),
+        )
+        for group, stats in [*per_group_stats.items(), ("(All)", overall)]
+    ]
+    aligns = ("l", "r", "r", "r", "r", "r")
+    header = (
+        "Group",
+        "Examples",
+        "Co-Incident",
+        "Percent Agreement",
+        "Krippendorff's Alpha",
+        "Gwet's AC2",
+    )
+    return table(data, header=header, divider=True, aligns=aligns)
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M")
+
+
+def render_windows(records):
+    """Renders the agreement in every time window of `windows.windowed_agreement`,
+    as a time series."""
+    data = [
+        (
+            _format_time(record["start"]),
+            _format_time(record["end"]),
+            record["n_examples"],
+            record["n_coincident_examples"],
+            record["n_annotators"],
+            _format_number(record["percent_agreement"], 4),
+            _format_number(record["kripp_alpha"], 4),
+            _format_number(record["ac2"], 4),
+        )
+        for record in records
+    ]
+    aligns = ("l", "l", "r", "r", "r", "r", "r", "r")
+    header = (
+        "Start (UTC)",
+        "End (UTC)",
+        "Examples",
+        "Co-Incident",
+        "Annotators",
+        "Percent Agreement",
+        "Krippendorff's Alpha",
+        "Gwet's AC2",
+    )
+    return table(data, header=header, divider=True, aligns=aligns)
@@ -0,0 +1,197 @@
+import glob
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Union
+
+import numpy as np
+
+from .arrow import PARQUET_SUFFIXES, read_arrow_annotations
+from .cache import encode_columns
+from .loaders import annotation_keys, read_jsonl_projected
+from .measures import (
+    SparseAgreementTable,
+    Weighting,
+    agreement_from_table,
+    sort_categories,
+    sparse_agreement_table,
+    weight_matrix,
+)
+from .processors import check_unique_annotations, columns_to_codes
+
+# Annotation types with a single category per annotation, so a shard reduces to
+# an agreement table
+SHARD_TYPES = ("binary", "multiclass")
+# Suffixes of shards read with `read_arrow_annotations`, the rest are JSONL
+ARROW_SUFFIXES = PARQUET_SUFFIXES + (".arrow", ".feather")
+
+
+class ShardCounts(NamedTuple):
+    """The partial agreement table of one shard: `counts[i]` annotations of
+    `categories[values[i]]` for the example `examples[rows[i]]`. The example and
+    annotator of every annotation (`annotation_rows`, `annotation_cols`) are
+    kept to check for duplicates across shards, but none of their values."""
+
+    examples: List[Any]
+    annotators: List[Any]
+    categories: List[Any]
+    rows: np.ndarray
+    values: np.ndarray
+    counts: np.ndarray
+    annotation_rows: np.ndarray
+    annotation_cols: np.ndarray
+
+
+def shard_counts(
+    path: Union[str, Path],
+    annotation_type: str,
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+) -> ShardCounts:
+    """Reads a JSONL, Parquet or Arrow shard (by suffix, see `ARROW_SUFFIXES`)
+    and counts the annotations of each category for each of its examples.
+    `annotation_type` is 'binary' or 'multiclass'. Runs in a worker process in
+    `sharded_agreement`."""
+    path = Path(path)
+    if path.suffix in ARROW_SUFFIXES:
+        columns = read_arrow_annotations(path, annotator_id, example_id)
+    else:
+        keys = annotation_keys(annotator_id, example_id)
+        columns = encode_columns(
+            read_jsonl_projected(path, keys), annotator_id, example_id
+        )
+    reliability = columns_to_codes(columns, annotation_type, sparse=True)
+    codes = reliability.codes
+    table = sparse_agreement_table(
+        codes.rows, codes.codes, codes.shape[0], len(reliability.categories)
+    )
+    return ShardCounts(
+        reliability.examples,
+        reliability.annotators,
+        reliability.categories,
+        table.rows(),
+        table.indices,
+        table.counts,
+        np.asarray(columns.example),
+        np.asarray(columns.annotator),
+    )
+
+
+class MergedCounts(NamedTuple):
+    """The agreement table of all shards, with its categories (sorted, see
+    `sort_categories`) and the annotators of all shards."""
+
+    table: SparseAgreementTable
+    categories: List[Any]
+    annotators: List[Any]
+    n_shards: int
+
+
+def merge_shard_counts(shards: Iterable[ShardCounts]) -> MergedCounts:
+    """Merges the partial agreement tables of shards, e.g. as they're returned by
+    the workers. Examples and categories are matched by value, so an example
+    whose annotations are split across shards gets the sum of its counts in
+    each of them. An annotator annotating the same example in more than one
+    shard fails, like duplicates within a shard do."""
+    example_index: Dict[Any, int] = {}
+    category_index: Dict[Any, int] = {}
+    annotator_index: Dict[Any, int] = {}
+    rows, values, counts = [], [], []
+    annotation_rows, annotation_cols = [], []
+    n_shards = 0
+    for shard in shards:
+        example_map = np.array(
+            [example_index.setdefault(e, len(example_index)) for e in shard.examples],
+            dtype=np.int64,
+        )
+        category_map = np.array(
+            [
+                category_index.setdefault(c, len(category_index))
+                for c in shard.categories
+            ],
+            dtype=np.int64,
+        )
+        annotator_map = np.array(
+            [
+                annotator_index.setdefault(a, len(annotator_index))
+                for a in shard.annotators
+            ],
+            dtype=np.int64,
+        )
+        annotation_rows.append(example_map[shard.annotation_rows])
+        annotation_cols.append(annotator_map[shard.annotation_cols])
+        rows.append(example_map[shard.rows])
+        values.append(category_map[shard.values])
+        counts.append(shard.counts)
+        n_shards += 1
+    empty = [np.zeros(0, dtype=np.int64)]
+    check_unique_annotations(
+        np.concatenate(annotation_rows + empty),
+        np.concatenate(annotation_cols + empty),
+        len(annotator_index),
+    )
+    categories = sort_categories(category_index)
+    remap = np.empty(len(categories), dtype=np.int64)
+    remap[[category_index[c] for c in categories]] = np.arange(len(categories))
+    n_examples, n_categories = len(example_index), max(len(categories), 1)
+    cells = np.concatenate(rows + empty) * n_categories
+    cells += remap[np.concatenate(values + empty)]
+    counts_ = np.concatenate(counts + empty)
+    # Sum the counts of cells that are in more than one shard, i.e. of examples
+    # that were annotated in several shards
+    order = np.argsort(cells, kind="stable")
+    cells, counts_ = cells[order], counts_[order]
+    starts = np.flatnonzero(np.diff(cells, prepend=-1))
+    summed = np.add.reduceat(counts_, starts) if len(starts) else counts_
+    cells = cells[starts]
+    indptr = np.zeros(n_examples + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells // n_categories, minlength=n_examples), out=indptr[1:])
+    table = SparseAgreementTable(indptr, cells % n_categories, summed, len(categories))
+    return MergedCounts(table, categories, list(annotator_index), n_shards)
+
+
+def shard_paths(pattern: str) -> List[str]:
+    """The files matching a glob pattern (`**` matches any directories), sorted."""
+    return sorted(
+        path for path in glob.glob(pattern, recursive=True) if Path(path).is_file()
+    )
+
+
+def sharded_agreement(
+    paths: List[Union[str, Path]],
+    annotation_type: str,
+    weighting: Weighting = "identity",
+    annotator_id: str = "_session_id",
+    example_id: str = "_task_hash",
+    n_process: int = 1,
+) -> Dict[str, Any]:
+    """Calculates agreement over many shards of annotations for the same examples
+    as map-reduce: `n_process` worker processes each read shards and reduce them
+    to their partial agreement table (`shard_counts`), which are merged into
+    the global table as they come in (`merge_shard_counts`). Workers send back
+    the counts and, to check for duplicates across shards, the example and
+    annotator positions of every annotation (`annotation_rows` and
+    `annotation_cols`), but no annotation values. The positions are two int64
+    arrays of 16 bytes per annotation in total, which the parent holds for all
+    shards until they're merged. Returns the statistics of
+    `calculate_agreement`, plus the number of shards."""
+    count = partial(
+        shard_counts,
+        annotation_type=annotation_type,
+        annotator_id=annotator_id,
+        example_id=example_id,
+    )
+    if n_process > 1 and len(paths) > 1:
+        # Only imported here, as it takes longer to import than the rest of the package
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(min(n_process, len(paths))) as executor:
+            merged = merge_shard_counts(executor.map(count, paths))
+    else:
+        merged = merge_shard_counts(map(count, paths))
+    stats = agreement_from_table(
+        merged.table,
+        merged.categories,
+        len(merged.annotators),
+        weights=weight_matrix(merged.categories, weighting),
+    )
+    return {**stats, "n_shards": merged.n_shards}
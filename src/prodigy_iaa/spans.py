@@ -0,0 +1,374 @@
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .measures import (
+    SparseReliability,
+    agreement_from_statistics,
+    build_agreement_array,
+    format_agreement,
+    sort_categories,
+    weight_matrix,
+    weighted_agreement_statistics,
+)
+
+ExampleDict = Dict[str, Any]
+Span = Tuple[int, int, Any]
+
+# Value of a token outside any span, for token-level Alpha. Not a string, so it
+# can't be mistaken for a span label like "O"
+OUTSIDE = None
+SPAN_MATCHES = ("exact", "overlap")
+
+
+def get_spans(example: ExampleDict) -> Optional[Tuple[int, List[Span]]]:
+    """Returns the length of an accepted example's text and its spans as
+    (start, end, label), with an exclusive end, or None if it wasn't accepted.
+    Offsets are token indices if the example has `tokens` (as Prodigy's 'ner'
+    and 'spans' interfaces add), and character offsets otherwise."""
+    if example.get("answer") != "accept":
+        return None
+    spans = example.get("spans") or []
+    tokens = example.get("tokens")
+    if tokens:
+        offsets = [(s["token_start"], s["token_end"] + 1, s["label"]) for s in spans]
+        length = len(tokens)
+    else:
+        offsets = [(s["start"], s["end"], s["label"]) for s in spans]
+        length = len(example.get("text") or "")
+    return max([length] + [end for _, end, _ in offsets]), offsets
+
+
+class SpanAnnotations(NamedTuple):
+    """Encoded span annotations. Annotation i is by annotator
+    `annotators[cols[i]]` on example `examples[rows[i]]`, whose text is
+    `lengths[i]` long. Span j is part of annotation `span_annotation[j]` and
+    covers `[starts[j], ends[j])` with label `labels[span_labels[j]]`.
+    Annotations are sorted by example, and annotations without spans are kept,
+    since they disagree with every span of other annotators."""
+
+    rows: np.ndarray
+    cols: np.ndarray
+    lengths: np.ndarray
+    span_annotation: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    span_labels: np.ndarray
+    examples: List[Any]
+    annotators: List[Any]
+    labels: List[Any]
+
+    @property
+    def span_examples(self) -> np.ndarray:
+        return self.rows[self.span_annotation]
+
+    @property
+    def span_annotators(self) -> np.ndarray:
+        return self.cols[self.span_annotation]
+
+
+def examples_to_spans(
+    examples: Iterable[ExampleDict],
+    annotator_id="_session_id",
+    example_id="_task_hash",
+    value_getter=get_spans,
+) -> SpanAnnotations:
+    """Encodes a long dataset of span annotations in a single pass, like
+    `processors.examples_to_codes`. Examples that weren't accepted are left
+    out, and empty or repeated spans of the same annotation are dropped."""
+    from .processors import check_unique_annotations
+
+    example_index: Dict[Any, int] = {}
+    annotator_index: Dict[Any, int] = {}
+    label_index: Dict[Any, int] = {}
+    rows, cols, lengths = array("q"), array("q"), array("q")
+    span_annotation, starts, ends, span_labels = (array("q") for _ in range(4))
+    for example in examples:
+        value = value_getter(example)
+        if value is None:
+            continue
+        length, spans = value
+        for start, end, label in spans:
+            if end > start:
+                span_annotation.append(len(rows))
+                starts.append(start)
+                ends.append(end)
+                span_labels.append(label_index.setdefault(label, len(label_index)))
+        rows.append(example_index.setdefault(example[example_id], len(example_index)))
+        cols.append(
+            annotator_index.setdefault(example[annotator_id], len(annotator_index))
+        )
+        lengths.append(length)
+
+    rows_, cols_, lengths_ = (
+        np.frombuffer(values, dtype=np.int64) for values in (rows, cols, lengths)
+    )
+    check_unique_annotations(rows_, cols_, len(annotator_index))
+    order = np.argsort(rows_, kind="stable")
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    labels = sort_categories(label_index)
+    remap = np.empty(len(labels), dtype=np.int64)
+    remap[[label_index[label] for label in labels]] = np.arange(len(labels))
+    span_annotation_, span_labels_, starts_, ends_ = _unique_columns(
+        position[np.frombuffer(span_annotation, dtype=np.int64)],
+        remap[np.frombuffer(span_labels, dtype=np.int64)],
+        np.frombuffer(starts, dtype=np.int64),
+        np.frombuffer(ends, dtype=np.int64),
+    )
+    return SpanAnnotations(
+        rows_[order],
+        cols_[order],
+        lengths_[order],
+        span_annotation_,
+        starts_,
+        ends_,
+        span_labels_,
+        list(example_index),
+        list(annotator_index),
+        labels,
+    )
+
+
+def _unique_columns(*columns: np.ndarray) -> List[np.ndarray]:
+    """Sorts the rows of equal-length columns (by the first column, then the second
+    etc.) and drops duplicate rows."""
+    order = np.lexsort(columns[::-1])
+    columns = [column[order] for column in columns]
+    keep = np.ones(len(order), dtype=bool)
+    if len(order):
+        keep[1:] = np.any([column[1:] != column[:-1] for column in columns], axis=0)
+    return [column[keep] for column in columns]
+
+
+def _following_pairs(n_following: np.ndarray) -> np.ndarray:
+    """(P x 2) pairs (i, j) for every i and the `n_following[i]` positions after it."""
+    first = np.repeat(np.arange(len(n_following)), n_following)
+    offsets = np.cumsum(n_following) - n_following
+    second = first + 1 + np.arange(len(first)) - np.repeat(offsets, n_following)
+    return np.stack([first, second], axis=1)
+
+
+def span_matches(
+    spans: SpanAnnotations, chunk_size: int = 100_000
+) -> Dict[str, np.ndarray]:
+    """Finds, for every span, the other annotators who have a span with the same
+    label on the same example that overlaps it ("overlap") or has the same
+    boundaries ("exact"). Returns sorted arrays of `span * n_annotators +
+    annotator` per kind of match.
+
+    Spans are sorted by example, label and start once. The spans overlapping a
+    span that start at or after it are then exactly the ones that follow it,
+    up to the first that starts at or after its end, found with a binary
+    search. So the cost is O(S log S) plus the number of overlapping pairs,
+    instead of comparing all pairs of spans in a document."""
+    n_annotators = len(spans.annotators)
+    annotators = spans.span_annotators
+    if not len(spans.starts):
+        return {match: np.zeros(0, dtype=np.int64) for match in SPAN_MATCHES}
+    group = spans.span_examples * len(spans.labels) + spans.span_labels
+    scale = int(spans.ends.max()) + 1
+    order = np.lexsort((spans.ends, spans.starts, group))
+    keys = group[order] * scale + spans.starts[order]
+    stops = np.searchsorted(keys, group[order] * scale + spans.ends[order])
+    n_following = stops - np.arange(len(order)) - 1
+
+    # Flags of (span, annotator), only as large as the (S x A) result can be
+    found = {match: np.zeros(len(order) * n_annotators, bool) for match in SPAN_MATCHES}
+    for start in range(0, len(order), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        pairs = _following_pairs(n_following[chunk]) + start
+        i, j = order[pairs[:, 0]], order[pairs[:, 1]]
+        other = annotators[i] != annotators[j]
+        i, j = i[other], j[other]
+        exact = (spans.starts[i] == spans.starts[j]) & (spans.ends[i] == spans.ends[j])
+        for match, mask in (("overlap", slice(None)), ("exact", exact)):
+            found[match][i[mask] * n_annotators + annotators[j[mask]]] = True
+            found[match][j[mask] * n_annotators + annotators[i[mask]]] = True
+    return {match: np.flatnonzero(flags) for match, flags in found.items()}
+
+
+def _span_totals(spans: SpanAnnotations) -> np.ndarray:
+    """(A x A x L) number of spans of annotator a with label l on examples that
+    annotator b also annotated."""
+    n_annotators, n_labels = len(spans.annotators), len(spans.labels)
+    indptr = np.searchsorted(spans.rows, np.arange(len(spans.examples) + 1))
+    span_examples = spans.span_examples
+    n_annotations = np.diff(indptr)[span_examples]
+    span = np.repeat(np.arange(len(span_examples)), n_annotations)
+    offsets = np.cumsum(n_annotations) - n_annotations
+    other = (
+        indptr[span_examples[span]]
+        + np.arange(len(span))
+        - np.repeat(offsets, n_annotations)
+    )
+    a, b = spans.span_annotators[span], spans.cols[other]
+    cells = (a * n_annotators + b) * n_labels + spans.span_labels[span]
+    totals = np.bincount(cells[a != b], minlength=n_annotators**2 * n_labels)
+    return totals.reshape(n_annotators, n_annotators, n_labels)
+
+
+def _f1(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 2 * precision * recall / (precision + recall)
+
+
+def span_agreement(spans: SpanAnnotations) -> Dict[str, Any]:
+    """Calculates span F1 between annotators, for exact and overlapping matches.
+    Between annotators a and b, on the examples both annotated, precision is the
+    share of a's spans that b also has (with the same label), recall the share
+    of b's spans that a also has, and F1 their harmonic mean.
+
+    Returns a dictionary per match ("exact" and "overlap") with (A x A)
+    `precision`, `recall` and `f1` matrices (NaN on the diagonal and for
+    annotators without shared spans), `pooled_f1`, the share of all spans that
+    the other annotator also has, summed over every pair of annotators (for
+    exact matches this is the micro-averaged pairwise F1), and the pooled F1 per
+    label in `per_label`. `n_spans` holds the (A x A)
+    number of spans of a on examples shared with b."""
+    n_annotators, n_labels = len(spans.annotators), len(spans.labels)
+    totals = _span_totals(spans)
+    n_spans = totals.sum(axis=-1)
+    matches = span_matches(spans)
+    results: Dict[str, Any] = {"n_spans": n_spans}
+    for match in SPAN_MATCHES:
+        span = matches[match] // n_annotators
+        b = matches[match] % n_annotators
+        a = spans.span_annotators[span]
+        matched = np.bincount(
+            (a * n_annotators + b) * n_labels + spans.span_labels[span],
+            minlength=n_annotators**2 * n_labels,
+        ).reshape(n_annotators, n_annotators, n_labels)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            precision = matched.sum(axis=-1) / n_spans
+            per_label = matched.sum(axis=(0, 1)) / totals.sum(axis=(0, 1))
+            f1 = matched.sum() / totals.sum()
+        np.fill_diagonal(precision, np.nan)
+        results[match] = {
+            "precision": precision,
+            "recall": precision.T,
+            "f1": _f1(precision, precision.T),
+            "pooled_f1": float(f1),
+            "per_label": dict(zip(spans.labels, per_label.tolist())),
+        }
+    return results
+
+
+def span_pairwise_records(
+    results: Dict[str, Any], annotators: List[Any]
+) -> Iterator[Dict[str, Any]]:
+    """Yields one record per (unordered) pair of annotators of `span_agreement`,
+    e.g. for export to JSONL. Undefined measures are `None`."""
+    for a in range(len(annotators)):
+        for b in range(a + 1, len(annotators)):
+            record = {
+                "annotator_a": annotators[a],
+                "annotator_b": annotators[b],
+                "n_spans_a": int(results["n_spans"][a, b]),
+                "n_spans_b": int(results["n_spans"][b, a]),
+            }
+            for match in SPAN_MATCHES:
+                for measure in ("precision", "recall", "f1"):
+                    value = float(results[match][measure][a, b])
+                    key = f"{match}_{measure}"
+                    record[key] = value if np.isfinite(value) else None
+            yield record
+
+
+def token_reliability(spans: SpanAnnotations) -> Tuple[SparseReliability, np.ndarray]:
+    """Converts span annotations to a reliability matrix over text segments, to
+    calculate Alpha and AC2 as if every token were labelled with the span it's
+    in (`OUTSIDE` if none, labels joined with "|" for overlapping spans).
+
+    Each example is cut at every span boundary of every annotator, so all tokens
+    of a segment have the same value for each annotator. Returns one row per
+    segment and the segment lengths, to use as weights: agreement weighted by
+    length is the same as per token, with a cost depending on the number of
+    spans instead of the length of the texts."""
+    n_annotators, n_labels = len(spans.annotators), len(spans.labels)
+    n_examples = len(spans.examples)
+    lengths = np.zeros(n_examples, dtype=np.int64)
+    np.maximum.at(lengths, spans.rows, spans.lengths)
+    scale = int(lengths.max(initial=0)) + 1
+    span_examples = spans.span_examples
+    examples = np.arange(n_examples)
+    (bounds,) = _unique_columns(
+        np.concatenate(
+            [
+                examples * scale,
+                examples * scale + lengths,
+                span_examples * scale + spans.starts,
+                span_examples * scale + spans.ends,
+            ]
+        )
+    )
+    bound_examples = bounds // scale
+    is_segment = bound_examples[:-1] == bound_examples[1:]
+    segment_lengths = np.diff(bounds)[is_segment]
+    segment_of_bound = np.cumsum(is_segment) - 1
+    segment_indptr = np.searchsorted(bound_examples[:-1][is_segment], examples)
+    segment_indptr = np.append(segment_indptr, len(segment_lengths))
+
+    # Every annotator of an example starts out with OUTSIDE for all its segments
+    n_segments = np.diff(segment_indptr)[spans.rows]
+    offsets = np.cumsum(n_segments) - n_segments
+    annotation = np.repeat(np.arange(len(spans.rows)), n_segments)
+    segments = (
+        segment_indptr[spans.rows[annotation]]
+        + np.arange(len(annotation))
+        - np.repeat(offsets, n_segments)
+    )
+    cells = segments * n_annotators + spans.cols[annotation]
+    order = np.argsort(cells)
+    cells = cells[order]
+    values = np.zeros(len(cells), dtype=np.int64)
+
+    # Then each span sets the segments it covers
+    first = np.searchsorted(bounds, span_examples * scale + spans.starts)
+    n_covered = np.searchsorted(bounds, span_examples * scale + spans.ends) - first
+    span = np.repeat(np.arange(len(first)), n_covered)
+    covered = (
+        np.repeat(first, n_covered)
+        + np.arange(len(span))
+        - np.repeat(np.cumsum(n_covered) - n_covered, n_covered)
+    )
+    span_cells = segment_of_bound[covered] * n_annotators + spans.span_annotators[span]
+    span_cells, span_labels = _unique_columns(span_cells, spans.span_labels[span])
+    categories = [OUTSIDE] + list(spans.labels)
+    combination_index: Dict[Tuple[int, ...], int] = {}
+    starts = np.flatnonzero(np.diff(span_cells, prepend=-1))
+    cell_values = span_labels[starts] + 1
+    # Only cells with overlapping spans of different labels need Python
+    for n in np.flatnonzero(np.diff(np.append(starts, len(span_cells))) > 1):
+        end = starts[n + 1] if n + 1 < len(starts) else len(span_cells)
+        combination = tuple(span_labels[starts[n] : end].tolist())
+        if combination not in combination_index:
+            combination_index[combination] = len(categories)
+            categories.append("|".join(str(spans.labels[l]) for l in combination))
+        cell_values[n] = combination_index[combination]
+    values[np.searchsorted(cells, span_cells[starts])] = cell_values
+    reliability = SparseReliability(
+        cells // n_annotators,
+        cells % n_annotators,
+        values,
+        (len(segment_lengths), n_annotators),
+        categories,
+    )
+    return reliability, segment_lengths
+
+
+def token_agreement(spans: SpanAnnotations) -> Dict[str, Any]:
+    """Percent Agreement, Alpha and AC2 over tokens (see `token_reliability`), in
+    the format of `calculate_agreement`. Example counts are in tokens."""
+    reliability, segment_lengths = token_reliability(spans)
+    weights = weight_matrix(reliability.categories, "identity")
+    agreement_table = build_agreement_array(reliability, len(reliability.categories))
+    statistics = weighted_agreement_statistics(
+        agreement_table, weights, segment_lengths[None, :]
+    )[0]
+    agreement = agreement_from_statistics(statistics, weights)
+    return format_agreement(
+        agreement, reliability.categories, n_annotators=reliability.shape[1]
+    )
@@ -0,0 +1,159 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from .accumulator import AgreementAccumulator
+from .cache import file_head, hashable
+from .loaders import annotation_keys, read_jsonl_checkpointed
+from .measures import Weighting
+from .processors import VALUE_GETTERS
+
+WATCH_STATE_VERSION = 1
+# Annotation types with a single category per annotation, see `AgreementAccumulator`
+WATCH_TYPES = ("binary", "multiclass")
+
+Annotation = Tuple[Hashable, Hashable, Any]
+
+
+class JsonlWatcher:
+    """Tails a growing JSONL file of annotations, e.g. one Prodigy appends to,
+    keeping an `AgreementAccumulator` up to date with only the lines appended
+    since the last `refresh`. An example an annotator already annotated
+    replaces their earlier annotation.
+
+    With a `state_dir`, the byte offset reached and the annotations read so far
+    are persisted, so a restarted watcher continues where it stopped instead of
+    reading the whole file again. New annotations are appended to a log, and only
+    a small `meta.json` is replaced (atomically) per refresh, so a refresh costs
+    time proportional to what was appended. If the file got shorter or its start
+    changed, it's assumed to have been rewritten and is read from scratch."""
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        annotation_type: str = "binary",
+        categories: Optional[Iterable[Any]] = None,
+        weighting: Weighting = "identity",
+        annotator_id: str = "_session_id",
+        example_id: str = "_task_hash",
+        state_dir: Optional[Union[str, Path]] = None,
+    ):
+        if annotation_type not in WATCH_TYPES:
+            raise ValueError(
+                f"Can only watch {' and '.join(WATCH_TYPES)} annotations, "
+                f"not '{annotation_type}'"
+            )
+        self.path = Path(path)
+        self.value_getter = VALUE_GETTERS[annotation_type]
+        self.annotator_id = annotator_id
+        self.example_id = example_id
+        if categories is None and annotation_type == "binary":
+            categories = ("accept", "reject")
+        self.source = {
+            "path": str(self.path.resolve()),
+            "annotation_type": annotation_type,
+            "categories": None if categories is None else list(categories),
+            "weighting": weighting,
+            "annotator_id": annotator_id,
+            "example_id": example_id,
+        }
+        self.state_dir = None if state_dir is None else Path(state_dir)
+        self._start()
+        if self.state_dir is not None:
+            self._load()
+
+    def reset(self) -> None:
+        """Discards all annotations read so far (also from the `state_dir`), so
+        the next refresh reads the file from the start."""
+        self._start()
+        if self.state_dir is not None:
+            (self.state_dir / "annotations.jsonl").unlink(missing_ok=True)
+            (self.state_dir / "meta.json").unlink(missing_ok=True)
+
+    def _start(self) -> None:
+        self.accumulator = AgreementAccumulator(
+            self.source["categories"], self.source["weighting"]
+        )
+        self.offset = 0
+        self.meta = {
+            "version": WATCH_STATE_VERSION,
+            "source": self.source,
+            "offset": 0,
+            "validation": None,
+            "log_size": 0,
+        }
+
+    def _load(self) -> None:
+        meta_path = self.state_dir / "meta.json"
+        if not meta_path.exists():
+            return
+        meta = json.loads(meta_path.read_text(encoding="utf8"))
+        if meta.get("version") != WATCH_STATE_VERSION or meta["source"] != self.source:
+            self.reset()
+            return
+        with (self.state_dir / "annotations.jsonl").open("rb") as f:
+            # Anything after `log_size` was written by an interrupted refresh
+            lines = f.read(meta["log_size"]).splitlines()
+        for line in lines:
+            self._apply(*(hashable(value) for value in json.loads(line)))
+        self.meta = meta
+        self.offset = meta["offset"]
+
+    def _apply(self, example: Hashable, annotator: Hashable, value: Any) -> None:
+        if (example, annotator) in self.accumulator:
+            self.accumulator.remove(example, annotator)
+        self.accumulator.add(example, annotator, value)
+
+    def _save(self, annotations: List[Annotation]) -> None:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        with (self.state_dir / "annotations.jsonl").open("ab") as f:
+            f.truncate(self.meta["log_size"])
+            for annotation in annotations:
+                f.write(json.dumps(annotation).encode("utf8") + b"\n")
+            log_size = f.tell()
+        self.meta.update(
+            offset=self.offset,
+            validation=file_head(self.path, self.offset),
+            log_size=log_size,
+        )
+        tmp_path = self.state_dir / "meta.json.tmp"
+        tmp_path.write_text(json.dumps(self.meta), encoding="utf8")
+        os.replace(tmp_path, self.state_dir / "meta.json")
+
+    def refresh(self) -> int:
+        """Reads the lines appended since the last refresh and updates the
+        statistics. Returns the number of annotations read."""
+        if self.offset:
+            size = self.path.stat().st_size
+            if size < self.offset or (
+                file_head(self.path, self.offset) != self.meta["validation"]
+            ):
+                self.reset()
+        keys = annotation_keys(self.annotator_id, self.example_id)
+        annotations = []
+        offset = self.offset
+        for example, offset in read_jsonl_checkpointed(self.path, keys, self.offset):
+            annotation = (
+                example[self.example_id],
+                example[self.annotator_id],
+                self.value_getter(example),
+            )
+            self._apply(*annotation)
+            annotations.append(annotation)
+        if offset != self.offset:
+            self.offset = offset
+            if self.state_dir is not None:
+                self._save(annotations)
+            else:
+                self.meta.update(offset=offset, validation=file_head(self.path, offset))
+        return len(annotations)
+
+    def stats(self) -> Dict[str, Any]:
+        """The current statistics, in the format returned by `calculate_agreement`,
+        plus the number of annotations and the byte offset read up to."""
+        return {
+            **self.accumulator.stats(),
+            "n_annotations": len(self.accumulator),
+            "offset": self.offset,
+        }
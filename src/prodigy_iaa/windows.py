@@ -0,0 +1,207 @@
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from .measures import (
+    AC_PA_SUM,
+    KRIPP_PA_SUM,
+    N_COINCIDENT,
+    N_SCALAR_STATISTICS,
+    Codes,
+    SparseReliability,
+    Weighting,
+    agreement_from_statistics,
+    example_statistics,
+    format_agreement,
+    split_statistics,
+    sum_by_group,
+    weight_matrix,
+)
+
+# Seconds per unit of a duration like "7d", see `parse_duration`
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(duration: Union[str, float]) -> float:
+    """Converts a duration like "90m", "12h", "7d" or "2w" (or a number of seconds)
+    to seconds."""
+    if isinstance(duration, (int, float)):
+        seconds = float(duration)
+    else:
+        duration = duration.strip()
+        unit = DURATION_UNITS.get(duration[-1:], None)
+        number = duration[:-1] if unit is not None else duration
+        try:
+            seconds = float(number) * (unit or 1)
+        except ValueError:
+            raise ValueError(
+                f"Invalid duration {duration!r}, expected a number followed by "
+                f"one of: {', '.join(DURATION_UNITS)}"
+            ) from None
+    if not seconds > 0:
+        raise ValueError(f"Duration has to be positive, got {duration!r}")
+    return seconds
+
+
+class Windows(NamedTuple):
+    """Windows `[starts[i], starts[i] + window)` over time, with the (W x (5 + 3K))
+    sufficient statistics of the annotations made in each window and the number
+    of annotators who made them."""
+
+    starts: np.ndarray
+    window: float
+    statistics: np.ndarray
+    n_annotators: np.ndarray
+
+    @property
+    def ends(self) -> np.ndarray:
+        return self.starts + self.window
+
+
+def _timed_coordinates(
+    codes: Codes, times: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """The example, annotator, category code and time of every annotation with a
+    time, given `times` in the layout of `codes`."""
+    if isinstance(codes, SparseReliability):
+        rows, cols, values = codes.rows, codes.cols, codes.codes
+    else:
+        rows, cols = np.nonzero(codes >= 0)
+        values, times = codes[rows, cols], times[rows, cols]
+    keep = (values >= 0) & np.isfinite(times)
+    return rows[keep], cols[keep], values[keep], times[keep]
+
+
+def _run_starts(keys: np.ndarray) -> np.ndarray:
+    """Positions where a run of equal, consecutive `keys` starts."""
+    return np.flatnonzero(np.diff(keys, prepend=keys[:1] - 1))
+
+
+def _running_counts(keys: np.ndarray, deltas: np.ndarray) -> np.ndarray:
+    """Running totals of `deltas` within each run of equal, consecutive `keys`."""
+    totals = np.cumsum(deltas, axis=0)
+    starts = _run_starts(keys)
+    offsets = np.repeat(
+        totals[starts] - deltas[starts], np.diff(starts, append=len(keys)), axis=0
+    )
+    return totals - offsets
+
+
+def windowed_statistics(
+    codes: Codes,
+    times: np.ndarray,
+    n_categories: int,
+    weights: np.ndarray,
+    window: float,
+    step: Optional[float] = None,
+    chunk_size: int = 100_000,
+) -> Windows:
+    """Calculates the sufficient statistics of every window of `window` seconds,
+    starting every `step` seconds (defaults to `window`, i.e. tumbling windows),
+    for the annotations of an (N x A) code array or `SparseReliability` with
+    their `times` (see `processors.examples_to_codes` with a `time_key`).
+    Annotations without a time are skipped.
+
+    The annotations are sorted into windows once and swept over: every
+    annotation is added to its example's counts when it enters a window and
+    retracted when it leaves, and only the change of the example's statistics
+    is recorded, so the cost is proportional to the number of annotations, not
+    to how many windows each annotation is part of. Windows are aligned to
+    multiples of `step`."""
+    step = window if step is None else step
+    rows, cols, values, times = _timed_coordinates(codes, times)
+    n_statistics = N_SCALAR_STATISTICS + 3 * n_categories
+    if len(times) == 0:
+        return Windows(
+            np.zeros(0), window, np.zeros((0, n_statistics)), np.zeros(0, dtype=int)
+        )
+    # Every window starting at a multiple of `step` that has an annotation
+    first = np.floor((times.min() - window) / step) + 1
+    last = np.floor(times.max() / step)
+    starts = np.arange(first, last + 1) * step
+    ends = starts + window
+
+    # An annotation enters at its time and leaves once the window has moved on.
+    # Events with times in [ends[i - 1], ends[i]) change window i and later ones.
+    n_buckets = len(starts) + 1
+    buckets = np.concatenate(
+        [
+            np.searchsorted(ends, times, side="right"),
+            np.searchsorted(ends, times + window, side="right"),
+        ]
+    )
+    signs = np.repeat([1, -1], len(times))
+    event_rows, event_cols = np.tile(rows, 2), np.tile(cols, 2)
+    event_values = np.tile(values, 2)
+    # Process events by example and bucket, so every example's counts after an
+    # event are running totals. Within a bucket only the total change counts,
+    # so the order of events there doesn't matter.
+    order = np.argsort(event_rows * n_buckets + buckets)
+    statistics = np.zeros((n_buckets, n_statistics))
+    # Chunks of about `chunk_size` events, without splitting an example
+    boundaries = np.flatnonzero(np.diff(event_rows[order], prepend=-1))
+    chunk_starts = np.unique(
+        boundaries[np.searchsorted(boundaries, np.arange(0, len(order), chunk_size))]
+    )
+    chunk_ends = np.append(chunk_starts[1:], len(order))
+    for start, end in zip(chunk_starts, chunk_ends):
+        chunk = order[start:end]
+        deltas = np.zeros((len(chunk), n_categories))
+        deltas[np.arange(len(chunk)), event_values[chunk]] = signs[chunk]
+        after = example_statistics(_running_counts(event_rows[chunk], deltas), weights)
+        # The statistics before an event are those after the example's last one
+        before = np.roll(after, 1, axis=0)
+        before[_run_starts(event_rows[chunk])] = 0
+        statistics += sum_by_group(after - before, buckets[chunk], n_buckets)
+
+    # An annotator is in a window while they have at least one annotation in it
+    order = np.argsort(event_cols * n_buckets + buckets)
+    counts = _running_counts(event_cols[order], signs[order])
+    active = (counts > 0).astype(int) - (counts - signs[order] > 0)
+    n_annotators = np.bincount(buckets[order], active, minlength=n_buckets)
+    statistics = np.cumsum(statistics, axis=0)[:-1]
+    # Counts are exact, but fractional sums of retracted examples can leave
+    # rounding errors where they should be 0
+    scalars, _, proportions, totals = split_statistics(statistics, n_categories)
+    scalars[scalars[:, N_COINCIDENT] == 0, KRIPP_PA_SUM : AC_PA_SUM + 1] = 0
+    proportions[totals == 0] = 0
+    return Windows(
+        starts, window, statistics, np.cumsum(n_annotators)[:-1].round().astype(int)
+    )
+
+
+def windowed_agreement(
+    codes: Codes,
+    categories: List[Any],
+    times: np.ndarray,
+    window: Union[str, float],
+    step: Optional[Union[str, float]] = None,
+    weighting: Weighting = "identity",
+) -> List[Dict[str, Any]]:
+    """Calculates agreement in every time window (see `windowed_statistics`), e.g.
+    to monitor drift week over week. `window` and `step` are durations in seconds
+    or strings like "7d" (see `parse_duration`). Returns one record per window in
+    time order, with its `start` and `end` and the statistics of
+    `calculate_agreement` for the annotations made in the window."""
+    weights = weight_matrix(categories, weighting)
+    windows = windowed_statistics(
+        codes,
+        times,
+        len(categories),
+        weights,
+        parse_duration(window),
+        None if step is None else parse_duration(step),
+    )
+    agreement = agreement_from_statistics(windows.statistics, weights)
+    return [
+        {
+            "start": float(start),
+            "end": float(end),
+            **format_agreement(
+                {key: value[i] for key, value in agreement.items()},
+                categories,
+                int(windows.n_annotators[i]),
+            ),
+        }
+        for i, (start, end) in enumerate(zip(windows.starts, windows.ends))
+    ]
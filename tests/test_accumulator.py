@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from prodigy_iaa.accumulator import AgreementAccumulator
+from prodigy_iaa.measures import calculate_agreement_vectorized
+
+
+def assert_same_stats(result, expected):
+    for key in ("percent_agreement", "kripp_alpha", "ac2", "avg_raters_per_example"):
+        assert result[key] == pytest.approx(expected[key], abs=1e-9)
+    for key in ("n_examples", "n_coincident_examples", "n_annotators"):
+        assert result[key] == expected[key]
+
+
+@pytest.mark.parametrize("weighting", ["identity", "quadratic"])
+def test_accumulator_matches_full_recompute(reliability_data2, weighting):
+    accumulator = AgreementAccumulator([0, 1, 2, 3], weighting=weighting)
+    for task, row in enumerate(reliability_data2):
+        for annotator, value in enumerate(row):
+            if value is not None:
+                accumulator.add(task, annotator, value)
+    expected = calculate_agreement_vectorized(reliability_data2, weighting=weighting)
+    assert_same_stats(accumulator.stats(), expected)
+
+    # Retract a random half of the annotations, one at a time
+    rng = np.random.default_rng(0)
+    remaining = [list(row) for row in reliability_data2]
+    annotations = [
+        (task, annotator)
+        for task, row in enumerate(remaining)
+        for annotator, value in enumerate(row)
+        if value is not None
+    ]
+    for i in rng.permutation(len(annotations))[: len(annotations) // 2]:
+        task, annotator = annotations[i]
+        accumulator.remove(task, annotator)
+        remaining[task][annotator] = None
+    expected = calculate_agreement_vectorized(
+        [row for row in remaining if any(v is not None for v in row)],
+        weighting=weighting,
+    )
+    assert_same_stats(accumulator.stats(), expected)
+
+
+def test_accumulator_validation():
+    accumulator = AgreementAccumulator(["accept", "reject"])
+    accumulator.add(1, "a", "accept")
+    with pytest.raises(ValueError):
+        accumulator.add(1, "a", "reject")
+    with pytest.raises(ValueError):
+        accumulator.add(1, "b", "ignore")
+    with pytest.raises(KeyError):
+        accumulator.remove(1, "b")
+    accumulator.remove(1, "a")
+    assert len(accumulator) == 0
+    assert not accumulator.statistics.any()
+
+
+def test_accumulator_adds_categories(reliability_data2):
+    accumulator = AgreementAccumulator()
+    for task, row in enumerate(reliability_data2):
+        for annotator, value in enumerate(row):
+            if value is not None:
+                accumulator.add(task, annotator, value)
+    assert sorted(accumulator.categories) == [0, 1, 2, 3]
+    expected = calculate_agreement_vectorized(reliability_data2)
+    assert_same_stats(accumulator.stats(), expected)
+    assert (0, 0) in accumulator and (0, 99) not in accumulator
+    with pytest.raises(ValueError):
+        AgreementAccumulator(weighting="ordinal")
@@ -0,0 +1,54 @@
+import pytest
+import srsly
+
+pyarrow = pytest.importorskip("pyarrow")
+import pyarrow.feather  # noqa: E402
+import pyarrow.parquet  # noqa: E402
+
+from prodigy_iaa.arrow import read_arrow_annotations  # noqa: E402
+
+from .test_cache import assert_same_codes, make_examples  # noqa: E402
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".arrow"])
+def test_read_arrow_annotations(tmp_path, suffix):
+    examples = make_examples(30)
+    table = pyarrow.Table.from_pylist(examples)
+    path = tmp_path / f"data{suffix}"
+    if suffix == ".parquet":
+        # Several row groups, so columns are chunked
+        pyarrow.parquet.write_table(table, path, row_group_size=7)
+    else:
+        pyarrow.feather.write_feather(table, path, chunksize=7)
+    columns = read_arrow_annotations(path)
+    assert_same_codes(columns, examples)
+
+
+def test_read_arrow_annotations_missing_columns(tmp_path):
+    examples = [
+        {"_task_hash": i % 3, "_session_id": f"a{i // 3}", "answer": "accept"}
+        for i in range(6)
+    ]
+    path = tmp_path / "data.parquet"
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(examples), path)
+    columns = read_arrow_annotations(path)
+    assert columns.n_accept.tolist() == [0] * 6
+    with pytest.raises(ValueError):
+        read_arrow_annotations(path, annotator_id="_dataset_id")
+
+
+def test_batch_parquet_entry(tmp_path):
+    from prodigy_iaa.batch import run_batch
+
+    examples = make_examples(30)
+    path = tmp_path / "data.parquet"
+    pyarrow.parquet.write_table(pyarrow.Table.from_pylist(examples), path)
+    jsonl_path = tmp_path / "data.jsonl"
+    srsly.write_jsonl(jsonl_path, examples)
+    entries = [
+        {"type": file_type, "path": str(p), "annotation_type": "multiclass"}
+        for file_type, p in (("parquet", path), ("jsonl", jsonl_path))
+    ]
+    parquet, jsonl = run_batch(entries)
+    assert parquet["kripp_alpha"] == jsonl["kripp_alpha"]
+    assert parquet["n_examples"] == jsonl["n_examples"]
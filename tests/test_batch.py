@@ -0,0 +1,78 @@
+import pytest
+import srsly
+
+from prodigy_iaa.batch import read_manifest, run_batch
+from prodigy_iaa.measures import calculate_agreement
+
+from .test_loaders import prodigy_sqlite_db
+from .test_processors import LocalDatabase, long_examples
+
+
+@pytest.fixture
+def batch_sources(tmp_path, reliability_data1, reliability_data2):
+    path = tmp_path / "data.jsonl"
+    srsly.write_jsonl(
+        path,
+        [
+            {**eg, "answer": "accept", "accept": [eg["answer"]]}
+            for eg in long_examples(reliability_data1)
+        ],
+    )
+    annotator_a = [
+        {"_task_hash": i, "answer": "accept", "accept": ["X"] if i else ["X", "Y"]}
+        for i in range(3)
+    ]
+    annotator_b = [
+        {"_task_hash": i, "answer": "accept", "accept": ["Y"]} for i in range(1, 4)
+    ]
+    duplicates = [
+        {"_task_hash": 1, "_session_id": "a", "answer": "accept"},
+        {"_task_hash": 1, "_session_id": "a", "answer": "reject"},
+    ]
+    connection = prodigy_sqlite_db(
+        tmp_path / "prodigy.db",
+        {"a": annotator_a, "b": annotator_b, "duplicates": duplicates},
+    )
+    DB = LocalDatabase(connection, ["a", "b", "duplicates"])
+    entries = [
+        {"type": "jsonl", "path": str(path), "annotation_type": "multiclass"},
+        {
+            "name": "labels",
+            "type": "datasets",
+            "datasets": ["a", "b"],
+            "annotation_type": "multilabel",
+            "labels": ["X", "Y"],
+        },
+        {"type": "sessions", "datasets": "duplicates", "annotation_type": "binary"},
+    ]
+    return entries, DB
+
+
+def test_run_batch(batch_sources, reliability_data1):
+    entries, DB = batch_sources
+    records = list(run_batch(entries, DB=DB))
+    names = [entries[0]["path"]] + ["labels"] * 4 + ["duplicates"]
+    assert [r["name"] for r in records] == names
+    assert "error" in records[-1] and "error" not in records[0]
+    jsonl = records[0]
+    expected = calculate_agreement(reliability_data1)
+    for key in ("percent_agreement", "kripp_alpha", "ac2", "n_examples"):
+        assert jsonl[key] == pytest.approx(expected[key])
+    assert [r.get("label") for r in records[1:3]] == ["X", "Y"]
+    assert [r.get("average") for r in records[3:5]] == ["macro", "micro"]
+    # JSONL entries are read in the worker processes
+    assert list(run_batch(entries[:1], n_process=2)) == records[:1]
+
+
+def test_run_batch_errors(batch_sources, tmp_path):
+    entries, DB = batch_sources
+    entries.append(entries[2])
+    records = list(run_batch(entries[2:], DB=DB))
+    assert len(records) == 2
+    assert all("error" in record for record in records)
+    manifest = tmp_path / "manifest.jsonl"
+    srsly.write_jsonl(manifest, entries[:2])
+    assert read_manifest(manifest) == entries[:2]
+    srsly.write_json(manifest, [{"type": "jsonl", "annotation_type": "binary"}])
+    with pytest.raises(ValueError):
+        read_manifest(manifest)
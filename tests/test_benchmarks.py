@@ -0,0 +1,35 @@
+import pytest
+
+from benchmarks.generators import generate_examples, scaling_grid
+from benchmarks.run import compare
+from prodigy_iaa.processors import VALUE_GETTERS, examples_to_codes
+
+
+@pytest.mark.parametrize("task", ["binary", "multiclass", "multilabel"])
+def test_generate_examples(task):
+    examples = generate_examples(
+        task, n_examples=200, n_annotators=4, n_categories=3, overlap=0.0
+    )
+    # Without overlap, every example has exactly one annotation
+    assert len(examples) == 200
+    examples = generate_examples(
+        task, n_examples=200, n_annotators=4, n_categories=3, overlap=1.0
+    )
+    assert len(examples) == 800
+    if task != "multilabel":
+        reliability = examples_to_codes(examples, value_getter=VALUE_GETTERS[task])
+        assert reliability.codes.shape == (200, 4)
+        assert len(reliability.categories) == (2 if task == "binary" else 3)
+
+
+def test_scaling_grid_and_compare():
+    base = {"n_examples": 10, "n_annotators": 2, "n_categories": 2}
+    base.update(overlap=0.5, skew=0.0)
+    configs = list(scaling_grid(base, {"n_examples": [10, 20], "skew": [1.0]}))
+    assert [c["n_examples"] for c in configs] == [10, 20, 10]
+    assert [c["skew"] for c in configs] == [0.0, 0.0, 1.0]
+    baseline = [{"task": "binary", "stage": "s", "seconds": 1.0, **c} for c in configs]
+    results = [{**r, "seconds": 1.1} for r in baseline]
+    assert compare(results, baseline, threshold=0.25) == []
+    results[1]["seconds"] = 2.0
+    assert len(compare(results, baseline, threshold=0.25)) == 1
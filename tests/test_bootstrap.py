@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from prodigy_iaa.bootstrap import bootstrap_agreement
+from prodigy_iaa.measures import (
+    agreement_statistics,
+    annotation_coordinates,
+    build_agreement_array,
+    calculate_agreement,
+    encode_reliability,
+    sparse_agreement_table,
+    weighted_agreement_statistics,
+)
+
+
+def test_weighted_statistics_repeat_examples(reliability_data2):
+    codes, categories = encode_reliability(reliability_data2)
+    table = build_agreement_array(codes, len(categories))
+    weights = np.eye(len(categories))
+    counts = np.arange(len(table)) % 3
+    expected = agreement_statistics(np.repeat(table, counts, axis=0), weights)
+    result = weighted_agreement_statistics(table, weights, counts[None])
+    assert result[0] == pytest.approx(expected)
+
+
+def test_bootstrap_agreement(reliability_data2):
+    codes, categories = encode_reliability(reliability_data2)
+    table = build_agreement_array(codes, len(categories))
+    intervals = bootstrap_agreement(table, categories, n_samples=200, batch_size=64)
+    expected = calculate_agreement(reliability_data2)
+    for measure, interval in intervals.items():
+        assert interval["estimate"] == pytest.approx(expected[measure])
+        assert interval["lower"] < interval["estimate"] < interval["upper"]
+
+    # Same seeds are used no matter how many processes run the batches
+    parallel = bootstrap_agreement(
+        table, categories, n_samples=200, batch_size=64, n_process=2
+    )
+    assert parallel == intervals
+
+
+def test_bootstrap_agreement_sparse_table(reliability_data2):
+    codes, categories = encode_reliability(reliability_data2)
+    rows, _, values = annotation_coordinates(codes)
+    sparse = sparse_agreement_table(rows, values, len(codes), len(categories))
+    dense = build_agreement_array(codes, len(categories))
+    for weighting in ("identity", "ordinal"):
+        kwargs = dict(weighting=weighting, n_samples=100, batch_size=32)
+        expected = bootstrap_agreement(dense, categories, **kwargs)
+        assert bootstrap_agreement(sparse, categories, **kwargs) == expected
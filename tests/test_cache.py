@@ -0,0 +1,132 @@
+import srsly
+
+from prodigy_iaa.cache import cached_jsonl_annotations, cached_sql_annotations
+from prodigy_iaa.processors import (
+    columns_to_codes,
+    columns_to_multilabel_codes,
+    examples_to_codes,
+    examples_to_multilabel_codes,
+    get_answer,
+    get_choice,
+)
+
+from .test_loaders import prodigy_sqlite_db
+
+
+def make_examples(n, offset=0):
+    return [
+        {
+            "text": f"Example {i}",
+            "_task_hash": i % 5,
+            "_session_id": f"annotator-{i // 5}",
+            "answer": ["accept", "reject", "ignore"][i % 3],
+            "accept": [["A"], ["B", "A"], []][i % 4 % 3],
+        }
+        for i in range(offset, offset + n)
+    ]
+
+
+def assert_same_codes(columns, examples):
+    for annotation_type, value_getter in (
+        ("binary", get_answer),
+        ("multiclass", get_choice),
+    ):
+        expected = examples_to_codes(examples, value_getter=value_getter)
+        result = columns_to_codes(columns, annotation_type)
+        assert result.codes.tolist() == expected.codes.tolist()
+        assert result.categories == expected.categories
+        assert result.examples == expected.examples
+        assert result.annotators == expected.annotators
+        sparse = columns_to_codes(columns, annotation_type, sparse=True)
+        assert sparse.to_list() == expected.to_list()
+    expected = examples_to_multilabel_codes(examples, ["A", "B", "C"])
+    result = columns_to_multilabel_codes(columns, ["A", "B", "C"])
+    assert result.codes.tolist() == expected.codes.tolist()
+
+
+def test_jsonl_cache_refresh(tmp_path):
+    path = tmp_path / "data.jsonl"
+    cache_dir = tmp_path / "cache"
+    examples = make_examples(12)
+    srsly.write_jsonl(path, examples)
+    assert_same_codes(cached_jsonl_annotations(path, cache_dir), examples)
+
+    # Only the new lines are read
+    more = make_examples(8, offset=12)
+    with path.open("a", encoding="utf8") as f:
+        for example in more:
+            f.write(srsly.json_dumps(example) + "\n")
+    meta_path = next(cache_dir.glob("*/meta.json"))
+    checkpoint = srsly.read_json(meta_path)["checkpoint"]
+    columns = cached_jsonl_annotations(path, cache_dir)
+    assert len(columns.example) == 20
+    assert srsly.read_json(meta_path)["checkpoint"] > checkpoint
+    assert_same_codes(columns, examples + more)
+
+    # A rewritten file is read again from scratch
+    srsly.write_jsonl(path, more)
+    assert_same_codes(cached_jsonl_annotations(path, cache_dir), more)
+
+
+def test_jsonl_cache_appends_vocabularies(tmp_path):
+    path = tmp_path / "data.jsonl"
+    cache_dir = tmp_path / "cache"
+    examples = [{**eg, "_task_hash": i} for i, eg in enumerate(make_examples(6))]
+    srsly.write_jsonl(path, examples[:4])
+    cached_jsonl_annotations(path, cache_dir)
+    vocabulary_path = next(cache_dir.glob("*/examples.jsonl"))
+    written = vocabulary_path.read_bytes()
+    # Left by an interrupted refresh, and dropped by the next one
+    with vocabulary_path.open("ab") as f:
+        f.write(b"999\n")
+    with path.open("a", encoding="utf8") as f:
+        for example in examples[4:]:
+            f.write(srsly.json_dumps(example) + "\n")
+    columns = cached_jsonl_annotations(path, cache_dir)
+    assert vocabulary_path.read_bytes() == written + b"4\n5\n"
+    assert columns.examples == list(range(6))
+    meta = srsly.read_json(next(cache_dir.glob("*/meta.json")))
+    assert "vocabularies" not in meta
+    assert_same_codes(columns, examples)
+
+
+def test_jsonl_cache_incomplete_line(tmp_path):
+    path = tmp_path / "data.jsonl"
+    examples = make_examples(5)
+    srsly.write_jsonl(path, examples)
+    partial = srsly.json_dumps(make_examples(1, offset=5)[0])
+    with path.open("a", encoding="utf8") as f:
+        f.write(partial[:10])
+    columns = cached_jsonl_annotations(path, tmp_path / "cache")
+    assert len(columns.example) == 5
+    with path.open("a", encoding="utf8") as f:
+        f.write(partial[10:] + "\n")
+    columns = cached_jsonl_annotations(path, tmp_path / "cache")
+    assert_same_codes(columns, examples + make_examples(1, offset=5))
+
+
+def test_sql_cache_refresh(tmp_path):
+    examples = make_examples(10)
+    connection = prodigy_sqlite_db(tmp_path / "prodigy.db", {"data": examples})
+    cache_dir = tmp_path / "cache"
+
+    def cached():
+        return cached_sql_annotations(
+            connection, "sqlite", ["data"], cache_dir, annotator_id="_session_id"
+        )
+
+    assert_same_codes(cached(), examples)
+    more = make_examples(6, offset=10)
+    for example in more:
+        example_id = connection.execute(
+            "INSERT INTO example (task_hash, content) VALUES (?, ?)",
+            (example["_task_hash"], srsly.json_dumps(example).encode("utf8")),
+        ).lastrowid
+        connection.execute(
+            "INSERT INTO link (example_id, dataset_id) VALUES (?, 1)", (example_id,)
+        )
+    assert_same_codes(cached(), examples + more)
+
+    # Deleted examples invalidate the cache
+    connection.execute("DELETE FROM link WHERE id <= 2")
+    assert_same_codes(cached(), examples[2:] + more)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from prodigy_iaa.contested import contested_records, example_agreement, most_contested
+from prodigy_iaa.measures import SparseReliability, encode_reliability
+
+
+def pair_agreement(row):
+    values = [value for value in row if value is not None]
+    pairs = [
+        (a, b) for i, a in enumerate(values) for j, b in enumerate(values) if i != j
+    ]
+    return sum(a == b for a, b in pairs) / len(pairs)
+
+
+def test_example_agreement(reliability_data2):
+    codes, categories = encode_reliability(reliability_data2)
+    chunks = list(example_agreement(codes, categories, chunk_size=4))
+    assert len(chunks) > 1
+    rows = np.concatenate([chunk.rows for chunk in chunks])
+    expected = [
+        i
+        for i, row in enumerate(reliability_data2)
+        if sum(value is not None for value in row) > 1
+    ]
+    assert rows.tolist() == expected
+    percent_agreement = np.concatenate([chunk.percent_agreement for chunk in chunks])
+    kripp_pa_i = np.concatenate([chunk.kripp_pa_i for chunk in chunks])
+    n_annotations = np.concatenate([chunk.n_annotations for chunk in chunks])
+    for i, row in enumerate(expected):
+        assert percent_agreement[i] == pytest.approx(
+            pair_agreement(reliability_data2[row])
+        )
+        assert kripp_pa_i[i] == pytest.approx(percent_agreement[i] * n_annotations[i])
+
+
+@pytest.mark.parametrize("k", [1, 3, 100])
+def test_most_contested_matches_full_sort(k):
+    rng = np.random.default_rng(0)
+    codes = rng.integers(-1, 3, (200, 4))
+    codes[rng.random(200) < 0.3, 1:] = -1
+    categories = ["a", "b", "c"]
+    chunks = list(example_agreement(codes, categories))
+    scores = sorted(
+        (p, -n, row)
+        for chunk in chunks
+        for p, n, row in zip(chunk.percent_agreement, chunk.n_annotations, chunk.rows)
+    )[:k]
+    for sparse in (False, True):
+        data = SparseReliability.from_codes(codes, categories) if sparse else codes
+        contested = most_contested(data, categories, k=k, chunk_size=16)
+        assert contested.rows.tolist() == [row for _, _, row in scores]
+        assert contested.percent_agreement.tolist() == pytest.approx(
+            [p for p, _, _ in scores]
+        )
+
+
+def test_contested_records():
+    data = [["a", "b", None], ["a", "a", "a"], ["a", None, None], ["b", "a", "a"]]
+    codes, categories = encode_reliability(data)
+    contested = most_contested(codes, categories, k=2)
+    records = list(
+        contested_records(
+            contested, codes, ["t0", "t1", "t2", "t3"], ["x", "y", "z"], categories
+        )
+    )
+    assert [record["_task_hash"] for record in records] == ["t0", "t3"]
+    assert records[0]["annotations"] == {"x": "a", "y": "b"}
+    assert records[1]["percent_agreement"] == pytest.approx(1 / 3)
+    assert records[1]["rank"] == 2
@@ -0,0 +1,62 @@
+import subprocess
+import sys
+
+# Standalone modules that must work without Prodigy (or pyarrow) installed
+MODULES = [
+    "prodigy_iaa",
+    "prodigy_iaa.measures",
+    "prodigy_iaa.processors",
+    "prodigy_iaa.pairwise",
+    "prodigy_iaa.influence",
+    "prodigy_iaa.bootstrap",
+    "prodigy_iaa.contested",
+    "prodigy_iaa.spans",
+    "prodigy_iaa.cache",
+    "prodigy_iaa.batch",
+    "prodigy_iaa.arrow",
+    "prodigy_iaa.render",
+]
+HEAVY_MODULES = ["prodigy", "srsly", "pyarrow", "pandas"]
+# Generous, to catch heavy imports sneaking back in rather than small slowdowns
+MAX_IMPORT_SECONDS = 0.5
+
+BLOCK_AND_IMPORT = """
+import sys, time
+
+class Block:
+    def find_spec(self, name, path=None, target=None):
+        if name.split(".")[0] in {heavy!r}:
+            raise ImportError(f"{{name}} is blocked")
+
+sys.meta_path.insert(0, Block())
+import numpy
+start = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+print(time.perf_counter() - start)
+"""
+
+
+def run_python(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+
+def test_import_without_prodigy():
+    # numpy is imported first, its import time doesn't count
+    code = BLOCK_AND_IMPORT.format(heavy=HEAVY_MODULES, modules=MODULES)
+    seconds = float(run_python(code))
+    assert seconds < MAX_IMPORT_SECONDS
+
+
+def test_import_doesnt_load_heavy_modules():
+    code = f"import sys\nfor m in {MODULES!r}: __import__(m)\n"
+    code += f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    assert run_python(code).strip() == "[]"
+
+
+def test_recipes_are_lazy():
+    code = "import sys, prodigy_iaa\nprint('prodigy_iaa.recipe' in sys.modules)"
+    assert run_python(code).strip() == "False"
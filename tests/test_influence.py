@@ -0,0 +1,27 @@
+import pytest
+
+from prodigy_iaa.influence import influence_records, leave_one_out_agreement
+from prodigy_iaa.measures import calculate_agreement_vectorized, encode_reliability
+
+
+@pytest.mark.parametrize("weighting", ["identity", "ordinal"])
+def test_leave_one_out_matches_recompute(reliability_data2, weighting):
+    codes, categories = encode_reliability(reliability_data2)
+    result = leave_one_out_agreement(codes, categories, weighting=weighting)
+    for a in range(codes.shape[1]):
+        rest = [row[:a] + row[a + 1 :] for row in reliability_data2]
+        rest = [row for row in rest if any(v is not None for v in row)]
+        expected = calculate_agreement_vectorized(rest, weighting=weighting)
+        for measure in ("percent_agreement", "kripp_alpha", "ac2"):
+            assert result[measure][a] == pytest.approx(expected[measure], abs=1e-12)
+
+
+def test_influence_records(reliability_data1):
+    codes, categories = encode_reliability(reliability_data1)
+    result = leave_one_out_agreement(codes, categories)
+    records = list(influence_records(result, ["A", "B", "C", "D"]))
+    deltas = [r["kripp_alpha_delta"] for r in records]
+    assert deltas == sorted(deltas, reverse=True)
+    # Annotator C disagrees most often in the Gwet example
+    assert records[0]["annotator"] == "C"
+    assert records[0]["n_annotations"] == 11
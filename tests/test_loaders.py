@@ -0,0 +1,133 @@
+import sqlite3
+
+import srsly
+
+from prodigy_iaa.loaders import (
+    annotation_keys,
+    read_jsonl_projected,
+    read_sql_projected,
+    sql_distinct_values,
+)
+from prodigy_iaa.processors import examples_to_codes, get_choice
+
+
+def test_read_jsonl_projected(tmp_path):
+    path = tmp_path / "data.jsonl"
+    examples = [
+        {
+            "text": "Some long text",
+            "tokens": [{"text": "Some"}],
+            "_task_hash": i % 2,
+            "_session_id": f"annotator-{i // 2}",
+            "answer": "accept",
+            "accept": ["A" if i < 3 else "B"],
+        }
+        for i in range(4)
+    ]
+    srsly.write_jsonl(path, examples)
+    projected = read_jsonl_projected(path, annotation_keys("_session_id"))
+    first = next(projected)
+    assert first == {
+        "_task_hash": 0,
+        "_session_id": "annotator-0",
+        "answer": "accept",
+        "accept": ["A"],
+    }
+    reliability = examples_to_codes(projected, value_getter=get_choice)
+    assert reliability.to_list() == [["A", "B"], [None, "A"]]
+
+
+def prodigy_sqlite_db(path, datasets):
+    """Creates a SQLite database with the tables Prodigy uses to store examples.
+    `datasets` maps dataset names to lists of examples."""
+    connection = sqlite3.connect(str(path))
+    connection.executescript(
+        """
+        CREATE TABLE dataset (id INTEGER PRIMARY KEY, name TEXT, created INTEGER, meta BLOB, session BOOLEAN);
+        CREATE TABLE example (id INTEGER PRIMARY KEY, input_hash INTEGER, task_hash INTEGER, content BLOB);
+        CREATE TABLE link (id INTEGER PRIMARY KEY, example_id INTEGER, dataset_id INTEGER);
+        """
+    )
+    for name, examples in datasets.items():
+        dataset_id = connection.execute(
+            "INSERT INTO dataset (name, session) VALUES (?, 0)", (name,)
+        ).lastrowid
+        for example in examples:
+            example_id = connection.execute(
+                "INSERT INTO example (input_hash, task_hash, content) VALUES (?, ?, ?)",
+                (
+                    example.get("_input_hash"),
+                    example["_task_hash"],
+                    srsly.json_dumps(example).encode("utf8"),
+                ),
+            ).lastrowid
+            connection.execute(
+                "INSERT INTO link (example_id, dataset_id) VALUES (?, ?)",
+                (example_id, dataset_id),
+            )
+    connection.commit()
+    return connection
+
+
+def test_read_sql_projected(tmp_path):
+    examples = [
+        {
+            "text": f"Example {i}",
+            "_task_hash": i % 3,
+            "_session_id": f"annotator-{i % 2}",
+            "answer": "accept",
+            "accept": ["A"] if i % 2 else [],
+            "label": "LABEL",
+        }
+        for i in range(7)
+    ]
+    connection = prodigy_sqlite_db(
+        tmp_path / "prodigy.db", {"first": examples[:4], "second": examples[4:]}
+    )
+    projected = list(
+        read_sql_projected(connection, "sqlite", ["first", "second"], page_size=3)
+    )
+    assert len(projected) == 7
+    assert projected[1] == {
+        "_task_hash": 1,
+        "_dataset_id": "first",
+        "_session_id": "annotator-1",
+        "answer": "accept",
+        "accept": ["A"],
+    }
+    assert [eg["_dataset_id"] for eg in projected] == ["first"] * 4 + ["second"] * 3
+    only_second = list(read_sql_projected(connection, "sqlite", ["second"]))
+    assert [eg["_task_hash"] for eg in only_second] == [1, 2, 0]
+
+    assert sql_distinct_values(connection, "sqlite", ["first", "second"], "label") == 1
+    assert sql_distinct_values(connection, "sqlite", ["first"], "view_id") == 1
+    assert sql_distinct_values(connection, "sqlite", ["first"], "_session_id") == 2
+
+
+def test_read_sql_projected_extra_keys(tmp_path):
+    base = {"_task_hash": 1, "_session_id": "a", "answer": "accept"}
+    examples = [
+        {**base, "_timestamp": 1690000000, "meta": {"source": "web", "n": 2}},
+        {**base, "_timestamp": 1.5, "meta": {"source": ["a", 1], "flag": True}},
+        {**base, "meta.source": "literal", "meta": {"source": "nested"}},
+        {**base, "meta": {"other": None}},
+    ]
+    connection = prodigy_sqlite_db(tmp_path / "prodigy.db", {"data": examples})
+    projected = list(
+        read_sql_projected(
+            connection,
+            "sqlite",
+            ["data"],
+            extra_keys=("meta.source", "meta.flag", "_timestamp"),
+        )
+    )
+    assert projected[0]["_timestamp"] == 1690000000
+    assert projected[0]["meta"] == {"source": "web"}
+    assert projected[1]["_timestamp"] == 1.5
+    assert projected[1]["meta"] == {"source": ["a", 1], "flag": True}
+    assert projected[2]["meta.source"] == "literal"
+    assert "meta" not in projected[2]
+    assert "meta" not in projected[3] and "_timestamp" not in projected[3]
+    projected[1]["_task_hash"] = 2
+    reliability = examples_to_codes(projected[:2], group_by="meta.source")
+    assert set(reliability.group_values) == {("a", 1), "web"}
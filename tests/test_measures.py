@@ -3,9 +3,29 @@
 K. L. Gwet, “On Krippendorff’s Alpha Coefficient,” p. 16, 2015.
 https://agreestat.com/papers/onkrippendorffalpha_rev10052015.pdf
 """
+import warnings
+
+import numpy as np
 import pytest
 
-from prodigy_iaa.measures import calculate_agreement
+from prodigy_iaa.measures import (
+    SparseReliability,
+    agreement_by_group,
+    agreement_from_codes,
+    agreement_from_multilabel_codes,
+    agreement_from_statistics,
+    agreement_statistics,
+    build_agreement_array,
+    build_agreement_table,
+    calculate_agreement,
+    calculate_agreement_vectorized,
+    encode_reliability,
+    grouped_agreement_statistics,
+    multilabel_agreement_by_group,
+    sparse_agreement_statistics,
+    sparse_agreement_table,
+    weight_matrix,
+)
 
 
 def test_data1(reliability_data1):
@@ -24,3 +44,231 @@ def test_data2(reliability_data2):
     assert agreement_stats["percent_agreement"] == pytest.approx(0.6250, 0.0001)
     assert agreement_stats["kripp_alpha"] == pytest.approx(0.4765, 0.0001)
     assert agreement_stats["ac2"] == pytest.approx(0.5093, 0.0001)
+
+
+@pytest.mark.parametrize("fixture", ["reliability_data1", "reliability_data2"])
+def test_vectorized_matches_reference(fixture, request):
+    reliability_data = request.getfixturevalue(fixture)
+    expected = calculate_agreement(reliability_data)
+    result = calculate_agreement_vectorized(reliability_data)
+    assert result.keys() == expected.keys()
+    for key in ("percent_agreement", "kripp_alpha", "ac2", "avg_raters_per_example"):
+        assert result[key] == pytest.approx(expected[key], abs=1e-12)
+    for key in (
+        "n_categories",
+        "n_annotators",
+        "n_examples",
+        "n_coincident_examples",
+        "n_single_annotation",
+        "coincident_annotations_per_category",
+    ):
+        assert result[key] == expected[key]
+
+
+def test_agreement_table_array(reliability_data1):
+    codes, categories = encode_reliability(reliability_data1)
+    table = build_agreement_array(codes, len(categories))
+    reference = build_agreement_table(reliability_data1)
+    assert table.shape == (len(reliability_data1), len(categories))
+    for row, counter in zip(table, reference):
+        assert {k: v for k, v in zip(categories, row)} == dict(counter)
+
+
+def test_builtin_weight_matrices():
+    categories = [1, 2, 3, 4, 5]
+    for name in ("identity", "ordinal", "linear", "quadratic", "interval", "ratio"):
+        weights = weight_matrix(categories, name)
+        assert weights.shape == (5, 5)
+        assert np.allclose(np.diag(weights), 1)
+        assert np.allclose(weights, weights.T)
+        assert weights.min() >= 0
+    assert np.array_equal(weight_matrix(categories, "identity"), np.eye(5))
+    assert weight_matrix(categories, "linear")[0, 4] == 0
+    assert weight_matrix(categories, "quadratic")[0, 1] == pytest.approx(1 - 1 / 16)
+    # Cached per category set
+    assert weight_matrix(categories, "ordinal") is weight_matrix(categories, "ordinal")
+    with pytest.raises(ValueError):
+        weight_matrix(["good", "bad"], "linear")
+
+
+@pytest.mark.parametrize("fixture", ["reliability_data1", "reliability_data2"])
+def test_weighted_vectorized_matches_reference(fixture, request):
+    reliability_data = request.getfixturevalue(fixture)
+
+    def quadratic(k, l):
+        return 1 - (k - l) ** 2 / 25
+
+    categories = encode_reliability(reliability_data)[1]
+    matrix = weight_matrix(categories, quadratic)
+    expected = calculate_agreement(reliability_data, weighting=quadratic)
+    for weighting in (quadratic, matrix):
+        result = calculate_agreement_vectorized(reliability_data, weighting=weighting)
+        for key in ("percent_agreement", "kripp_alpha", "ac2"):
+            assert result[key] == pytest.approx(expected[key], abs=1e-12)
+
+
+def test_interval_and_ratio_alpha(reliability_data1, reliability_data2):
+    # Values from the `krippendorff` package's interval and ratio metrics
+    stats1 = calculate_agreement_vectorized(reliability_data1, weighting="interval")
+    stats2 = calculate_agreement_vectorized(reliability_data2, weighting="interval")
+    assert stats1["kripp_alpha"] == pytest.approx(0.8491, 0.0001)
+    assert stats2["kripp_alpha"] == pytest.approx(0.7574, 0.0001)
+    stats1 = calculate_agreement_vectorized(reliability_data1, weighting="ratio")
+    assert stats1["kripp_alpha"] == pytest.approx(0.7974, 0.0001)
+
+
+def test_multilabel_batch_matches_per_label():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 2, size=(50, 4, 3)).astype(np.int8)
+    # Some annotators skip some examples entirely
+    codes[rng.random((50, 4)) < 0.3] = -1
+    codes[codes.max(axis=(1, 2)) < 0, 0] = 1
+    labels = ["A", "B", "C"]
+    per_label, summary = agreement_from_multilabel_codes(codes, labels)
+
+    def to_matrix(values):
+        return [[None if v < 0 else int(v) for v in row] for row in values.tolist()]
+
+    for i, label in enumerate(labels):
+        expected = calculate_agreement(to_matrix(codes[:, :, i]))
+        for key in ("percent_agreement", "kripp_alpha", "ac2"):
+            assert per_label[label][key] == pytest.approx(expected[key], abs=1e-12)
+        assert per_label[label]["n_examples"] == expected["n_examples"]
+    stacked = to_matrix(codes.transpose(2, 0, 1).reshape(-1, 4))
+    expected = calculate_agreement(stacked)
+    for key in ("percent_agreement", "kripp_alpha", "ac2"):
+        assert summary["micro"][key] == pytest.approx(expected[key], abs=1e-12)
+        assert summary["macro"][key] == pytest.approx(
+            np.mean([per_label[label][key] for label in labels])
+        )
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_single_category_is_nan(sparse):
+    data = [["a", "a"], ["a", None], ["a", "a"]]
+    with pytest.raises(ZeroDivisionError):
+        calculate_agreement(data)
+    reliability = SparseReliability.from_matrix(data) if sparse else data
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        result = calculate_agreement_vectorized(reliability)
+    assert result["percent_agreement"] == 1
+    assert np.isnan(result["kripp_alpha"]) and np.isnan(result["ac2"])
+    assert result["n_categories"] == 1
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_no_coincident_examples_is_nan(sparse):
+    data = [["a", None], [None, "b"]]
+    with pytest.raises(ZeroDivisionError):
+        calculate_agreement(data)
+    reliability = SparseReliability.from_matrix(data) if sparse else data
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        result = calculate_agreement_vectorized(reliability)
+    for key in ("percent_agreement", "kripp_alpha", "ac2"):
+        assert np.isnan(result[key])
+    assert result["n_coincident_examples"] == 0
+    assert result["n_single_annotation"] == 2
+
+
+@pytest.mark.parametrize("weighting", ["identity", "interval"])
+def test_sparse_table_matches_dense(weighting):
+    rng = np.random.default_rng(0)
+    n_categories = 200
+    codes = rng.integers(0, n_categories, size=(300, 5))
+    # Mostly agreeing annotators, with some missing values
+    agree = rng.random((300, 5)) < 0.6
+    codes[agree] = np.broadcast_to(codes[:, :1], codes.shape)[agree]
+    codes[rng.random((300, 5)) < 0.2] = -1
+    codes[-1] = -1
+    categories = list(range(n_categories))
+    weights = weight_matrix(categories, weighting)
+    dense = build_agreement_array(codes, n_categories)
+    rows, cols = np.nonzero(codes >= 0)
+    sparse = sparse_agreement_table(rows, codes[rows, cols], 300, n_categories)
+    assert sparse.shape == dense.shape
+    assert np.array_equal(sparse.toarray(), dense)
+    np.testing.assert_allclose(
+        sparse_agreement_statistics(sparse, weights),
+        agreement_statistics(dense, weights),
+        atol=1e-9,
+    )
+    expected = agreement_from_statistics(agreement_statistics(dense, weights), weights)
+    result = agreement_from_codes(codes, categories, weighting)
+    for key in ("percent_agreement", "kripp_alpha", "ac2"):
+        assert result[key] == pytest.approx(float(expected[key]), abs=1e-12)
+
+
+def test_sparse_reliability(reliability_data1, reliability_data2):
+    from prodigy_iaa.render import render_descriptives
+
+    for data in (reliability_data1, reliability_data2):
+        sparse = SparseReliability.from_matrix(data)
+        assert sparse.to_list() == data
+        assert len(sparse.rows) == sum(v is not None for row in data for v in row)
+        expected = calculate_agreement(data)
+        result = calculate_agreement(sparse)
+        for key in ("percent_agreement", "kripp_alpha", "ac2"):
+            assert result[key] == pytest.approx(expected[key], abs=1e-12)
+        assert render_descriptives(sparse) == render_descriptives(expected)
+
+
+@pytest.mark.parametrize("weighting", ["identity", "interval"])
+def test_grouped_statistics_match_filtering(weighting):
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 4, size=(200, 4))
+    codes[rng.random((200, 4)) < 0.3] = -1
+    groups = rng.integers(0, 3, size=200)
+    categories = [0, 1, 2, 3]
+    weights = weight_matrix(categories, weighting)
+    dense = build_agreement_array(codes, len(categories))
+    rows, cols = np.nonzero(codes >= 0)
+    sparse = sparse_agreement_table(rows, codes[rows, cols], 200, len(categories))
+    for table in (dense, sparse):
+        statistics = grouped_agreement_statistics(
+            table, weights, groups, n_groups=4, chunk_size=64
+        )
+        assert statistics.shape == (4, 5 + 3 * len(categories))
+        for group in range(3):
+            np.testing.assert_allclose(
+                statistics[group],
+                agreement_statistics(dense[groups == group], weights),
+                atol=1e-9,
+            )
+        # Groups without examples have no statistics
+        assert not statistics[3].any()
+    per_group, overall = agreement_by_group(
+        codes, categories, groups, ["a", "b", "c"], weighting
+    )
+    expected = agreement_from_codes(codes, categories, weighting)
+    for key in ("percent_agreement", "kripp_alpha", "ac2", "n_examples"):
+        assert overall[key] == pytest.approx(expected[key])
+    for group, name in enumerate(["a", "b", "c"]):
+        expected = agreement_from_codes(codes[groups == group], categories, weighting)
+        for key in ("percent_agreement", "kripp_alpha", "ac2", "n_examples"):
+            assert per_group[name][key] == pytest.approx(expected[key])
+
+
+def test_multilabel_agreement_by_group():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 2, size=(100, 3, 4))
+    codes[rng.random((100, 3)) < 0.3] = -1
+    groups = rng.integers(0, 2, size=100)
+    labels = ["W", "X", "Y", "Z"]
+    per_group, overall = multilabel_agreement_by_group(
+        codes, labels, groups, ["a", "b"], chunk_size=32
+    )
+    for group, name in enumerate(["a", "b"]):
+        per_label, summary = agreement_from_multilabel_codes(
+            codes[groups == group], labels
+        )
+        assert per_group[name]["micro"]["kripp_alpha"] == pytest.approx(
+            summary["micro"]["kripp_alpha"]
+        )
+        for label in labels:
+            assert per_group[name]["per_label"][label]["ac2"] == pytest.approx(
+                per_label[label]["ac2"]
+            )
+    per_label, summary = agreement_from_multilabel_codes(codes, labels)
+    assert overall["macro"] == pytest.approx(summary["macro"])
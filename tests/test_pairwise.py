@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from prodigy_iaa.measures import calculate_agreement_vectorized, encode_reliability
+from prodigy_iaa.pairwise import pairwise_agreement, pairwise_records
+
+
+def squared_distance(k, l):
+    return 1 - (k - l) ** 2 / 9
+
+
+@pytest.mark.parametrize("weighting", ["identity", squared_distance])
+def test_pairwise_matches_two_column_agreement(reliability_data2, weighting):
+    codes, categories = encode_reliability(reliability_data2)
+    pairwise = pairwise_agreement(codes, categories, weighting=weighting)
+    n_annotators = codes.shape[1]
+    for a in range(n_annotators):
+        assert np.isnan(pairwise["kripp_alpha"][a, a])
+        for b in range(n_annotators):
+            if a == b:
+                continue
+            pair = [
+                [row[a], row[b]]
+                for row in reliability_data2
+                if row[a] is not None or row[b] is not None
+            ]
+            expected = calculate_agreement_vectorized(pair, weighting=weighting)
+            assert (
+                pairwise["n_coincident_examples"][a, b]
+                == expected["n_coincident_examples"]
+            )
+            for measure in ("percent_agreement", "kripp_alpha", "ac2"):
+                assert pairwise[measure][a, b] == pytest.approx(
+                    expected[measure], abs=1e-12
+                )
+
+
+def test_pairwise_records(reliability_data1):
+    codes, categories = encode_reliability(reliability_data1)
+    pairwise = pairwise_agreement(codes, categories)
+    records = list(pairwise_records(pairwise, ["A", "B", "C", "D"]))
+    assert len(records) == 6
+    assert records[0]["annotator_a"] == "A" and records[0]["annotator_b"] == "B"
+    assert records[0]["n_coincident_examples"] == 9
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from prodigy_iaa.measures import agreement_from_multilabel_codes
+from prodigy_iaa.parallel import map_shared, split_evenly
+
+
+def column_sum(array, column):
+    return int(array[:, column].sum())
+
+
+@pytest.mark.parametrize("n_process", [1, 2])
+def test_map_shared_order(n_process):
+    array = np.arange(40).reshape(10, 4)
+    result = map_shared(column_sum, array, [3, 0, 2, 1], n_process=n_process)
+    assert result == [array[:, c].sum() for c in (3, 0, 2, 1)]
+
+
+def test_split_evenly():
+    assert split_evenly(5, 2) == [slice(0, 2), slice(2, 5)]
+    assert split_evenly(2, 8) == [slice(0, 1), slice(1, 2)]
+    assert split_evenly(0, 4) == [slice(0, 0)]
+
+
+def test_multilabel_n_process():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 2, (500, 4, 7))
+    codes[rng.random((500, 4)) < 0.3] = -1
+    labels = [f"L{i}" for i in range(7)]
+    expected = agreement_from_multilabel_codes(codes, labels)
+    per_label, summary = agreement_from_multilabel_codes(codes, labels, n_process=3)
+    assert list(per_label) == labels
+    for label in labels:
+        assert per_label[label] == expected[0][label]
+    assert summary["micro"] == expected[1]["micro"]
@@ -0,0 +1,209 @@
+import pytest
+
+from prodigy_iaa.measures import calculate_agreement
+from prodigy_iaa.processors import (
+    datasets_to_annotations,
+    examples_to_codes,
+    examples_to_multilabel_codes,
+    examples_to_reliability,
+    get_group,
+)
+
+from .test_loaders import prodigy_sqlite_db
+
+
+def long_examples(reliability_data):
+    """Converts an (N x A) reliability matrix into binary-style prodigy examples."""
+    examples = []
+    for task_hash, row in enumerate(reliability_data):
+        for annotator, value in enumerate(row):
+            if value is None:
+                continue
+            examples.append(
+                {
+                    "_task_hash": task_hash,
+                    "_session_id": f"Annotator-{annotator}",
+                    "answer": value,
+                }
+            )
+    return examples
+
+
+def test_examples_to_codes(reliability_data1):
+    examples = long_examples(reliability_data1)
+    reliability = examples_to_codes(examples, value_getter=lambda eg: eg["answer"])
+    assert reliability.codes.shape == (12, 4)
+    assert reliability.categories == [1, 2, 3, 4, 5]
+    lookup = {a: i for i, a in enumerate(reliability.annotators)}
+    for task_hash, row in zip(reliability.examples, reliability.to_list()):
+        expected = reliability_data1[task_hash]
+        assert [row[lookup[f"Annotator-{a}"]] for a in range(4)] == expected
+
+
+def test_examples_to_codes_sparse(reliability_data1):
+    examples = long_examples(reliability_data1)
+    dense = examples_to_codes(examples, value_getter=lambda eg: eg["answer"])
+    sparse = examples_to_codes(
+        examples, value_getter=lambda eg: eg["answer"], sparse=True
+    )
+    assert sparse.codes.shape == (12, 4)
+    assert len(sparse.codes.rows) == len(examples)
+    assert sparse.codes.toarray().tolist() == dense.codes.tolist()
+    assert sparse.to_list() == dense.to_list()
+    reliability = examples_to_reliability(
+        examples, value_getter=lambda eg: eg["answer"], sparse=True
+    )
+    result = calculate_agreement(reliability)
+    expected = calculate_agreement(dense.to_list())
+    for key in ("percent_agreement", "kripp_alpha", "ac2", "n_examples"):
+        assert result[key] == pytest.approx(expected[key])
+
+
+def test_examples_to_codes_sparse_memory():
+    import tracemalloc
+
+    # 20k examples x 5k annotators, but only 60k annotations
+    examples = [
+        {"_task_hash": i // 3, "_session_id": (i * 7) % 5000, "answer": "accept"}
+        for i in range(60_000)
+    ]
+    tracemalloc.start()
+    try:
+        reliability = examples_to_codes(
+            examples, value_getter=lambda eg: eg["answer"], sparse=True
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert reliability.codes.shape == (20_000, 5000)
+    # The dense grid alone would be 800 MB
+    assert peak < 100 * 1024**2
+
+
+def test_examples_to_reliability_duplicates():
+    examples = [
+        {"_task_hash": 1, "_session_id": "a", "answer": "accept"},
+        {"_task_hash": 1, "_session_id": "b", "answer": "reject"},
+        {"_task_hash": 1, "_session_id": "a", "answer": "reject"},
+    ]
+    with pytest.raises(SystemExit):
+        examples_to_reliability(examples)
+    assert examples_to_reliability(examples[:2]) == [["accept", "reject"]]
+
+
+def test_examples_to_multilabel_codes():
+    examples = [
+        {"_task_hash": 1, "_session_id": "a", "accept": ["X", "Y"]},
+        {"_task_hash": 1, "_session_id": "b", "accept": ["Y", "Z"]},
+        {"_task_hash": 2, "_session_id": "b", "accept": []},
+    ]
+    reliability = examples_to_multilabel_codes(examples, ["X", "Y"])
+    assert reliability.codes.tolist() == [
+        [[1, 1], [0, 1]],
+        [[-1, -1], [0, 0]],
+    ]
+    assert reliability.examples == [1, 2]
+    assert reliability.annotators == ["a", "b"]
+
+
+def test_examples_to_codes_group_by():
+    examples = [
+        {
+            "_task_hash": 1,
+            "_session_id": "a",
+            "answer": "accept",
+            "meta": {"source": "y"},
+        },
+        {
+            "_task_hash": 1,
+            "_session_id": "b",
+            "answer": "reject",
+            "meta": {"source": "y"},
+        },
+        {
+            "_task_hash": 2,
+            "_session_id": "a",
+            "answer": "accept",
+            "meta": {"source": "x"},
+        },
+        {"_task_hash": 3, "_session_id": "a", "answer": "accept"},
+    ]
+    reliability = examples_to_codes(examples, sparse=True, group_by="meta.source")
+    assert reliability.group_values == [None, "x", "y"]
+    assert reliability.groups.tolist() == [2, 1, 0]
+    assert examples_to_codes(examples).groups is None
+    examples = [{"accept": [], **example} for example in examples]
+    multilabel = examples_to_multilabel_codes(examples, ["X"], group_by="meta.source")
+    assert multilabel.groups.tolist() == [2, 1, 0]
+
+
+def test_get_group():
+    example = {"meta": {"source": "x", "tags": ["a", "b"]}, "meta.source": "y"}
+    assert get_group(example, "meta.source") == "y"
+    assert get_group(example, "meta.tags") == ("a", "b")
+    assert get_group(example, "meta.missing") is None
+    assert get_group({"meta": "x"}, "meta.source") is None
+
+
+class LocalDatabase:
+    """Minimal stand-in for prodigy's `Database` around a SQLite connection."""
+
+    db_id = "sqlite"
+
+    def __init__(self, connection, names):
+        self.db = self
+        self._connection = connection
+        self._names = names
+
+    def connection(self):
+        return self._connection
+
+    def __contains__(self, name):
+        return name in self._names
+
+
+def test_datasets_to_annotations_sql(tmp_path):
+    annotator_a = [
+        {"_task_hash": i, "answer": "accept", "label": "L", "text": "..."}
+        for i in range(3)
+    ]
+    annotator_b = [
+        {"_task_hash": i, "answer": "reject" if i else "accept", "label": "L"}
+        for i in range(1, 4)
+    ]
+    connection = prodigy_sqlite_db(
+        tmp_path / "prodigy.db", {"a": annotator_a, "b": annotator_b}
+    )
+    DB = LocalDatabase(connection, ["a", "b"])
+    examples = datasets_to_annotations(["a", "b"], DB=DB)
+    reliability = examples_to_codes(examples, annotator_id="_dataset_id")
+    assert reliability.to_list() == [
+        ["accept", None],
+        ["accept", "reject"],
+        ["accept", "reject"],
+        [None, "reject"],
+    ]
+
+    annotator_b[0]["label"] = "OTHER"
+    connection = prodigy_sqlite_db(
+        tmp_path / "other.db", {"a": annotator_a, "b": annotator_b}
+    )
+    with pytest.raises(SystemExit):
+        datasets_to_annotations(["a", "b"], DB=LocalDatabase(connection, ["a", "b"]))
+
+
+def test_datasets_to_annotations_sql_group_by(tmp_path):
+    examples = [
+        {"_task_hash": i, "answer": "accept", "label": "L", "meta": {"source": s}}
+        for i, s in enumerate(["x", "y", "x"])
+    ]
+    connection = prodigy_sqlite_db(tmp_path / "prodigy.db", {"a": examples})
+    # `LocalDatabase` can't load full examples, so this only works in SQL
+    annotations = datasets_to_annotations(
+        ["a"], DB=LocalDatabase(connection, ["a"]), extra_keys=("meta.source",)
+    )
+    reliability = examples_to_codes(
+        annotations, annotator_id="_dataset_id", group_by="meta.source"
+    )
+    assert reliability.group_values == ["x", "y"]
+    assert reliability.groups.tolist() == [0, 1, 0]
@@ -0,0 +1,28 @@
+from prodigy_iaa.profiling import Profiler
+from prodigy_iaa.render import render_profile
+
+
+def test_profiler_stages():
+    finished = []
+    profiler = Profiler(callback=finished.append)
+    with profiler.stage("outer", count=3) as outer:
+        items = list(profiler.iterate("read", iter(range(5))))
+        with profiler.stage("inner", label="A") as inner:
+            inner["count"] = len(items)
+    assert [r["stage"] for r in profiler.records] == ["read", "inner", "outer"]
+    assert finished == profiler.records
+    assert profiler.records[0]["count"] == 5
+    assert inner["label"] == "A" and inner["count"] == 5
+    assert outer["count"] == 3
+    assert outer["seconds"] >= inner["seconds"] >= 0
+    if outer["peak_rss_mb"] is not None:
+        assert outer["peak_rss_mb"] >= inner["peak_rss_mb"] > 0
+    rendered = render_profile(profiler.records)
+    assert "inner (A)" in rendered and "Total" in rendered
+
+
+def test_disabled_profiler():
+    profiler = Profiler(enabled=False)
+    with profiler.stage("stage"):
+        assert list(profiler.iterate("read", range(3))) == [0, 1, 2]
+    assert profiler.records == []
@@ -5,8 +5,7 @@ import pytest
 import srsly
 from prodigy.util import set_hashes
 
-
-from prodigy_iaa import iaa_jsonl
+from prodigy_iaa import iaa_jsonl, iaa_shards, iaa_watch
 
 
 def prodigy_installed():
@@ -212,3 +211,204 @@ def test_jsonl_multilabel(multilabel_data_prodigy_json):
         [f"Label {i}" for i in range(4)],
         None,
     )
+
+
+@pytest.fixture
+def ner_data_prodigy_json(tmp_path):
+    spans = [
+        [("A", 0, 5), ("B", 10, 14)],
+        [("A", 0, 5), ("B", 11, 14)],
+        [("A", 0, 4)],
+    ]
+    lines = [
+        {
+            "text": "Hello world and more",
+            "_task_hash": 0,
+            "_session_id": f"Annotator-{a_i}",
+            "answer": "accept",
+            "spans": [{"start": s, "end": e, "label": l} for l, s, e in annotation],
+        }
+        for a_i, annotation in enumerate(spans)
+    ]
+    path = tmp_path / "ner.jsonl"
+    srsly.write_jsonl(path, lines)
+    yield path
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_ner(ner_data_prodigy_json, tmp_path):
+    pairwise_output = tmp_path / "pairwise.jsonl"
+    iaa_jsonl(ner_data_prodigy_json, "ner", [], None, pairwise_output=pairwise_output)
+    assert len(list(srsly.read_jsonl(pairwise_output))) == 3
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_contested(multiclass_data_prodigy_json, tmp_path):
+    contested_output = tmp_path / "contested.jsonl"
+    iaa_jsonl(
+        multiclass_data_prodigy_json,
+        "multiclass",
+        [],
+        None,
+        contested_output=contested_output,
+        top_k=2,
+    )
+    records = list(srsly.read_jsonl(contested_output))
+    assert [record["rank"] for record in records] == [1, 2]
+    assert records[0]["percent_agreement"] == 0
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_group_by(tmp_path, monkeypatch):
+    import prodigy_iaa.recipe
+
+    def ungrouped(*args, **kwargs):
+        raise AssertionError("Overall agreement should come from the groups")
+
+    # Per-group and overall statistics come from one pass
+    monkeypatch.setattr(prodigy_iaa.recipe, "agreement_from_codes", ungrouped)
+    lines = multiclass_df_to_prodigy(multiclass_data())
+    for line in lines:
+        line["meta"] = {"source": "first" if line["text"] < "Row 3" else "second"}
+    path = tmp_path / "multiclass.jsonl"
+    srsly.write_jsonl(path, lines)
+    group_output = tmp_path / "groups.json"
+    iaa_jsonl(
+        path, "multiclass", [], None, group_by="meta.source", group_output=group_output
+    )
+    result = srsly.read_json(group_output)
+    assert result["group_by"] == "meta.source"
+    assert [group["group"] for group in result["groups"]] == ["first", "second"]
+    assert [group["n_examples"] for group in result["groups"]] == [3, 2]
+    assert result["overall"]["n_examples"] == 5
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_multilabel_group_by(multilabel_data_prodigy_json, tmp_path):
+    group_output = tmp_path / "groups.json"
+    iaa_jsonl(
+        multilabel_data_prodigy_json,
+        "multilabel",
+        [f"Label {i}" for i in range(4)],
+        None,
+        group_by="text",
+        group_output=group_output,
+    )
+    result = srsly.read_json(group_output)
+    # Every group is a single example, so Alpha is undefined
+    assert len(result["groups"]) == 4
+    assert result["groups"][0]["per_label"]["Label 0"]["n_examples"] == 1
+    assert result["groups"][0]["macro"]["kripp_alpha"] is None
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_window(tmp_path):
+    lines = multiclass_df_to_prodigy(multiclass_data())
+    for line in lines:
+        # One example per day
+        line["_timestamp"] = 86400 * int(line["text"].split()[1])
+    path = tmp_path / "multiclass.jsonl"
+    srsly.write_jsonl(path, lines)
+    window_output = tmp_path / "windows.jsonl"
+    iaa_jsonl(
+        path,
+        "multiclass",
+        [],
+        None,
+        window="2d",
+        window_step="1d",
+        window_output=window_output,
+    )
+    records = list(srsly.read_jsonl(window_output))
+    assert [record["start"] for record in records] == [
+        -86400.0 + 86400 * i for i in range(6)
+    ]
+    assert [record["n_examples"] for record in records] == [1, 2, 2, 2, 2, 1]
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_watch(multiclass_data_prodigy_json, tmp_path):
+    output = tmp_path / "stats.json"
+    state_dir = tmp_path / "state"
+    iaa_watch(
+        multiclass_data_prodigy_json,
+        "multiclass",
+        state_dir=state_dir,
+        output=output,
+        max_refreshes=1,
+    )
+    stats = srsly.read_json(output)
+    assert stats["n_annotations"] == stats["n_new"] == 13
+    assert stats["n_examples"] == 5
+    iaa_watch(
+        multiclass_data_prodigy_json,
+        "multiclass",
+        state_dir=state_dir,
+        output=output,
+        max_refreshes=1,
+    )
+    assert srsly.read_json(output)["n_new"] == 0
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_shards(tmp_path, capsys):
+    lines = multiclass_df_to_prodigy(multiclass_data())
+    # Split by annotator, so every example is annotated in several shards
+    (tmp_path / "shards").mkdir()
+    for annotator in {line["_session_id"] for line in lines}:
+        shard = [line for line in lines if line["_session_id"] == annotator]
+        srsly.write_jsonl(tmp_path / "shards" / f"{annotator}.jsonl", shard)
+    profile = tmp_path / "profile.json"
+    iaa_shards(
+        str(tmp_path / "shards" / "*.jsonl"), "multiclass", None, profile=profile
+    )
+    assert "(3 shards)" in capsys.readouterr().out
+    record = srsly.read_json(profile)[0]
+    assert record["stage"] == "shards" and record["count"] == 3
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_numeric_weighting_needs_numeric_categories(
+    multiclass_data_prodigy_json, capsys
+):
+    with pytest.raises(SystemExit):
+        iaa_jsonl(
+            multiclass_data_prodigy_json, "multiclass", [], None, weighting="linear"
+        )
+    assert "numeric categories" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(
+    not PRODIGY_INSTALLED, reason="Prodigy not installed. Install locally and run test."
+)
+def test_jsonl_bootstrap_n_process(multiclass_data_prodigy_json, monkeypatch):
+    import prodigy_iaa.recipe
+
+    calls = []
+
+    def bootstrap(*args, **kwargs):
+        calls.append(kwargs["n_process"])
+        return None
+
+    monkeypatch.setattr(prodigy_iaa.recipe, "bootstrap_agreement", bootstrap)
+    iaa_jsonl(multiclass_data_prodigy_json, "multiclass", [], None, bootstrap=10)
+    iaa_jsonl(
+        multiclass_data_prodigy_json, "multiclass", [], None, bootstrap=10, n_process=2
+    )
+    assert calls == [1, 2]
@@ -0,0 +1,99 @@
+import json
+import random
+
+import pytest
+
+from prodigy_iaa.measures import agreement_from_codes
+from prodigy_iaa.processors import examples_to_codes, get_answer, get_choice
+from prodigy_iaa.shards import merge_shard_counts, shard_counts, sharded_agreement
+
+
+def make_examples(n_examples=60, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "_task_hash": task,
+            "_session_id": annotator,
+            "answer": rng.choice(["accept", "accept", "reject", "ignore"]),
+            "accept": [rng.choice("ABC")],
+        }
+        for task in range(n_examples)
+        for annotator in rng.sample("vwxyz", rng.randint(1, 4))
+    ]
+
+
+def write_shards(tmp_path, examples, n_shards):
+    # Shards by annotator, so most examples are split across shards
+    paths = [tmp_path / f"shard-{i}.jsonl" for i in range(n_shards)]
+    annotators = sorted({eg["_session_id"] for eg in examples})
+    for i, path in enumerate(paths):
+        with path.open("w", encoding="utf8") as f:
+            for eg in examples:
+                if annotators.index(eg["_session_id"]) % n_shards == i:
+                    f.write(json.dumps(eg) + "\n")
+    return paths
+
+
+@pytest.mark.parametrize("annotation_type", ["binary", "multiclass"])
+@pytest.mark.parametrize("weighting", ["identity", "ordinal"])
+@pytest.mark.parametrize("n_process", [1, 2])
+def test_sharded_agreement_matches_single_file(
+    tmp_path, annotation_type, weighting, n_process
+):
+    examples = make_examples()
+    paths = write_shards(tmp_path, examples, 3)
+    stats = sharded_agreement(
+        paths, annotation_type, weighting=weighting, n_process=n_process
+    )
+    value_getter = get_answer if annotation_type == "binary" else get_choice
+    reliability = examples_to_codes(examples, value_getter=value_getter)
+    expected = agreement_from_codes(
+        reliability.codes, reliability.categories, weighting=weighting
+    )
+    assert stats["n_shards"] == 3
+    for key in (
+        "n_examples",
+        "n_coincident_examples",
+        "n_annotators",
+        "n_single_annotation",
+    ):
+        assert stats[key] == expected[key]
+    for key in ("percent_agreement", "kripp_alpha", "ac2", "avg_raters_per_example"):
+        assert stats[key] == pytest.approx(expected[key])
+
+
+def test_merge_shard_counts_sums_split_examples(tmp_path):
+    examples = [
+        {"_task_hash": 1, "_session_id": "a", "answer": "accept"},
+        {"_task_hash": 2, "_session_id": "a", "answer": "reject"},
+        {"_task_hash": 1, "_session_id": "b", "answer": "accept"},
+        {"_task_hash": 1, "_session_id": "c", "answer": "reject"},
+    ]
+    paths = [tmp_path / "a.jsonl", tmp_path / "b.jsonl"]
+    for path, shard in zip(paths, [examples[:2], examples[2:]]):
+        path.write_text("".join(json.dumps(eg) + "\n" for eg in shard))
+    merged = merge_shard_counts([shard_counts(path, "binary") for path in paths])
+    assert merged.categories == ["accept", "reject"]
+    assert merged.annotators == ["a", "b", "c"]
+    assert merged.table.toarray().tolist() == [[2, 1], [0, 1]]
+
+
+def test_shard_counts_duplicate_annotations(tmp_path):
+    path = tmp_path / "shard.jsonl"
+    example = {"_task_hash": 1, "_session_id": "a", "answer": "accept"}
+    path.write_text(json.dumps(example) + "\n" + json.dumps(example) + "\n")
+    with pytest.raises(SystemExit):
+        shard_counts(path, "binary")
+
+
+def test_merge_shard_counts_duplicates_across_shards(tmp_path):
+    examples = [
+        {"_task_hash": 1, "_session_id": "a", "answer": "accept"},
+        {"_task_hash": 1, "_session_id": "b", "answer": "reject"},
+    ]
+    paths = [tmp_path / "a.jsonl", tmp_path / "b.jsonl"]
+    # The same annotation, exported to both shards
+    for path, shard in zip(paths, [examples, examples[:1]]):
+        path.write_text("".join(json.dumps(eg) + "\n" for eg in shard))
+    with pytest.raises(SystemExit):
+        sharded_agreement(paths, "binary")
@@ -0,0 +1,183 @@
+import random
+
+import numpy as np
+import pytest
+
+from prodigy_iaa.measures import calculate_agreement
+from prodigy_iaa.spans import (
+    examples_to_spans,
+    get_spans,
+    span_agreement,
+    span_pairwise_records,
+    token_agreement,
+)
+
+
+def random_span_examples(n_examples=40, n_annotators=4, seed=0):
+    rng = random.Random(seed)
+    examples = []
+    for i in range(n_examples):
+        length = rng.randint(0, 25)
+        for a in range(n_annotators):
+            if rng.random() > 0.6:
+                continue
+            spans = []
+            for _ in range(rng.randint(0, 5)):
+                start = rng.randint(0, max(length - 1, 0))
+                end = min(length, start + rng.randint(1, 5))
+                if end > start:
+                    spans.append(
+                        {"start": start, "end": end, "label": rng.choice("AB")}
+                    )
+            examples.append(
+                {
+                    "text": "x" * length,
+                    "_task_hash": i,
+                    "_session_id": f"annotator-{a}",
+                    "answer": rng.choice(["accept", "accept", "accept", "reject"]),
+                    "spans": spans,
+                }
+            )
+    return examples
+
+
+def annotation_sets(examples):
+    return {
+        (eg["_task_hash"], eg["_session_id"]): {
+            (span["start"], span["end"], span["label"]) for span in eg["spans"]
+        }
+        for eg in examples
+        if eg["answer"] == "accept"
+    }
+
+
+def matches(span, others, match):
+    if match == "exact":
+        return span in others
+    start, end, label = span
+    return any(o[2] == label and o[0] < end and start < o[1] for o in others)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_span_agreement_matches_all_pairs(seed):
+    examples = random_span_examples(seed=seed)
+    spans = examples_to_spans(examples)
+    result = span_agreement(spans)
+    annotations = annotation_sets(examples)
+    index = {annotator: a for a, annotator in enumerate(spans.annotators)}
+    n_annotators = len(index)
+    for match in ("exact", "overlap"):
+        matched = np.zeros((n_annotators, n_annotators))
+        totals = np.zeros((n_annotators, n_annotators))
+        for (example, annotator), own in annotations.items():
+            for other in spans.annotators:
+                if other == annotator or (example, other) not in annotations:
+                    continue
+                a, b = index[annotator], index[other]
+                for span in own:
+                    totals[a, b] += 1
+                    matched[a, b] += matches(span, annotations[example, other], match)
+        with np.errstate(invalid="ignore"):
+            precision = matched / totals
+        np.fill_diagonal(precision, np.nan)
+        np.testing.assert_allclose(result[match]["precision"], precision)
+        np.testing.assert_allclose(result[match]["recall"], precision.T)
+        assert result[match]["pooled_f1"] == pytest.approx(matched.sum() / totals.sum())
+    np.testing.assert_array_equal(result["n_spans"], totals)
+
+
+def test_token_agreement_matches_per_token_reliability():
+    examples = random_span_examples(seed=2)
+    spans = examples_to_spans(examples)
+    annotations = annotation_sets(examples)
+    lengths = {eg["_task_hash"]: len(eg["text"]) for eg in examples}
+    reliability = []
+    for example in spans.examples:
+        for token in range(lengths[example]):
+            row = []
+            for annotator in spans.annotators:
+                own = annotations.get((example, annotator))
+                if own is None:
+                    row.append(None)
+                    continue
+                labels = sorted({l for s, e, l in own if s <= token < e})
+                row.append("|".join(labels) if labels else "O")
+            reliability.append(row)
+    expected = calculate_agreement(reliability)
+    result = token_agreement(spans)
+    assert result["n_examples"] == expected["n_examples"]
+    for measure in ("percent_agreement", "kripp_alpha", "ac2"):
+        assert result[measure] == pytest.approx(expected[measure])
+
+
+def test_get_spans_tokens():
+    example = {
+        "text": "Hello Berlin and New York",
+        "answer": "accept",
+        "tokens": [{"id": i} for i in range(5)],
+        "spans": [
+            {"start": 6, "end": 12, "token_start": 1, "token_end": 1, "label": "GPE"},
+            {"start": 17, "end": 25, "token_start": 3, "token_end": 4, "label": "GPE"},
+        ],
+    }
+    assert get_spans(example) == (5, [(1, 2, "GPE"), (3, 5, "GPE")])
+    assert get_spans({**example, "answer": "reject"}) is None
+
+
+def test_span_pairwise_records():
+    examples = [
+        {
+            "_task_hash": 0,
+            "_session_id": "a",
+            "answer": "accept",
+            "text": "x" * 10,
+            "spans": [
+                {"start": 0, "end": 3, "label": "A"},
+                {"start": 5, "end": 8, "label": "A"},
+            ],
+        },
+        {
+            "_task_hash": 0,
+            "_session_id": "b",
+            "answer": "accept",
+            "text": "x" * 10,
+            "spans": [
+                {"start": 0, "end": 3, "label": "A"},
+                {"start": 6, "end": 9, "label": "A"},
+            ],
+        },
+        {
+            "_task_hash": 1,
+            "_session_id": "b",
+            "answer": "accept",
+            "text": "x",
+            "spans": [],
+        },
+    ]
+    spans = examples_to_spans(examples)
+    (record,) = span_pairwise_records(span_agreement(spans), spans.annotators)
+    assert record["n_spans_a"] == record["n_spans_b"] == 2
+    assert record["exact_f1"] == pytest.approx(0.5)
+    assert record["overlap_f1"] == pytest.approx(1.0)
+
+
+def test_token_agreement_label_named_like_outside():
+    examples = [
+        {
+            "_task_hash": 0,
+            "_session_id": "a",
+            "answer": "accept",
+            "text": "x" * 10,
+            "spans": [{"start": 0, "end": 3, "label": "O"}],
+        },
+        {
+            "_task_hash": 0,
+            "_session_id": "b",
+            "answer": "accept",
+            "text": "x" * 10,
+            "spans": [],
+        },
+    ]
+    result = token_agreement(examples_to_spans(examples))
+    assert result["percent_agreement"] == pytest.approx(0.7)
+    assert result["coincident_annotations_per_category"] == {"O": 3, None: 17}
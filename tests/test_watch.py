@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from prodigy_iaa.measures import agreement_from_codes
+from prodigy_iaa.processors import examples_to_codes, get_choice
+from prodigy_iaa.watch import JsonlWatcher
+
+
+def make_examples(n_examples=100, seed=0):
+    import random
+
+    rng = random.Random(seed)
+    return [
+        {
+            "_task_hash": task,
+            "_session_id": annotator,
+            "answer": "accept",
+            "accept": [rng.choice("ABC")],
+        }
+        for task in range(n_examples)
+        for annotator in rng.sample("wxyz", 2)
+    ]
+
+
+def write_lines(path, examples, mode="w", tail=""):
+    with path.open(mode, encoding="utf8") as f:
+        f.write("".join(json.dumps(eg) + "\n" for eg in examples) + tail)
+
+
+def expected_alpha(examples):
+    reliability = examples_to_codes(examples, value_getter=get_choice)
+    return agreement_from_codes(reliability.codes, reliability.categories)[
+        "kripp_alpha"
+    ]
+
+
+def test_watcher_reads_only_appended_lines(tmp_path):
+    path = tmp_path / "annotations.jsonl"
+    examples = make_examples()
+    write_lines(path, examples[:50])
+    watcher = JsonlWatcher(path, "multiclass")
+    assert watcher.refresh() == 50
+    assert watcher.refresh() == 0
+    # A line that's still being written is left for the next refresh
+    write_lines(path, examples[50:], mode="a", tail='{"_task_ha')
+    assert watcher.refresh() == len(examples) - 50
+    assert watcher.stats()["n_annotations"] == len(examples)
+    assert watcher.stats()["kripp_alpha"] == pytest.approx(expected_alpha(examples))
+    assert sorted(watcher.accumulator.categories) == ["A", "B", "C"]
+
+
+def test_watcher_resumes_from_state(tmp_path):
+    path = tmp_path / "annotations.jsonl"
+    state_dir = tmp_path / "state"
+    examples = make_examples()
+    write_lines(path, examples[:80])
+    assert JsonlWatcher(path, "multiclass", state_dir=state_dir).refresh() == 80
+    write_lines(path, examples[80:], mode="a")
+    watcher = JsonlWatcher(path, "multiclass", state_dir=state_dir)
+    assert len(watcher.accumulator) == 80
+    assert watcher.refresh() == len(examples) - 80
+    assert watcher.stats()["kripp_alpha"] == pytest.approx(expected_alpha(examples))
+    # Other settings don't reuse the state
+    other = JsonlWatcher(path, "multiclass", ["A", "B", "C"], state_dir=state_dir)
+    assert len(other.accumulator) == 0
+
+
+def test_watcher_rewritten_file_and_replaced_answers(tmp_path):
+    path = tmp_path / "annotations.jsonl"
+    examples = make_examples()
+    write_lines(path, examples)
+    watcher = JsonlWatcher(path, "multiclass", state_dir=tmp_path / "state")
+    watcher.refresh()
+    write_lines(path, examples[:10])
+    assert watcher.refresh() == 10
+    assert len(watcher.accumulator) == 10
+    # Annotating an example again replaces the earlier answer
+    changed = [dict(eg, accept=["D"]) for eg in examples[:2]]
+    write_lines(path, changed, mode="a")
+    assert watcher.refresh() == 2
+    assert len(watcher.accumulator) == 10
+    assert watcher.stats()["kripp_alpha"] == pytest.approx(
+        expected_alpha(changed + examples[2:10])
+    )
+
+
+def test_watcher_invalid_type(tmp_path):
+    with pytest.raises(ValueError):
+        JsonlWatcher(tmp_path / "annotations.jsonl", "multilabel")
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from prodigy_iaa.measures import SparseReliability, agreement_from_codes
+from prodigy_iaa.processors import examples_to_codes
+from prodigy_iaa.windows import parse_duration, windowed_agreement
+
+DAY = 86400
+
+
+def random_timed_codes(seed=0, n_examples=300, n_annotators=5):
+    rng = np.random.default_rng(seed)
+    codes = rng.integers(0, 3, size=(n_examples, n_annotators))
+    codes[rng.random(codes.shape) < 0.4] = -1
+    times = rng.uniform(0, 30 * DAY, size=codes.shape)
+    # Some ties and annotations without a time
+    times[:30] = times[:30].round(-5)
+    times[rng.random(codes.shape) < 0.05] = np.nan
+    return codes, times
+
+
+@pytest.mark.parametrize("weighting", ["identity", "quadratic"])
+@pytest.mark.parametrize("window,step", [("7d", None), ("7d", "1d"), ("3d", "5d")])
+def test_windows_match_recompute(window, step, weighting):
+    codes, times = random_timed_codes()
+    categories = [0, 1, 2]
+    records = windowed_agreement(codes, categories, times, window, step, weighting)
+    assert records[0]["start"] <= np.nanmin(times) < records[0]["end"]
+    assert records[-1]["start"] <= np.nanmax(times) < records[-1]["end"]
+    assert records[1]["start"] - records[0]["start"] == parse_duration(step or window)
+    for record in records:
+        in_window = (times >= record["start"]) & (times < record["end"])
+        window_codes = np.where(in_window, codes, -1)
+        window_codes = window_codes[(window_codes >= 0).any(axis=1)]
+        expected = agreement_from_codes(window_codes, categories, weighting)
+        for key in ("percent_agreement", "kripp_alpha", "ac2"):
+            assert record[key] == pytest.approx(expected[key], abs=1e-9, nan_ok=True)
+        for key in ("n_examples", "n_coincident_examples"):
+            assert record[key] == expected[key]
+        annotators = np.unique(np.nonzero(in_window & (codes >= 0))[1])
+        assert record["n_annotators"] == len(annotators)
+
+
+def test_windows_sparse_matches_dense():
+    codes, times = random_timed_codes(seed=1)
+    sparse = SparseReliability.from_codes(codes, [0, 1, 2])
+    dense = windowed_agreement(codes, [0, 1, 2], times, "5d", "2d")
+    result = windowed_agreement(
+        sparse, [0, 1, 2], times[sparse.rows, sparse.cols], "5d", "2d"
+    )
+    assert [r["start"] for r in result] == [r["start"] for r in dense]
+    for record, expected in zip(result, dense):
+        assert record["kripp_alpha"] == pytest.approx(
+            expected["kripp_alpha"], nan_ok=True
+        )
+
+
+def test_examples_to_codes_times():
+    examples = [
+        {"_task_hash": 1, "_session_id": "a", "answer": "accept", "_timestamp": 10},
+        {"_task_hash": 1, "_session_id": "b", "answer": "reject", "_timestamp": 20},
+        {"_task_hash": 2, "_session_id": "a", "answer": "accept"},
+    ]
+    sparse = examples_to_codes(examples, sparse=True, time_key="_timestamp")
+    assert sparse.times.tolist()[:2] == [10, 20]
+    assert np.isnan(sparse.times[2])
+    dense = examples_to_codes(examples, time_key="_timestamp")
+    assert dense.times[0].tolist() == [10, 20]
+    records = windowed_agreement(sparse.codes, sparse.categories, sparse.times, 15)
+    assert [record["n_examples"] for record in records] == [1, 1]
+    assert examples_to_codes(examples).times is None
+
+
+def test_parse_duration():
+    assert parse_duration("90m") == 5400
+    assert parse_duration("2w") == 14 * DAY
+    assert parse_duration("3600") == parse_duration(3600) == 3600
+    for duration in ("7x", "d", "-1d", 0):
+        with pytest.raises(ValueError):
+            parse_duration(duration)